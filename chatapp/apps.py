@@ -1,6 +1,14 @@
+import threading
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ChatappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatapp'
+    
+    def ready(self):
+        # Pre-load the embedding model when a worker starts instead of on the first request
+        if settings.EMBEDDING_WARMUP:
+            from .embeddings import warm_up_embedding_model
+            threading.Thread(target=warm_up_embedding_model, daemon=True, name='embedding-warmup').start()
@@ -1,12 +1,282 @@
+import asyncio
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+import json
 import logging
 import time
 import random
 import os
+import hashlib
+import threading
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from typing import List, Optional
 
+from django.conf import settings
+
+from utils.hashing import chunk_hash
+from utils.slicing import iter_slices_for_upload, slice_for_upload
+from utils.transport import (
+    JSON_TYPE, MSGPACK_TYPE, deserialize, encode_body, negotiate, supported_encodings, supported_formats
+)
+
 logger = logging.getLogger(__name__)
 
+_sessions = {}
+_clients = {}
+_async_sessions = weakref.WeakKeyDictionary()  # Event loop -> {api_url: httpx.AsyncClient}
+_session_lock = threading.Lock()
+_client_lock = threading.Lock()
+
+
+def get_session(api_url: str) -> requests.Session:
+    """
+    Shared keep-alive session for an API URL.
+    
+    The underlying urllib3 pool is thread-safe, so one session serves every
+    view and background task in the process.
+    """
+    api_url = api_url.rstrip('/')
+    with _session_lock:
+        session = _sessions.get(api_url)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=settings.COLAB_POOL_CONNECTIONS,
+                pool_maxsize=settings.COLAB_POOL_MAXSIZE,
+                pool_block=settings.COLAB_POOL_BLOCK
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[api_url] = session
+        return session
+
+
+def get_async_session(api_url: str) -> httpx.AsyncClient:
+    """
+    Shared keep-alive httpx.AsyncClient for an API URL.
+    
+    httpx connections belong to the event loop that opened them, so clients are
+    kept per running loop; under ASGI that is one client per URL for the life
+    of the process.
+    """
+    api_url = api_url.rstrip('/')
+    loop = asyncio.get_running_loop()
+    with _session_lock:
+        sessions = _async_sessions.setdefault(loop, {})
+        session = sessions.get(api_url)
+        if session is None or session.is_closed:
+            session = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=settings.COLAB_POOL_MAXSIZE,
+                max_keepalive_connections=settings.COLAB_POOL_MAXSIZE
+            ))
+            sessions[api_url] = session
+        return session
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling the API while its circuit breaker is open"""
+
+
+class HealthMonitor:
+    """
+    Cached API health with a circuit breaker.
+    
+    Health results are reused for ``ttl`` seconds; once stale the last result is
+    still returned while a background thread refreshes it. Every request outcome
+    is recorded, and ``failure_threshold`` consecutive failures open the circuit
+    for ``reset_timeout`` seconds, after which a single trial request is allowed.
+    """
+    
+    def __init__(self, probe, ttl=None, failure_threshold=None, reset_timeout=None):
+        """
+        Args:
+            probe: Function returning (is_healthy, model_info) from the API
+            ttl: Seconds a health result is considered fresh (defaults to settings.COLAB_HEALTH_TTL)
+            failure_threshold: Consecutive failures that open the circuit (defaults to settings.COLAB_BREAKER_FAILURES)
+            reset_timeout: Seconds the circuit stays open before a trial request (defaults to settings.COLAB_BREAKER_RESET)
+        """
+        self.probe = probe
+        self.ttl = settings.COLAB_HEALTH_TTL if ttl is None else ttl
+        self.failure_threshold = settings.COLAB_BREAKER_FAILURES if failure_threshold is None else failure_threshold
+        self.reset_timeout = settings.COLAB_BREAKER_RESET if reset_timeout is None else reset_timeout
+        
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._status = None
+        self._checked_at = 0.0
+        self._refresh_thread = None
+        self._lock = threading.Lock()
+    
+    @property
+    def is_open(self) -> bool:
+        """Whether requests are currently being refused"""
+        with self._lock:
+            return self._refuses_requests()
+    
+    def _refuses_requests(self) -> bool:
+        if self.opened_at is None:
+            return False
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return True
+        # Half-open: let one trial request through
+        return self._trial_in_flight
+    
+    def before_request(self):
+        """Raise CircuitOpenError if the API should not be called right now"""
+        with self._lock:
+            if self._refuses_requests():
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+                raise CircuitOpenError(
+                    f"Connection to the Colab API suspended after {self.consecutive_failures} "
+                    f"consecutive failures (retrying in {retry_in:.0f}s)"
+                )
+            if self.opened_at is not None:
+                self._trial_in_flight = True
+    
+    def record_success(self, model_info=None):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Colab API recovered, closing circuit breaker")
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+            if model_info is not None:
+                self._status = (True, model_info)
+                self._checked_at = time.monotonic()
+            elif self._status is not None and not self._status[0]:
+                # A cached failure is out of date; probe again on next use
+                self._status = None
+    
+    def record_failure(self, reason=None):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Opening circuit breaker after {self.consecutive_failures} consecutive failures")
+                self.opened_at = time.monotonic()
+            if reason is not None:
+                self._status = (False, reason)
+                self._checked_at = time.monotonic()
+    
+    def status(self, force=False) -> tuple:
+        """
+        Return (is_healthy, model_info), probing the API only when needed.
+        
+        Args:
+            force: Probe the API now instead of using the cached result
+        """
+        with self._lock:
+            cached = self._status
+            age = time.monotonic() - self._checked_at
+            if self._refuses_requests() and not force:
+                return False, "Circuit breaker open"
+        
+        if cached is None or force:
+            return self._refresh()
+        if age >= self.ttl:
+            self._refresh_in_background()
+        return cached
+    
+    def _refresh(self) -> tuple:
+        try:
+            is_healthy, model_info = self.probe()
+        except Exception as e:
+            is_healthy, model_info = False, str(e)
+        
+        if is_healthy:
+            self.record_success(model_info)
+        else:
+            self.record_failure(model_info)
+        return is_healthy, model_info
+    
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self._refresh, daemon=True)
+            self._refresh_thread.start()
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "healthy": self._status[0] if self._status else None,
+                "checked_seconds_ago": round(time.monotonic() - self._checked_at, 1) if self._status else None,
+                "circuit_open": self._refuses_requests(),
+                "consecutive_failures": self.consecutive_failures
+            }
+
+
+def slice_id(document_id: str, slice_number: int, text: str) -> str:
+    """Stable ID of an upload slice, so the API can recognise a retried slice"""
+    return f"{document_id}-{slice_number}-{hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}"
+
+
+class UploadCheckpoint:
+    """
+    Slices of a document upload that the API has already indexed.
+    
+    Saved as JSON after every slice, so an interrupted upload resumes with the
+    slices that are still missing. A checkpoint for different content is ignored.
+    """
+    
+    def __init__(self, path: str, content_hash: str):
+        self.path = path
+        self.content_hash = content_hash
+        self.slices = {}
+        self._lock = threading.Lock()
+        
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    saved = json.load(f)
+                if saved.get("content_hash") == content_hash:
+                    self.slices = saved.get("slices", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable upload checkpoint {path}: {str(e)}")
+    
+    @classmethod
+    def for_document(cls, document_id: str, user_id: str, content: str = None, content_hash: str = None) -> 'UploadCheckpoint':
+        """Checkpoint of a document's upload, keyed by its text or (for streamed files) the file hash"""
+        path = os.path.join(settings.COLAB_UPLOAD_CHECKPOINT_DIR, f"user_{user_id}_doc_{document_id}.json")
+        return cls(path, content_hash or hashlib.sha256(content.encode('utf-8')).hexdigest())
+    
+    def __contains__(self, slice_id):
+        return slice_id in self.slices
+    
+    def record(self, slice_id: str, chunks: int):
+        with self._lock:
+            self.slices[slice_id] = chunks
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w") as f:
+                json.dump({"content_hash": self.content_hash, "slices": self.slices}, f)
+            os.replace(temporary_path, self.path)
+    
+    def total_chunks(self) -> int:
+        return sum(self.slices.values())
+    
+    def clear(self):
+        with self._lock:
+            self.slices = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def get_colab_client(api_url: str) -> 'ColabClient':
+    """Shared ColabClient for an API URL, created on first use"""
+    api_url = api_url.rstrip('/')
+    with _client_lock:
+        client = _clients.get(api_url)
+        if client is None:
+            client = ColabClient(api_url=api_url)
+            _clients[api_url] = client
+        return client
+
+
 class ColabClient:
     def __init__(self, api_url: str):
         """
@@ -18,26 +288,45 @@ class ColabClient:
         self.api_url = api_url.rstrip('/')
         self.max_retries = 3
         self.base_retry_delay = 2  # seconds
+        self.session = get_session(self.api_url)
+        self.health = HealthMonitor(self._probe_health)
+        self.transport = None  # Body formats and encodings the API accepts, learned from its health check
+        self.embedding_model = None  # Model the API embeds queries with, learned from its health check
+        self.embedding_backend = None  # And the backend running it ('pytorch', 'onnx-int8')
         logger.info(f"ColabClient initialized with API URL: {self.api_url}")
     
-    def check_health(self) -> tuple:
+    def check_health(self, force: bool = False) -> tuple:
         """
-        Check if the API is healthy.
+        Check if the API is healthy, using the cached result while it is fresh.
+        
+        Args:
+            force: Probe the API now instead of using the cached result
         
         Returns:
             Tuple of (is_healthy, model_info)
         """
+        return self.health.status(force=force)
+    
+    def _probe_health(self) -> tuple:
+        """Single health request to the API, without retries"""
         try:
-            result = self._make_api_request(
-                endpoint="healthcheck",
-                payload={},
-                method='get',
-                timeout=5
-            )
+            response = self.session.get(f"{self.api_url}/healthcheck", timeout=5)
+            if response.status_code != 200:
+                return False, f"API returned status {response.status_code}"
             
+            result = response.json()
             is_healthy = result.get("status") == "ok"
             model_info = result.get("model", "unknown")
             
+            # APIs without compression support don't advertise it; requests then stay plain JSON
+            transport = result.get("transport")
+            self.transport = transport if isinstance(transport, dict) else None
+            embedding_model = result.get("embedding_model")
+            self.embedding_model = embedding_model if isinstance(embedding_model, str) else None
+            # APIs that don't report a backend embed with PyTorch
+            embedding_backend = result.get("embedding_backend")
+            self.embedding_backend = embedding_backend if isinstance(embedding_backend, str) else "pytorch"
+            
             return is_healthy, model_info
         
         except Exception as e:
@@ -61,40 +350,59 @@ class ColabClient:
         url = f"{self.api_url}/{endpoint}"
         
         for attempt in range(self.max_retries):
+            # Fail fast while the API is known to be down
+            self.health.before_request()
+            
             try:
                 # Make the request
-                if method.lower() == 'post':
-                    response = requests.post(url, json=payload, timeout=timeout)
+                if method.lower() == 'post' and self.transport:
+                    body, headers = self._encode_payload(payload)
+                    response = self.session.post(url, data=body, headers=headers, timeout=timeout)
+                elif method.lower() == 'post':
+                    response = self.session.post(url, json=payload, timeout=timeout)
                 else:
                     # Use params for GET requests if provided, otherwise use payload as params
-                    response = requests.get(url, params=params if params else payload, timeout=timeout)
+                    response = self.session.get(url, params=params if params else payload, headers=self._accept_headers(), timeout=timeout)
                 
                 # Log the request for debugging
                 logger.debug(f"{method.upper()} {url} - Status: {response.status_code}")
                 
                 if response.status_code == 200:
-                    return response.json()
+                    self.health.record_success()
+                    return self._decode_response(response)
                 
-                # Non-200 responses
+                # Non-200 responses; only server errors count against the API's health
+                if response.status_code >= 500:
+                    self.health.record_failure()
+                else:
+                    self.health.record_success()
                 logger.warning(f"API returned non-200 status: {response.status_code} - {response.text}")
                 response.raise_for_status()
             
             except requests.exceptions.Timeout:
+                self.health.record_failure("Request timed out")
                 logger.warning(f"Request timed out (attempt {attempt+1}/{self.max_retries})")
-                if attempt < self.max_retries - 1:
+                if attempt < self.max_retries - 1 and not self.health.is_open:
                     retry_delay = self.base_retry_delay * (attempt + 1) + random.uniform(0, 1)
                     logger.info(f"Retrying in {retry_delay:.1f} seconds...")
                     time.sleep(retry_delay)
+                elif self.health.is_open:
+                    logger.error("Circuit breaker open, not retrying timeout")
+                    raise
                 else:
                     logger.error("Maximum retries reached for timeout")
                     raise
             
             except requests.exceptions.ConnectionError as e:
+                self.health.record_failure(str(e))
                 logger.warning(f"Connection error: {str(e)} (attempt {attempt+1}/{self.max_retries})")
-                if attempt < self.max_retries - 1:
+                if attempt < self.max_retries - 1 and not self.health.is_open:
                     retry_delay = self.base_retry_delay * (attempt + 1) + random.uniform(0, 1)
                     logger.info(f"Retrying in {retry_delay:.1f} seconds...")
                     time.sleep(retry_delay)
+                elif self.health.is_open:
+                    logger.error("Circuit breaker open, not retrying connection error")
+                    raise
                 else:
                     logger.error("Maximum retries reached for connection error")
                     raise
@@ -106,6 +414,31 @@ class ColabClient:
         # If we get here, all retries failed (this should not be reachable with current logic)
         raise Exception(f"Failed to get successful response from {url} after {self.max_retries} attempts")
     
+    def _accept_headers(self) -> dict:
+        """Ask for msgpack responses when both sides support it"""
+        if self.transport and negotiate(self.transport.get("formats", []), supported_formats()) == MSGPACK_TYPE:
+            return {"Accept": f"{MSGPACK_TYPE}, {JSON_TYPE}"}
+        return {}
+    
+    def _encode_payload(self, payload: dict) -> tuple:
+        """
+        Encode a request body in the best format and compression both sides support.
+        
+        Returns:
+            Tuple of (body bytes, request headers)
+        """
+        content_type = negotiate(self.transport.get("formats", []), supported_formats()) or JSON_TYPE
+        encoding = negotiate(self.transport.get("encodings", []), supported_encodings())
+        body, headers = encode_body(payload, content_type=content_type, encoding=encoding)
+        return body, {**headers, **self._accept_headers()}
+    
+    @staticmethod
+    def _decode_response(response) -> dict:
+        """Response body as a dictionary; requests already undoes any Content-Encoding"""
+        if response.headers.get("Content-Type") == MSGPACK_TYPE:
+            return deserialize(response.content, MSGPACK_TYPE)
+        return response.json()
+    
     def process_document(self, document_id: str, content: str, user_id: str) -> int:
         """
         Process a document through the Colab API.
@@ -120,7 +453,7 @@ class ColabClient:
         """
         try:
             # For large documents, process in chunks to avoid timeout
-            max_chunk_size = 20000  # Process 20K characters at once
+            max_chunk_size = settings.COLAB_UPLOAD_SLICE_CHARS
             chunks_created = 0
             
             logger.info(f"Processing document {document_id} for user {user_id}")
@@ -172,37 +505,12 @@ class ColabClient:
                     chunks_created = result.get("chunks", 0)
                     
             else:
-                # For large content, process in chunks
+                # For large content, upload slices in parallel, skipping any a previous attempt finished
                 logger.info(f"Processing large document of {len(content)} characters in chunks")
                 
-                # Process multiple chunks
-                for i in range(0, len(content), max_chunk_size):
-                    chunk = content[i:i + max_chunk_size]
-                    
-                    payload = {
-                        "text": chunk,
-                        "document_id": document_id,
-                        "user_id": user_id,
-                        "chunk_number": i // max_chunk_size,
-                        "is_partial": True
-                    }
-                    
-                    # Process this chunk
-                    result = self._make_api_request(
-                        endpoint="process_document",
-                        payload=payload,
-                        timeout=120
-                    )
-                    
-                    # Track chunks created
-                    chunk_count = result.get("chunks", 0)
-                    chunks_created += chunk_count
-                    
-                    logger.info(f"Processed chunk {i // max_chunk_size + 1}, created {chunk_count} chunks")
-                    
-                    # Small delay between chunks
-                    if i + max_chunk_size < len(content):
-                        time.sleep(2)
+                checkpoint = UploadCheckpoint.for_document(document_id, user_id, content)
+                self._upload_slices(document_id, user_id, slice_for_upload(content, max_chars=max_chunk_size), checkpoint)
+                chunks_created = checkpoint.total_chunks()
                 
                 # Finalize the document
                 payload = {
@@ -216,6 +524,7 @@ class ColabClient:
                     payload=payload,
                     timeout=30
                 )
+                checkpoint.clear()
             
             logger.info(f"Document {document_id} processed with {chunks_created} chunks")
             return chunks_created
@@ -224,6 +533,360 @@ class ColabClient:
             logger.error(f"Error processing document {document_id}: {str(e)}")
             raise Exception(f"Failed to process document: {str(e)}")
 
+    def process_document_pages(self, document_id: str, pages, user_id: str, content_hash: str) -> int:
+        """
+        Process a document whose text arrives page by page (e.g. a streamed PDF).
+        
+        Slices are cut and uploaded while later pages are still being extracted,
+        so neither side holds the whole text.
+        
+        Args:
+            document_id: The document ID
+            pages: Iterable of page texts, in order
+            user_id: The user ID
+            content_hash: Hash of the file, identifying its upload checkpoint
+            
+        Returns:
+            The number of chunks created (0 if the pages hold no text)
+        """
+        try:
+            logger.info(f"Processing streamed document {document_id} for user {user_id}")
+            
+            checkpoint = UploadCheckpoint.for_document(document_id, user_id, content_hash=content_hash)
+            slices = iter_slices_for_upload(pages, max_chars=settings.COLAB_UPLOAD_SLICE_CHARS)
+            if not self._upload_slices(document_id, user_id, slices, checkpoint):
+                return 0
+            chunks_created = checkpoint.total_chunks()
+            
+            self._make_api_request(
+                endpoint="finalize_document",
+                payload={
+                    "document_id": document_id,
+                    "user_id": user_id,
+                    "finalize": True
+                },
+                timeout=30
+            )
+            checkpoint.clear()
+            
+            logger.info(f"Document {document_id} processed with {chunks_created} chunks")
+            return chunks_created
+            
+        except Exception as e:
+            logger.error(f"Error processing document {document_id}: {str(e)}")
+            raise Exception(f"Failed to process document: {str(e)}")
+    
+    def _upload_slices(self, document_id: str, user_id: str, slices, checkpoint: UploadCheckpoint) -> int:
+        """
+        Send the slices of a large document with bounded concurrency.
+        
+        Slices are cut on chunk boundaries (see utils.slicing), so the API builds
+        the same chunks as from the whole text. Each slice carries a stable
+        slice_id, so a slice that is sent twice is only indexed once. Finished
+        slices are recorded in the checkpoint as they complete; if any slice
+        fails, the rest are cancelled and the error raised. ``slices`` may be a
+        generator: at most twice the concurrency of slices are held at once.
+        
+        Returns:
+            The number of slices in the document, including ones already done
+        """
+        concurrency = max(1, settings.COLAB_UPLOAD_CONCURRENCY)
+        
+        def upload(number, piece, sid):
+            result = self._make_api_request(
+                endpoint="process_document",
+                payload={
+                    "text": piece["text"],
+                    "document_id": document_id,
+                    "user_id": user_id,
+                    "chunk_number": number,
+                    "slice_id": sid,
+                    "owned": piece["owned"],
+                    "first_chunk": piece["first_chunk"],
+                    "is_partial": True
+                },
+                timeout=120
+            )
+            return result.get("chunks", 0)
+        
+        def collect(future):
+            number, sid = futures.pop(future)
+            chunk_count = future.result()
+            checkpoint.record(sid, chunk_count)
+            logger.info(f"Processed slice {number + 1}, created {chunk_count} chunks")
+        
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        futures = {}
+        total = skipped = 0
+        try:
+            for number, piece in enumerate(slices):
+                total += 1
+                sid = slice_id(document_id, number, piece["text"])
+                if sid in checkpoint:
+                    skipped += 1
+                    continue
+                futures[executor.submit(upload, number, piece, sid)] = (number, sid)
+                # Don't read further ahead than the uploads can keep up with
+                while len(futures) >= 2 * concurrency:
+                    done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+            for future in as_completed(list(futures)):
+                collect(future)
+        except Exception:
+            # Don't start slices that haven't begun, but keep those that finished meanwhile
+            executor.shutdown(wait=True, cancel_futures=True)
+            for future, (_, sid) in futures.items():
+                if not future.cancelled() and future.exception() is None:
+                    checkpoint.record(sid, future.result())
+            raise
+        finally:
+            executor.shutdown(wait=True)
+        
+        if skipped:
+            logger.info(f"Resumed upload of document {document_id}: {skipped} of {total} slices were already done")
+        return total
+    
+    def reindex_document(self, document_id: str, content: str, user_id: str) -> dict:
+        """
+        Incrementally re-index a document through the Colab API.
+        
+        Only chunks whose content hash is not already stored are embedded; chunks
+        that no longer exist in the content are deleted.
+        
+        Args:
+            document_id: The document ID
+            content: The new document content
+            user_id: The user ID
+            
+        Returns:
+            Dictionary with the chunks, added, reused and deleted counts
+        """
+        max_chunk_size = settings.COLAB_UPLOAD_SLICE_CHARS  # Same request size limit as process_document
+        totals = {"chunks": 0, "added": 0, "reused": 0, "deleted": 0}
+        
+        slices = slice_for_upload(content, max_chars=max_chunk_size)
+        is_partial = len(slices) > 1
+        
+        logger.info(f"Re-indexing document {document_id} for user {user_id} in {len(slices)} request(s)")
+        
+        try:
+            for slice_number, piece in enumerate(slices):
+                result = self._make_api_request(
+                    endpoint="reindex_document",
+                    payload={
+                        "text": piece["text"],
+                        "document_id": document_id,
+                        "user_id": user_id,
+                        "chunk_number": slice_number,
+                        "owned": piece["owned"],
+                        "first_chunk": piece["first_chunk"],
+                        "is_partial": is_partial
+                    },
+                    timeout=120
+                )
+                for key in ("chunks", "added", "reused", "deleted"):
+                    totals[key] += result.get(key, 0)
+            
+            if is_partial:
+                # Stale chunks are removed once the API has seen every slice
+                result = self._make_api_request(
+                    endpoint="finalize_document",
+                    payload={
+                        "document_id": document_id,
+                        "user_id": user_id,
+                        "finalize": True,
+                        "reindex": True
+                    },
+                    timeout=30
+                )
+                totals["chunks"] = result.get("chunks", totals["chunks"])
+                totals["deleted"] += result.get("deleted", 0)
+            
+            logger.info(f"Document {document_id} re-indexed: {totals}")
+            return totals
+            
+        except Exception as e:
+            logger.error(f"Error re-indexing document {document_id}: {str(e)}")
+            raise Exception(f"Failed to re-index document: {str(e)}")
+    
+    def accepts_vectors_from(self, backend: str) -> bool:
+        """Whether the API stores vectors embedded here with ``backend``: same model and backend as its queries"""
+        return bool(self.embedding_model) and self.embedding_backend == backend
+    
+    def upsert_vectors(self, document_id: str, user_id: str, model_name: str, ids: list, vectors: list,
+                       texts: list, metadatas: list, is_partial: bool = False, backend: str = "pytorch",
+                       batch_number: int = 0) -> dict:
+        """
+        Store chunks that were chunked and embedded on this side.
+        
+        Args:
+            document_id: The document ID
+            user_id: The user ID
+            model_name: Embedding model the vectors were made with; must be the API's
+            ids: Chunk IDs
+            vectors: One embedding per chunk
+            texts: Chunk texts
+            metadatas: Chunk metadata
+            is_partial: More batches of the document follow (stale chunks are removed on finalize)
+            backend: Backend the vectors were made with; must be the API's
+            batch_number: Position of this batch in the upload; batch 0 starts a new one
+            
+        Returns:
+            Dictionary with the chunks, added, reused and deleted counts
+        """
+        return self._make_api_request(
+            endpoint="upsert_vectors",
+            payload={
+                "document_id": document_id,
+                "user_id": user_id,
+                "model": model_name,
+                "backend": backend,
+                "ids": ids,
+                "embeddings": vectors,
+                "texts": texts,
+                "metadatas": metadatas,
+                "is_partial": is_partial,
+                "batch_number": batch_number
+            },
+            timeout=120
+        )
+    
+    def ingest_chunks(self, document_id: str, user_id: str, chunks, embedding_model, model_name: str,
+                      backend: str = "pytorch", batch_size: int = None) -> int:
+        """
+        Embed a document's chunks locally and send the API only their vectors.
+        
+        Chunks are consumed, embedded and sent one batch at a time, so a chunk
+        generator (e.g. file_processor.iter_document_chunks) is never held whole.
+        
+        Args:
+            document_id: The document ID
+            user_id: The user ID
+            chunks: Iterable of LangChain documents
+            embedding_model: Embeddings object to embed the chunks with
+            model_name: Name of that model, checked against the API's
+            backend: Backend embedding_model runs on, checked against the API's
+            batch_size: Chunks embedded and sent per request (defaults to settings.COLAB_UPSERT_BATCH_SIZE)
+            
+        Returns:
+            The number of chunks stored
+        """
+        try:
+            stored = 0
+            batches = iter_vector_batches(document_id, chunks, embedding_model, batch_size)
+            for batch_number, (ids, vectors, texts, metadatas) in enumerate(batches):
+                self.upsert_vectors(
+                    document_id=document_id,
+                    user_id=user_id,
+                    model_name=model_name,
+                    ids=ids,
+                    vectors=vectors,
+                    texts=texts,
+                    metadatas=metadatas,
+                    is_partial=True,
+                    backend=backend,
+                    batch_number=batch_number
+                )
+                stored += len(ids)
+            
+            if stored:
+                self.finalize_vectors(document_id, user_id)
+            
+            logger.info(f"Document {document_id} ingested with {stored} locally embedded chunks")
+            return stored
+            
+        except Exception as e:
+            logger.error(f"Error ingesting document {document_id}: {str(e)}")
+            raise Exception(f"Failed to ingest document: {str(e)}")
+    
+    def finalize_vectors(self, document_id: str, user_id: str) -> dict:
+        """
+        Finish a batched vector upload: chunks none of the batches sent are deleted
+        and the search indexes rebuilt.
+        """
+        return self._make_api_request(
+            endpoint="finalize_document",
+            payload={
+                "document_id": document_id,
+                "user_id": user_id,
+                "finalize": True,
+                "reindex": True
+            },
+            timeout=30
+        )
+    
+    def link_document(self, document_id: str, user_id: str, source_document_id: str, source_user_id: str) -> int:
+        """
+        Point a document at the vectors of an identical, already processed document.
+        
+        Args:
+            document_id: The document ID to link
+            user_id: The user ID owning the document
+            source_document_id: The processed document with the same content
+            source_user_id: The user ID owning the source document
+            
+        Returns:
+            The number of chunks available through the link
+        """
+        payload = {
+            "document_id": document_id,
+            "user_id": user_id,
+            "source_document_id": source_document_id,
+            "source_user_id": source_user_id
+        }
+        
+        result = self._make_api_request(
+            endpoint="link_document",
+            payload=payload,
+            timeout=30
+        )
+        
+        chunks = result.get("chunks", 0)
+        logger.info(f"Document {document_id} linked to document {source_document_id} with {chunks} chunks")
+        return chunks
+    
+    def delete_document(self, document_id: str, user_id: str) -> bool:
+        """
+        Remove a document's chunks, indexes and cached retrievals from the API.
+        
+        Chunks still used by linked documents are kept.
+        
+        Returns:
+            True if the document's chunks were deleted
+        """
+        result = self._make_api_request(
+            endpoint="delete_document",
+            payload={"document_id": document_id, "user_id": user_id},
+            timeout=30
+        )
+        
+        deleted = result.get("deleted_chunks", False)
+        logger.info(f"Document {document_id} removed from the API (chunks deleted: {deleted})")
+        return deleted
+    
+    def check_document_status(self, document_id: str, user_id: str) -> dict:
+        """
+        Get the processing status of a document on the API.
+        
+        Returns:
+            Status dictionary (status, chunks, ...); status is "error" if the API could not be reached
+        """
+        try:
+            return self._make_api_request(
+                endpoint="document_status",
+                payload={},
+                method="get",
+                params={
+                    "document_id": document_id,
+                    "user_id": user_id
+                },
+                timeout=10
+            )
+        except Exception as e:
+            logger.warning(f"Could not get status for document {document_id}: {str(e)}")
+            return {"status": "error", "error": str(e)}
+    
     def generate_response(self, query: str, document_id: str, user_id: str, conversation_history=None) -> str:
         """Generate a response using the Colab-hosted LLM."""
         try:
@@ -254,28 +917,304 @@ class ColabClient:
         except requests.exceptions.RequestException as e:
             error_message = str(e)
             logger.error(f"Request error: {error_message}")
-            
-            if "404" in error_message:
-                if "Document not processed yet" in error_message or "vectorstore not found" in error_message:
-                    return "This document hasn't been processed yet in the current session. Please go back to the Documents page and click 'Reprocess' on this document, then try again."
-                else:
-                    return "The API endpoint was not found. The Colab notebook might need to be restarted."
-            elif "Connection" in error_message:
-                return "Could not connect to the API server. Please check that your Colab notebook is running."
-            else:
-                return f"Sorry, an error occurred while contacting the API: {error_message}"
+            return _request_error_response(error_message)
             
         except Exception as e:
             logger.error(f"Error generating response: {str(e)}")
             return f"Sorry, an error occurred: {str(e)}"
     
+    def stream_response(self, query: str, document_id: str, user_id: str, conversation_history=None):
+        """
+        Stream a response from the Colab-hosted LLM token by token.
+        
+        Args:
+            query: The user's question
+            document_id: The document to answer from
+            user_id: The user ID owning the document
+            conversation_history: Previous messages, as for generate_response
+            
+        Yields:
+            Text fragments of the answer as the model produces them
+            
+        Raises:
+            Exception: If the API can't be reached or reports an error mid-stream
+        """
+        payload = {
+            "query": query,
+            "document_id": document_id,
+            "user_id": user_id
+        }
+        
+        if conversation_history:
+            payload["conversation_history"] = conversation_history
+        
+        logger.info(f"Streaming response for query on document {document_id}")
+        
+        self.health.before_request()
+        try:
+            # Short connect timeout, generous gap allowed between tokens
+            response = self.session.post(f"{self.api_url}/generate_stream", json=payload, stream=True, timeout=(5, 120))
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            self.health.record_failure(str(e))
+            raise
+        
+        with response:
+            if response.status_code >= 500:
+                self.health.record_failure()
+            else:
+                self.health.record_success()
+            if response.status_code != 200:
+                raise Exception(f"Streaming request failed: {response.status_code} - {response.text}")
+            
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+                if "error" in event:
+                    raise Exception(f"Streaming failed: {event['error']}")
+                if event.get("done"):
+                    return
+                yield event.get("token", "")
+    
+    def generate_multi_document_response(self, query: str, user_id: str, document_ids=None, k: int = 8) -> dict:
+        """
+        Answer a question from several of a user's documents at once.
+        
+        Args:
+            query: The user's question
+            user_id: Owner of the documents
+            document_ids: Documents to search (all of the user's indexed documents if empty)
+            k: Number of chunks used as context across all documents
+            
+        Returns:
+            Dictionary with the response text and the sources (document ID, score, preview) it used
+        """
+        payload = {
+            "query": query,
+            "user_id": user_id,
+            "k": k
+        }
+        if document_ids:
+            payload["document_ids"] = [str(document_id) for document_id in document_ids]
+        
+        logger.info(f"Generating multi-document response for user {user_id} over {len(document_ids or [])} documents")
+        
+        result = self._make_api_request(
+            endpoint="generate_multi",
+            payload=payload,
+            timeout=60
+        )
+        
+        return {
+            "response": result.get("response", "Sorry, I couldn't generate a proper response."),
+            "sources": result.get("sources", [])
+        }
+    
+    def search_documents(self, query: str, user_id: str, document_ids=None, k: int = 8) -> list:
+        """Return the best chunks across a user's documents, each tagged with its document ID"""
+        payload = {
+            "query": query,
+            "user_id": user_id,
+            "k": k
+        }
+        if document_ids:
+            payload["document_ids"] = [str(document_id) for document_id in document_ids]
+        
+        result = self._make_api_request(
+            endpoint="search_documents",
+            payload=payload,
+            timeout=30
+        )
+        return result.get("results", [])
+    
     def _check_health_simple(self) -> bool:
         """Simple health check that just returns True/False"""
+        return self.check_health()[0]
+
+
+class AsyncColabClient:
+    """
+    Asynchronous client for the chat endpoints of the Colab API.
+    
+    Used by the async chat view so that an ASGI worker is not blocked while
+    the LLM is generating: waiting on the API only suspends the coroutine.
+    Requests go over the URL's shared keep-alive client (get_async_session)
+    and share the health cache and circuit breaker of the URL's ColabClient.
+    """
+    
+    def __init__(self, api_url: str):
+        """
+        Initialize the async Colab client.
+        
+        Args:
+            api_url: The public URL of your Colab notebook Flask API.
+        """
+        self.api_url = api_url.rstrip('/')
+        self.max_retries = 3
+        self.base_retry_delay = 2  # seconds
+        self.health = get_colab_client(self.api_url).health
+    
+    async def _make_api_request(self, endpoint: str, payload: dict, timeout: int = 30, method: str = 'post') -> dict:
+        """
+        Make an API request with the same retry logic as ColabClient.
+        
+        Args:
+            endpoint: API endpoint to call (without leading slash)
+            payload: Request payload (JSON body for POST, query parameters for GET)
+            timeout: Request timeout in seconds
+            method: HTTP method (get or post)
+        
+        Returns:
+            API response as dictionary
+        """
+        url = f"{self.api_url}/{endpoint}"
+        
+        session = get_async_session(self.api_url)
+        
+        for attempt in range(self.max_retries):
+            # Fail fast while the API is known to be down
+            self.health.before_request()
+            
+            try:
+                if method.lower() == 'post':
+                    response = await session.post(url, json=payload, timeout=timeout)
+                else:
+                    response = await session.get(url, params=payload, timeout=timeout)
+                
+                logger.debug(f"{method.upper()} {url} - Status: {response.status_code}")
+                
+                if response.status_code == 200:
+                    self.health.record_success()
+                    return response.json()
+                
+                # Only server errors count against the API's health
+                if response.status_code >= 500:
+                    self.health.record_failure()
+                else:
+                    self.health.record_success()
+                logger.warning(f"API returned non-200 status: {response.status_code} - {response.text}")
+                response.raise_for_status()
+            
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                error_message = str(e) or type(e).__name__
+                self.health.record_failure(error_message)
+                logger.warning(f"Request failed: {error_message} (attempt {attempt+1}/{self.max_retries})")
+                if attempt < self.max_retries - 1 and not self.health.is_open:
+                    retry_delay = self.base_retry_delay * (attempt + 1) + random.uniform(0, 1)
+                    logger.info(f"Retrying in {retry_delay:.1f} seconds...")
+                    await asyncio.sleep(retry_delay)
+                elif self.health.is_open:
+                    logger.error("Circuit breaker open, not retrying")
+                    raise
+                else:
+                    logger.error("Maximum retries reached")
+                    raise
+        
+        raise Exception(f"Failed to get successful response from {url} after {self.max_retries} attempts")
+    
+    async def check_health(self, force: bool = False) -> tuple:
+        """
+        Check if the API is healthy, using the shared cached result while it is fresh.
+        
+        Args:
+            force: Probe the API now instead of using the cached result
+        
+        Returns:
+            Tuple of (is_healthy, model_info)
+        """
+        # A probe is a blocking request; keep it off the event loop
+        return await asyncio.to_thread(self.health.status, force)
+    
+    async def generate_response(self, query: str, document_id: str, user_id: str, conversation_history=None) -> str:
+        """Generate a response using the Colab-hosted LLM, as ColabClient.generate_response does."""
         try:
-            response = requests.get(f"{self.api_url}/healthcheck", timeout=5)
-            return response.status_code == 200
-        except:
-            return False
+            is_healthy, _ = await self.check_health()
+            if not is_healthy:
+                return "The Colab service is currently unavailable. Please try again later."
+            
+            payload = {
+                "query": query,
+                "document_id": document_id,
+                "user_id": user_id
+            }
+            
+            if conversation_history:
+                payload["conversation_history"] = conversation_history
+            
+            logger.info(f"Generating response for query on document {document_id}")
+            
+            result = await self._make_api_request(
+                endpoint="generate",
+                payload=payload,
+                timeout=45
+            )
+            
+            return result.get("response", "Sorry, I couldn't generate a proper response.")
+            
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            error_message = str(e) or type(e).__name__
+            logger.error(f"Request error: {error_message}")
+            return _request_error_response(error_message)
+            
+        except Exception as e:
+            logger.error(f"Error generating response: {str(e)}")
+            return f"Sorry, an error occurred: {str(e)}"
+
+
+def iter_vector_batches(document_id, chunks, embedding_model, batch_size=None):
+    """
+    Embed chunks in batches, as the API stores them.
+    
+    IDs are content-addressed as on the API, so repeated chunks collapse into
+    one vector. Chunks from file_processor use the API's splitter, so switching
+    between local and remote ingestion keeps the same chunks and IDs and
+    re-embeds nothing.
+    
+    Args:
+        batch_size: Chunks embedded per batch (defaults to settings.COLAB_UPSERT_BATCH_SIZE)
+    
+    Yields:
+        Tuples of (ids, vectors, texts, metadatas), one per batch
+    """
+    batch_size = batch_size or settings.COLAB_UPSERT_BATCH_SIZE
+    seen = set()
+    batch = []
+    
+    def embedded(batch):
+        texts = [chunk.page_content for _, chunk in batch]
+        vectors = [[float(value) for value in vector] for vector in embedding_model.embed_documents(texts)]
+        return [chunk_key for chunk_key, _ in batch], vectors, texts, [_vector_metadata(chunk) for _, chunk in batch]
+    
+    for chunk in chunks:
+        chunk_key = f"{document_id}:{chunk_hash(chunk.page_content)}"
+        if chunk_key in seen:
+            continue
+        seen.add(chunk_key)
+        batch.append((chunk_key, chunk))
+        if len(batch) >= batch_size:
+            yield embedded(batch)
+            batch = []
+    if batch:
+        yield embedded(batch)
+
+def _vector_metadata(chunk):
+    """Chunk metadata the vector stores accept: scalar values only, plus the fields the API sets"""
+    metadata = {key: value for key, value in chunk.metadata.items() if isinstance(value, (str, int, float, bool))}
+    metadata["chunk_length"] = len(chunk.page_content)
+    metadata["chunk_hash"] = chunk_hash(chunk.page_content)
+    return metadata
+
+def _request_error_response(error_message):
+    """Message shown to the user when a request to the API failed"""
+    if "404" in error_message:
+        if "Document not processed yet" in error_message or "vectorstore not found" in error_message:
+            return "This document hasn't been processed yet in the current session. Please go back to the Documents page and click 'Reprocess' on this document, then try again."
+        else:
+            return "The API endpoint was not found. The Colab notebook might need to be restarted."
+    elif "Connection" in error_message or "Connect" in error_message:
+        return "Could not connect to the API server. Please check that your Colab notebook is running."
+    else:
+        return f"Sorry, an error occurred while contacting the API: {error_message}"
 
 
 def detect_query_type(query):
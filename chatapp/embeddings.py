@@ -1,23 +1,166 @@
+import logging
+import os
+import threading
+import time
+from django.conf import settings
 from langchain_community.embeddings import HuggingFaceEmbeddings
+from utils.embedding_batcher import MicroBatchingEmbeddings
+from utils.embedding_cache import CachedEmbeddings, EmbeddingCache, cache_model_name
+from utils.hybrid_search import HybridRetriever
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"  # Better than all-MiniLM-L6-v2
+
+# One cache per file, shared by every model that uses it
+_embedding_caches = {}
+
+# Process-wide model registry: each model is loaded once and shared by every caller
+_model_registry = {}
+_model_stats = {}
+_registry_lock = threading.Lock()
 
 def get_embedding_model(model_name=None):
-    """Get improved embedding model for better semantic understanding"""
+    """Get improved embedding model for better semantic understanding, loading it once per process"""
     
     # Default to a more powerful model if none specified
     if not model_name:
-        model_name = "sentence-transformers/all-mpnet-base-v2"  # Better than all-MiniLM-L6-v2
+        model_name = DEFAULT_EMBEDDING_MODEL
     
+    embedding_model = _model_registry.get(model_name)
+    if embedding_model is None:
+        with _registry_lock:
+            # Another thread may have finished loading while we waited for the lock
+            embedding_model = _model_registry.get(model_name)
+            if embedding_model is None:
+                embedding_model = _load_embedding_model(model_name)
+                _model_registry[model_name] = embedding_model
+    
+    return embedding_model
+
+def _load_embedding_model(model_name):
+    """Load a model from disk, recording how long it took and how much memory it uses"""
+    rss_before = _current_rss_bytes()
+    start = time.perf_counter()
+    
+    if embedding_backend() != 'pytorch':
+        # int8 ONNX export served by onnxruntime: faster on CPU and a smaller footprint
+        from utils.onnx_embeddings import OnnxEmbeddings
+        embedding_model = OnnxEmbeddings(
+            model_name=model_name,
+            cache_dir=settings.ONNX_MODEL_DIR,
+            quantize=True
+        )
+    else:
+        embedding_model = load_huggingface_embeddings(model_name)
+    
+    load_seconds = time.perf_counter() - start
+    _model_stats[model_name] = {
+        "model_name": model_name,
+        "load_seconds": round(load_seconds, 3),
+        "parameter_bytes": _parameter_bytes(embedding_model),
+        "rss_delta_bytes": max(_current_rss_bytes() - rss_before, 0),
+        "loaded_at": time.time(),
+        "warmup_seconds": None
+    }
+    logger.info(f"Loaded embedding model {model_name} in {load_seconds:.2f}s")
+    
+    # Merge concurrent requests into shared forward passes
+    if getattr(settings, 'EMBEDDING_MICRO_BATCHING', False):
+        embedding_model = MicroBatchingEmbeddings(
+            embedding_model,
+            max_batch_size=getattr(settings, 'EMBEDDING_MAX_BATCH_SIZE', 64),
+            max_wait_ms=getattr(settings, 'EMBEDDING_MAX_WAIT_MS', 10)
+        )
+    
+    # Serve repeated texts from the on-disk cache instead of re-embedding them; each
+    # backend gets its own entries, as int8 vectors differ slightly from PyTorch ones
+    cache = get_embedding_cache()
+    if cache:
+        embedding_model = CachedEmbeddings(
+            embedding_model, model_name=cache_model_name(model_name, embedding_backend()), cache=cache
+        )
+    
+    return embedding_model
+
+def embedding_backend():
+    """Backend this process embeds with: 'pytorch', or 'onnx-int8' with EMBEDDING_BACKEND=onnx"""
+    if getattr(settings, 'EMBEDDING_BACKEND', 'huggingface') == 'onnx':
+        from utils.onnx_embeddings import onnx_backend_name
+        return onnx_backend_name(quantize=True)
+    return 'pytorch'
+
+def load_huggingface_embeddings(model_name):
+    """Load the PyTorch sentence-transformer backend"""
     # Initialize embeddings with better parameters
-    embedding_model = HuggingFaceEmbeddings(
+    return HuggingFaceEmbeddings(
         model_name=model_name,
         model_kwargs={"device": "cpu"},
         encode_kwargs={"normalize_embeddings": True}  # Normalize for better similarity comparison
     )
+
+def warm_up_embedding_model(model_name=None, batch_size=8):
+    """Load a model and push a dummy batch through it so the first real request pays no startup cost"""
+    model_name = model_name or DEFAULT_EMBEDDING_MODEL
+    embedding_model = get_embedding_model(model_name)
+    
+    # Bypass the cache so the forward pass actually runs
+    base_model = embedding_model.embeddings if isinstance(embedding_model, CachedEmbeddings) else embedding_model
     
+    start = time.perf_counter()
+    base_model.embed_documents([f"warm-up sentence {i}" for i in range(batch_size)])
+    warmup_seconds = time.perf_counter() - start
+    
+    _model_stats[model_name]["warmup_seconds"] = round(warmup_seconds, 3)
+    logger.info(f"Warmed up embedding model {model_name} in {warmup_seconds:.2f}s")
     return embedding_model
 
-def create_hybrid_retriever(retriever):
-    """Create a hybrid retrieval approach (future enhancement)"""
-    # This is a placeholder for future implementation
-    # Could combine vector search with keyword-based approaches
-    return retriever
\ No newline at end of file
+def get_embedding_model_stats():
+    """Load time and memory footprint of every model loaded in this process"""
+    return [dict(stats) for stats in _model_stats.values()]
+
+def _parameter_bytes(embedding_model):
+    """Size of the model weights, or None if the backend doesn't expose them"""
+    if hasattr(embedding_model, 'model_bytes'):
+        return embedding_model.model_bytes
+    try:
+        return sum(p.numel() * p.element_size() for p in embedding_model.client.parameters())
+    except Exception:
+        return None
+
+def _current_rss_bytes():
+    """Resident memory of this process (0 where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def get_embedding_cache():
+    """Get the persistent embedding cache configured in settings, or None if disabled"""
+    path = getattr(settings, 'EMBEDDING_CACHE_PATH', None)
+    if not path:
+        return None
+    
+    if path not in _embedding_caches:
+        max_bytes = getattr(settings, 'EMBEDDING_CACHE_MAX_MB', 512) * 1024 * 1024
+        _embedding_caches[path] = EmbeddingCache(path, max_bytes=max_bytes)
+    return _embedding_caches[path]
+
+def create_hybrid_retriever(retriever, bm25_index=None, vectorstore=None, k=5, rrf_k=60):
+    """Combine a vector retriever with BM25 keyword search using reciprocal rank fusion"""
+    # Without a keyword index there is nothing to fuse with
+    if bm25_index is None or len(bm25_index) == 0:
+        return retriever
+    
+    if vectorstore is None:
+        vectorstore = getattr(retriever, 'vectorstore', None)
+    
+    return HybridRetriever(
+        vectorstore=vectorstore,
+        bm25_index=bm25_index,
+        k=k,
+        lexical_k=k,
+        rrf_k=rrf_k,
+        retriever=retriever
+    )
@@ -1,16 +1,36 @@
 import os
 import io
 import csv
+import bisect
+import hashlib
 import chardet
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from PyPDF2 import PdfReader
 import docx2txt
 import pandas as pd
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils.hashing import chunk_hash
+from utils.slicing import iter_slices_for_upload, make_text_splitter
 
 logger = logging.getLogger(__name__)
 
-def extract_content_from_file(file):
+# Characters of streamed PDF text chunked at a time
+PAGE_WINDOW_CHARS = 16000
+
+# Parallel extraction settings: worker processes and PDF pages handed to each task
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = int(os.environ.get('PDF_PAGES_PER_TASK', 25))
+
+# Shared by background and pipeline workers; started on first use by get_extraction_pool
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+# (source key, PdfReader) of the PDF a worker process read last, reused by its next page range
+_worker_pdf = (None, None)
+
+def extract_content_from_file(file, parallel=False):
     """Extract text content from various file types"""
     file_name = file.name if hasattr(file, 'name') else 'unknown'
     extension = os.path.splitext(file_name)[1].lower()
@@ -22,7 +42,7 @@ def extract_content_from_file(file):
     try:
         # Handle different file types
         if extension == '.pdf':
-            return extract_from_pdf(file)
+            return extract_pdf_parallel(file) if parallel else extract_from_pdf(file)
         elif extension == '.docx':
             return extract_from_docx(file)
         elif extension == '.doc':
@@ -42,11 +62,148 @@ def extract_content_from_file(file):
 
 def extract_from_pdf(file):
     """Extract text from PDF files"""
+    return "\n".join(text for _, text in iter_pdf_pages(file)).strip()
+
+def iter_pdf_pages(file):
+    """Yield (page_number, text) tuples one page at a time from a PDF"""
     pdf_reader = PdfReader(file)
-    text = ""
-    for page_num in range(len(pdf_reader.pages)):
-        text += pdf_reader.pages[page_num].extract_text() + "\n"
-    return text.strip()
+    for page_number, page in enumerate(pdf_reader.pages, start=1):
+        yield page_number, page.extract_text() or ""
+
+def count_pdf_pages(file):
+    """Return the number of pages in a PDF without extracting any text"""
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    page_count = len(PdfReader(file).pages)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return page_count
+
+def get_extraction_pool():
+    """The process-wide pool for parallel extraction, started on first use
+
+    Starting worker processes costs more than a web request should spend, so only
+    background tasks and ingestion pipeline workers extract in parallel.
+    """
+    global _extraction_pool
+    if _extraction_pool is None:
+        with _extraction_pool_lock:
+            if _extraction_pool is None:
+                _extraction_pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+    return _extraction_pool
+
+def iter_pdf_pages_parallel(file, pages_per_task=PDF_PAGES_PER_TASK, window=None):
+    """Yield (page_number, text) from a PDF in page order, parsing page ranges on the shared pool
+
+    At most ``window`` ranges (default: two per worker) are in flight, so a long
+    PDF is never held in memory all at once.
+    """
+    total_pages = count_pdf_pages(file)
+    
+    # Small PDFs are not worth the round trips to worker processes
+    if EXTRACTION_WORKERS <= 1 or total_pages <= pages_per_task:
+        yield from iter_pdf_pages(file)
+        return
+    
+    source = _file_source(file)
+    key = source if isinstance(source, str) else hashlib.sha256(source).hexdigest()
+    window = window or 2 * EXTRACTION_WORKERS
+    starts = iter(range(0, total_pages, pages_per_task))
+    pending = deque()
+    pool = get_extraction_pool()
+    
+    logger.info(f"Extracting {total_pages} PDF pages in ranges of {pages_per_task} over {EXTRACTION_WORKERS} processes")
+    try:
+        while True:
+            for start in starts:
+                end = min(start + pages_per_task, total_pages)
+                pending.append((start, pool.submit(_extract_pdf_page_range, key, source, start, end)))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            # Ranges are collected in submission order, so pages come out in order
+            start, future = pending.popleft()
+            for offset, text in enumerate(future.result()):
+                yield start + offset + 1, text
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+def extract_pdf_parallel(file, pages_per_task=PDF_PAGES_PER_TASK):
+    """Extract text from a PDF by spreading page ranges over the shared process pool"""
+    return "\n".join(text for _, text in iter_pdf_pages_parallel(file, pages_per_task)).strip()
+
+def _extract_pdf_page_range(key, source, start, end):
+    """Extract pages [start, end) in a worker process, reusing the reader of the previous range"""
+    global _worker_pdf
+    if _worker_pdf[0] != key:
+        _worker_pdf = (key, PdfReader(source if isinstance(source, str) else io.BytesIO(source)))
+    reader = _worker_pdf[1]
+    return [reader.pages[page_num].extract_text() or "" for page_num in range(start, end)]
+
+def extract_contents_from_files(files, max_workers=None):
+    """Extract several uploaded files concurrently, returning results in input order.
+
+    Files that cannot be read produce the ValueError raised by
+    extract_content_from_file in their slot instead of text.
+    """
+    max_workers = max_workers or EXTRACTION_WORKERS
+    sources = [(getattr(file, 'name', 'unknown'), _file_source(file)) for file in files]
+    
+    if max_workers <= 1 or len(sources) <= 1:
+        return [_extract_content_from_source(name, source) for name, source in sources]
+    
+    pool = get_extraction_pool()
+    futures = [pool.submit(_extract_content_from_source, name, source) for name, source in sources]
+    return [future.result() for future in futures]
+
+def _extract_content_from_source(name, source):
+    """Worker entry point for extract_contents_from_files"""
+    try:
+        if isinstance(source, str):
+            with open(source, 'rb') as file:
+                return extract_content_from_file(file)
+        file = io.BytesIO(source)
+        file.name = name
+        return extract_content_from_file(file)
+    except ValueError as e:
+        return e
+
+def _file_source(file):
+    """Return a path worker processes can open, or the raw bytes when the file is not on disk"""
+    try:
+        path = file.path
+        if os.path.exists(path):
+            return path
+    except (AttributeError, NotImplementedError, ValueError):
+        pass
+    
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    data = file.read()
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return data
+
+def compute_content_hash(file=None, content=None):
+    """Return the SHA-256 of a file's raw bytes (or of pasted text content)"""
+    hasher = hashlib.sha256()
+    if file:
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        # Hash in blocks so large uploads are never fully loaded in memory
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            hasher.update(block if isinstance(block, bytes) else block.encode('utf-8'))
+        if hasattr(file, 'seek'):
+            file.seek(0)
+    else:
+        hasher.update((content or "").encode('utf-8'))
+    return hasher.hexdigest()
+
+def compute_chunk_hash(text):
+    """Stable content hash of a chunk, matching the chunk IDs used by the RAG API"""
+    return chunk_hash(text)
 
 def extract_from_docx(file):
     """Extract text from DOCX files"""
@@ -89,14 +246,13 @@ def extract_from_text(file):
     # Decode the content with the detected encoding
     return content.decode(encoding, errors='replace')
 
+def get_text_splitter(add_start_index=False):
+    # Chunk exactly as the API does, so locally ingested chunks get the same
+    # content-hash IDs (and retrieval granularity) as remotely ingested ones
+    return make_text_splitter(add_start_index=add_start_index)
+
 def process_document_text(text, document_id, user_id):
-    # Replace simple chunking with more semantically aware splitting
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=800,  # Smaller chunks for more precise retrieval
-        chunk_overlap=300,  # Larger overlap to maintain context across chunks
-        separators=["\n\n", "\n", ".", " ", ""],  # More granular separators for better splitting
-        length_function=len
-    )
+    text_splitter = get_text_splitter()
     
     # Split text and create metadata with more context
     chunks = text_splitter.create_documents(
@@ -126,8 +282,122 @@ def enrich_chunk_metadata(chunks, document_id):
             "chunk_id": i,
             "position": position,
             "potential_header": potential_header[:50],
-            "content_preview": chunk.page_content[:100].replace("\n", " ")
+            "content_preview": chunk.page_content[:100].replace("\n", " "),
+            "chunk_hash": compute_chunk_hash(chunk.page_content)
         })
         enriched_chunks.append(chunk)
     
-    return enriched_chunks
\ No newline at end of file
+    return enriched_chunks
+
+def process_document_pages(pages, document_id, user_id, total_pages=None, window_chars=PAGE_WINDOW_CHARS):
+    """Chunk (page_number, text) pages incrementally, yielding chunks as soon as they are final.
+
+    Pages are cut into chunk-aligned windows by utils.slicing.iter_slices_for_upload,
+    which re-splits from the last stable chunk boundary, so the chunks are exactly
+    those process_document_text gives for the non-empty pages joined by newlines.
+    Only about two windows of ``window_chars`` characters are held in memory, so
+    chunking and embedding can start on the first pages while later pages are
+    still being parsed.
+    """
+    text_splitter = get_text_splitter(add_start_index=True)
+    base_metadata = {"document_id": str(document_id), "user_id": str(user_id), "source": "document"}
+    
+    # Offset of every page in the joined text, recorded as the page is read
+    page_starts = []
+    page_numbers = []
+    
+    def page_texts():
+        position = 0
+        for page_number, page_text in pages:
+            if not page_text:
+                continue
+            if page_starts:
+                position += 1  # The newline joining it to the previous page
+            page_starts.append(position)
+            page_numbers.append(page_number)
+            position += len(page_text)
+            yield page_text
+    
+    for piece in iter_slices_for_upload(page_texts(), max_chars=window_chars, splitter=text_splitter):
+        chunks = [
+            chunk for chunk in text_splitter.create_documents([piece["text"]])
+            if chunk.metadata["start_index"] < piece["owned"]
+        ]
+        for i, chunk in enumerate(chunks):
+            start = piece["offset"] + chunk.metadata.pop("start_index")
+            page_number = page_numbers[max(bisect.bisect_right(page_starts, start) - 1, 0)]
+            chunk.metadata.update(base_metadata)
+            yield _enrich_streamed_chunk(chunk, piece["first_chunk"] + i, page_number, total_pages)
+
+def _enrich_streamed_chunk(chunk, chunk_index, page_number, total_pages):
+    """Add the same metadata as enrich_chunk_metadata without knowing the final chunk count"""
+    lines = chunk.page_content.split('\n')
+    potential_header = lines[0] if lines else ""
+    
+    # Position is derived from the page, since the total number of chunks is not known yet
+    if total_pages and page_number:
+        ratio = (page_number - 1) / total_pages
+        position = "beginning" if ratio < 1/3 else "middle" if ratio < 2/3 else "end"
+    else:
+        position = "unknown"
+    
+    chunk.metadata.update({
+        "chunk_id": chunk_index,
+        "page_number": page_number,
+        "position": position,
+        "potential_header": potential_header[:50],
+        "content_preview": chunk.page_content[:100].replace("\n", " "),
+        "chunk_hash": compute_chunk_hash(chunk.page_content)
+    })
+    return chunk
+
+class LeadingText:
+    """on_page callback keeping the start of streamed text, e.g. for Document.content"""
+    
+    def __init__(self, limit=1000000):
+        self.limit = limit
+        self.parts = []
+        self.length = 0
+    
+    def __call__(self, text):
+        if text and self.length < self.limit:
+            self.parts.append(text[:self.limit - self.length])
+            self.length += len(self.parts[-1])
+    
+    @property
+    def text(self):
+        return "\n".join(self.parts).strip()
+
+def is_streamable(file):
+    """Whether a file is extracted page by page instead of as one text"""
+    file_name = file.name if hasattr(file, 'name') else 'unknown'
+    return os.path.splitext(file_name)[1].lower() == '.pdf'
+
+def iter_document_pages(file, on_page=None, parallel=False):
+    """Yield (page_number, text) for a PDF one page at a time, passing each text to on_page
+
+    With parallel=True page ranges are parsed ahead on the shared extraction pool.
+    """
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    pages = iter_pdf_pages_parallel(file) if parallel else iter_pdf_pages(file)
+    for page_number, text in pages:
+        if on_page:
+            on_page(text)
+        yield page_number, text
+
+def iter_document_chunks(file, document_id, user_id, on_page=None, parallel=False):
+    """Yield enriched chunks for an uploaded file, streaming PDFs page by page
+
+    on_page is called with the text of each page (or of the whole file when it
+    is not streamed) as it is extracted, e.g. to keep a preview.
+    """
+    if is_streamable(file):
+        total_pages = count_pdf_pages(file)
+        pages = iter_document_pages(file, on_page, parallel=parallel)
+        yield from process_document_pages(pages, document_id, user_id, total_pages=total_pages)
+    else:
+        text = extract_content_from_file(file)
+        if on_page:
+            on_page(text)
+        yield from process_document_text(text, document_id, user_id)
@@ -0,0 +1,357 @@
+"""
+Document ingestion as a staged pipeline: extract -> chunk -> embed -> index -> finalize.
+
+Each stage has its own worker threads and a bounded queue in front of it (see
+utils.pipeline), so a slow embedding stage doesn't stop the next upload from
+being extracted, and a burst of uploads waits in the queues instead of holding
+every document's text and vectors in memory. The job carries all intermediate
+state, so the Document row is written twice: its status when extraction starts
+and the result (or error) at the end.
+
+Every stage finishes its own work before handing the job on: extract parses
+the file (PDFs page by page on the shared extraction pool, kept as a list of
+pages rather than one joined text), chunk splits it and embed only embeds, so
+the per-stage numbers of Pipeline.stats() show where the time goes.
+
+Chunking and embedding only do work in INGEST_MODE 'local', where the embed
+stage sends each batch of vectors as soon as it is embedded; otherwise the
+index stage sends the text (or the pages, as a sliced upload) to the API,
+which chunks and embeds it itself.
+"""
+
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.timezone import now
+
+from utils.pipeline import Pipeline, Stage
+from .colab_client import get_colab_client, iter_vector_batches
+from .file_processor import (
+    EXTRACTION_WORKERS, LeadingText, extract_content_from_file, extract_contents_from_files, is_streamable,
+    iter_document_pages, process_document_pages, process_document_text
+)
+from .models import Document
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("extract", "chunk", "embed", "index", "finalize")
+
+CONTENT_LIMIT = 1000000  # Characters of extracted text kept in Document.content
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+class IngestionError(Exception):
+    """A stage failed with a known cause, shown to the user as ``status``"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+class IngestionJob:
+    """A document on its way through the pipeline, with everything the later stages need"""
+
+    def __init__(self, document_id, content=None):
+        self.document_id = document_id
+        self.document = None
+        self.colab_client = None
+        self.content = content  # Text extracted ahead of the pipeline, or the exception that raised
+        self.pages = None  # (page_number, text) of a PDF, parsed page by page instead of as one text
+        self.local = False  # Chunk and embed here instead of on the API
+        self.chunks = None  # Locally made chunks, consumed by the embed stage
+        self.vectors_sent = 0
+        self.chunks_stored = None  # Set once the API holds the document's chunks
+        self.leading_text = LeadingText(CONTENT_LIMIT)  # Start of the parsed pages, kept for Document.content
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until the document is processed or failed; False on timeout"""
+        return self.done.wait(timeout)
+
+
+def _db_stage(func):
+    """Stage threads are long-lived: drop database connections that went stale between jobs"""
+    def run(job):
+        close_old_connections()
+        try:
+            return func(job)
+        finally:
+            close_old_connections()
+    run.__name__ = func.__name__
+    return run
+
+
+@_db_stage
+def extract(job):
+    """Load the document, link identical content or read its text"""
+    try:
+        document = Document.objects.select_related('uploaded_by').get(id=job.document_id)
+    except Document.DoesNotExist:
+        raise IngestionError(f"Document {job.document_id} not found", "Failed - Not found")
+
+    Document.objects.filter(id=document.id).update(processing_status="Processing in background...")
+    job.document = document
+
+    api_url = os.environ.get('COLAB_API_URL', 'http://localhost:5000')
+    job.colab_client = get_colab_client(api_url)
+    if not job.colab_client._check_health_simple():
+        raise IngestionError("API service is unavailable", "Failed - API unavailable")
+
+    # Identical content that was already processed only needs its vectors linked
+    if not document.content_hash:
+        document.content_hash = document.compute_content_hash()
+
+    duplicate = document.find_processed_duplicate(across_users=settings.DEDUP_ACROSS_USERS)
+    if duplicate:
+        try:
+            chunks_linked = job.colab_client.link_document(
+                document_id=str(document.id),
+                user_id=str(document.uploaded_by.id),
+                source_document_id=str(duplicate.id),
+                source_user_id=str(duplicate.uploaded_by.id)
+            )
+            if chunks_linked > 0:
+                if not document.content:
+                    document.content = duplicate.content
+                job.chunks_stored = chunks_linked
+                logger.info(f"Document {document.id} reused {chunks_linked} chunks from document {duplicate.id}")
+                return job
+        except Exception as e:
+            logger.warning(f"Could not link document {document.id} to {duplicate.id}, processing normally: {str(e)}")
+
+    content = document.content
+    if not content and document.file and is_streamable(document.file):
+        try:
+            job.pages = list(iter_document_pages(document.file, on_page=job.leading_text, parallel=True))
+        except Exception as e:
+            raise IngestionError(f"Could not read file: {str(e)}", "Failed - File read error")
+        if not job.leading_text.text:
+            raise IngestionError("No content found in document", "Failed - Empty content")
+    elif not content and document.file:
+        content = job.content
+        try:
+            if isinstance(content, Exception):
+                raise content
+            if content is None:
+                content = extract_content_from_file(document.file, parallel=True)
+        except Exception as e:
+            raise IngestionError(f"Could not read file: {str(e)}", "Failed - File read error")
+        document.content = content[:CONTENT_LIMIT]  # Limit content size if needed
+
+    if not content and job.pages is None:
+        raise IngestionError("No content found in document", "Failed - Empty content")
+
+    from .embeddings import embedding_backend
+    job.content = content
+    job.local = settings.INGEST_MODE == 'local' and job.colab_client.accepts_vectors_from(embedding_backend())
+    if settings.INGEST_MODE == 'local' and not job.local:
+        logger.warning(f"API embeds with another model or backend, sending document {document.id} for remote embedding")
+    return job
+
+
+def chunk(job):
+    """Split locally ingested documents into chunks"""
+    if job.local and job.chunks_stored is None:
+        document = job.document
+        if job.pages is not None:
+            job.chunks = list(process_document_pages(
+                job.pages, document.id, document.uploaded_by.id, total_pages=len(job.pages)
+            ))
+            job.pages = None
+        else:
+            job.chunks = process_document_text(job.content, document.id, document.uploaded_by.id)
+    return job
+
+
+def embed(job):
+    """Embed chunks with the API's model and send each batch of vectors as soon as it is ready"""
+    if job.chunks is None:
+        return job
+
+    from .embeddings import embedding_backend, get_embedding_model
+    client = job.colab_client
+    document_id = str(job.document.id)
+    embedding_model = get_embedding_model(client.embedding_model)
+
+    try:
+        batches = iter_vector_batches(document_id, job.chunks, embedding_model)
+        for batch_number, (ids, vectors, texts, metadatas) in enumerate(batches):
+            client.upsert_vectors(
+                document_id=document_id,
+                user_id=str(job.document.uploaded_by.id),
+                model_name=client.embedding_model,
+                ids=ids,
+                vectors=vectors,
+                texts=texts,
+                metadatas=metadatas,
+                is_partial=True,
+                backend=embedding_backend(),
+                batch_number=batch_number
+            )
+            job.vectors_sent += len(ids)
+    finally:
+        job.chunks = None
+    return job
+
+
+def index(job):
+    """Store the document's chunks on the API (for local ingestion: finish the batched upload)"""
+    if job.chunks_stored is not None:
+        return job
+
+    client = job.colab_client
+    document = job.document
+    document_id = str(document.id)
+    user_id = str(document.uploaded_by.id)
+
+    if job.local:
+        if job.vectors_sent:
+            client.finalize_vectors(document_id, user_id)
+        job.chunks_stored = job.vectors_sent
+    elif job.pages is not None:
+        logger.info(f"Indexing document {document_id} with {len(job.pages)} pages")
+        pages = (text for _, text in job.pages)
+        job.chunks_stored = client.process_document_pages(document_id, pages, user_id, content_hash=document.content_hash)
+    else:
+        logger.info(f"Indexing document {document_id} with {len(job.content)} characters")
+        job.chunks_stored = client.process_document(document_id=document_id, content=job.content, user_id=user_id)
+
+    # The text is no longer needed; free it while the job waits for finalize
+    job.content = None
+    job.pages = None
+    return job
+
+
+@_db_stage
+def finalize(job):
+    """Save the result in one write, touching only the fields ingestion sets"""
+    document = job.document
+    if job.leading_text.text:
+        document.content = job.leading_text.text
+    document.is_processed = True
+    document.chunks = job.chunks_stored
+    document.processing_status = "Complete"
+    document.last_processed = now()
+    document.save(update_fields=[
+        'content', 'content_hash', 'is_processed', 'chunks', 'processing_status', 'last_processed'
+    ])
+
+    logger.info(f"Document {document.id} processed successfully with {job.chunks_stored} chunks")
+    job.done.set()
+    return None
+
+
+def record_failure(job, stage, error):
+    """Mark the document failed, keeping what extraction already found out"""
+    job.error = error
+    # Errors may arrive wrapped by the client; look for the original
+    cause = error
+    while cause is not None and not isinstance(cause, IngestionError):
+        cause = cause.__cause__ or cause.__context__
+    if cause is not None:
+        status = cause.status
+    elif stage in ("embed", "index"):
+        status = f"Failed - API error: {str(error)[:100]}"
+    else:
+        status = f"Failed - Unexpected error: {str(error)[:100]}"
+
+    fields = {"processing_error": str(error), "processing_status": status, "is_processed": False}
+    if job.document is not None:
+        fields.update(content=job.document.content, content_hash=job.document.content_hash)
+
+    close_old_connections()
+    try:
+        Document.objects.filter(id=job.document_id).update(**fields)
+    finally:
+        job.done.set()
+
+
+def build_ingestion_pipeline(workers=None, queue_size=None):
+    """
+    Pipeline with the document ingestion stages.
+
+    Args:
+        workers: Worker threads per stage name (defaults to settings.INGEST_PIPELINE_WORKERS)
+        queue_size: Jobs waiting in front of each stage (defaults to settings.INGEST_PIPELINE_QUEUE_SIZE)
+    """
+    workers = {**settings.INGEST_PIPELINE_WORKERS, **(workers or {})}
+    queue_size = queue_size or settings.INGEST_PIPELINE_QUEUE_SIZE
+    functions = {"extract": extract, "chunk": chunk, "embed": embed, "index": index, "finalize": finalize}
+    return Pipeline(
+        [Stage(name, functions[name], workers=workers.get(name, 1), queue_size=queue_size) for name in STAGES],
+        on_error=record_failure,
+        name="ingestion"
+    )
+
+
+def get_ingestion_pipeline():
+    """The process-wide ingestion pipeline, started on first use"""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = build_ingestion_pipeline().start()
+    return _pipeline
+
+
+def ingest_document(document_id, pipeline=None):
+    """Queue a document for ingestion, blocking while the pipeline is full; returns its job"""
+    job = IngestionJob(document_id)
+    (pipeline or get_ingestion_pipeline()).submit(job)
+    return job
+
+
+def ingest_documents(document_ids, pipeline=None, batch_size=None):
+    """
+    Queue several documents, extracting the non-PDF files of each batch together.
+
+    Files that are read whole are extracted concurrently on the shared process
+    pool before their jobs are submitted; PDFs are parsed page by page by the extract stage.
+
+    Args:
+        document_ids: Documents to ingest, in order
+        pipeline: Pipeline to submit to (defaults to the process-wide one)
+        batch_size: Documents extracted together (defaults to the extraction workers)
+
+    Yields:
+        The job of each document as it is submitted
+    """
+    batch_size = batch_size or max(EXTRACTION_WORKERS, 1)
+    for start in range(0, len(document_ids), batch_size):
+        batch = document_ids[start:start + batch_size]
+        documents = Document.objects.in_bulk(batch)
+        to_extract = [
+            document for document in documents.values()
+            if not document.content and document.file and not is_streamable(document.file)
+        ]
+        # Each slot holds the text or the error raised while reading that file
+        extracted = {}
+        if to_extract:
+            try:
+                files = [document.file for document in to_extract]
+                extracted = dict(zip((document.id for document in to_extract), extract_contents_from_files(files)))
+            except Exception as e:
+                logger.warning(f"Batch extraction failed, extracting in the pipeline instead: {str(e)}")
+        
+        for document_id in batch:
+            job = IngestionJob(document_id, content=extracted.get(document_id))
+            (pipeline or get_ingestion_pipeline()).submit(job)
+            yield job
+
+
+def format_stats(stats):
+    """One line per stage: queue depth, busy workers, throughput"""
+    return "\n".join(
+        f"{stage['stage']:<9} queue {stage['queue_depth']}/{stage['queue_size']}  "
+        f"workers {stage['in_progress']}/{stage['workers']}  "
+        f"done {stage['processed']}  failed {stage['failed']}  "
+        f"{stage['throughput_per_second']:.2f}/s  avg {stage['avg_seconds']:.2f}s  "
+        f"blocked {stage['blocked_seconds']:.1f}s"
+        for stage in stats["stages"]
+    )
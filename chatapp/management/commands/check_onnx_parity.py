@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from chatapp.embeddings import DEFAULT_EMBEDDING_MODEL, load_huggingface_embeddings
+from chatapp.models import Document
+
+class Command(BaseCommand):
+    help = 'Compare the quantized ONNX embedding backend against the PyTorch model'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            default=DEFAULT_EMBEDDING_MODEL,
+            help='Embedding model to export and compare',
+        )
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=64,
+            help='Number of document excerpts to compare on',
+        )
+        parser.add_argument(
+            '--min-cosine',
+            type=float,
+            default=0.98,
+            dest='min_cosine',
+            help='Lowest acceptable cosine similarity between the two backends',
+        )
+    
+    def handle(self, *args, **options):
+        from utils.onnx_embeddings import OnnxEmbeddings, check_parity
+        
+        model_name = options['model']
+        
+        # Compare on real document text where available
+        texts = []
+        for document in Document.objects.exclude(content='')[:options['samples']]:
+            texts.append(document.content[:1000])
+        if not texts:
+            texts = ["The quick brown fox jumps over the lazy dog.", "Customer 1042 renewed the contract in March."]
+        
+        self.stdout.write(f'Loading PyTorch and ONNX backends for {model_name}...')
+        reference = load_huggingface_embeddings(model_name)
+        candidate = OnnxEmbeddings(model_name=model_name, cache_dir=settings.ONNX_MODEL_DIR, quantize=True)
+        
+        result = check_parity(reference, candidate, texts, min_cosine=options['min_cosine'])
+        summary = (
+            f"{result['texts']} texts: min cosine {result['min_cosine']:.4f}, "
+            f"mean cosine {result['mean_cosine']:.4f}, ONNX model {candidate.model_bytes / 1024 / 1024:.1f} MB"
+        )
+        
+        if result['passed']:
+            self.stdout.write(self.style.SUCCESS(f'Parity OK - {summary}'))
+        else:
+            raise CommandError(f'Parity FAILED - {summary}')
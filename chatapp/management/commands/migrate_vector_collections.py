@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from utils.sharded_store import migrate_to_shards
+
+class Command(BaseCommand):
+    help = 'Move per-document vector collections into shared, user-sharded collections'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--persist-directory',
+            default='./chroma_db',
+            dest='persist_directory',
+            help='Chroma directory holding the per-document collections',
+        )
+        parser.add_argument(
+            '--shards',
+            type=int,
+            default=settings.VECTOR_SHARD_COUNT,
+            help='Number of shard collections to spread users over',
+        )
+        parser.add_argument(
+            '--delete-source',
+            action='store_true',
+            dest='delete_source',
+            help='Delete each per-document collection once it has been copied',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            help='Only report what would be migrated',
+        )
+    
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"Migrating collections in {options['persist_directory']} to {options['shards']} shards..."
+        )
+        
+        stats = migrate_to_shards(
+            persist_directory=options['persist_directory'],
+            shard_count=options['shards'],
+            delete_source=options['delete_source'],
+            dry_run=options['dry_run']
+        )
+        
+        action = 'Would migrate' if options['dry_run'] else 'Migrated'
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {stats['documents']} documents ({stats['chunks']} chunks), "
+            f"skipped {stats['skipped']} empty collections"
+        ))
@@ -16,6 +16,7 @@ class Document(models.Model):
     processing_error = models.TextField(blank=True, null=True)
     last_processed = models.DateTimeField(null=True, blank=True)
     processing_status = models.CharField(max_length=100, blank=True, null=True)  # New field for processing status
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)  # SHA-256 of the raw file or pasted content
     
     def __str__(self):
         return self.title
@@ -25,6 +26,29 @@ class Document(models.Model):
             return self.file.name.split('.')[-1].lower()
         return None
     
+    def compute_content_hash(self):
+        """Hash the uploaded file, or the pasted content for text-only documents"""
+        from .file_processor import compute_content_hash
+        if self.file:
+            return compute_content_hash(file=self.file)
+        return compute_content_hash(content=self.content)
+    
+    def find_processed_duplicate(self, across_users=False):
+        """Return an already processed document with the same content hash, if any"""
+        if not self.content_hash:
+            return None
+        
+        duplicates = Document.objects.filter(
+            content_hash=self.content_hash,
+            is_processed=True,
+            chunks__gt=0
+        ).exclude(id=self.id)
+        
+        if not across_users:
+            duplicates = duplicates.filter(uploaded_by=self.uploaded_by)
+        
+        return duplicates.order_by('-last_processed').first()
+    
     def save(self, *args, **kwargs):
         # Set file_type when saving if file is present
         if self.file:
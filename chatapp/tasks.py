@@ -2,6 +2,7 @@ from background_task import background
 import logging
 import time
 import os
+from django.conf import settings
 from django.utils.timezone import now
 
 # Set up logging
@@ -12,10 +13,17 @@ def process_document_background(document_id):
     """Process a document in the background to prevent request timeouts."""
     # We need to import models here to avoid circular imports
     from .models import Document
-    from .colab_client import ColabClient
+    from .colab_client import get_colab_client
     
     logger.info(f"Background task: Starting document processing for document {document_id}")
     
+    if settings.INGEST_PIPELINE:
+        # The stages run on the pipeline's threads; concurrent tasks overlap there
+        from .ingestion_pipeline import format_stats, get_ingestion_pipeline, ingest_document
+        ingest_document(document_id).wait()
+        logger.info(f"Ingestion pipeline after document {document_id}:\n{format_stats(get_ingestion_pipeline().stats())}")
+        return
+    
     try:
         # Get the document
         document = Document.objects.get(id=document_id)
@@ -24,7 +32,7 @@ def process_document_background(document_id):
         
         # Get the Colab API URL
         api_url = os.environ.get('COLAB_API_URL', 'http://localhost:5000')
-        colab_client = ColabClient(api_url=api_url)
+        colab_client = get_colab_client(api_url)
         
         # Check if API is available
         is_healthy = colab_client._check_health_simple()
@@ -34,14 +42,43 @@ def process_document_background(document_id):
             document.save()
             logger.error(f"Background task: API unavailable for document {document_id}")
             return
+        
+        # Identical content that was already processed only needs its vectors linked
+        if not document.content_hash:
+            document.content_hash = document.compute_content_hash()
+            document.save()
+        
+        duplicate = document.find_processed_duplicate(across_users=settings.DEDUP_ACROSS_USERS)
+        if duplicate:
+            try:
+                chunks_linked = colab_client.link_document(
+                    document_id=str(document.id),
+                    user_id=str(document.uploaded_by.id),
+                    source_document_id=str(duplicate.id),
+                    source_user_id=str(duplicate.uploaded_by.id)
+                )
+                if chunks_linked > 0:
+                    if not document.content:
+                        document.content = duplicate.content
+                    document.is_processed = True
+                    document.chunks = chunks_linked
+                    document.processing_status = "Complete"
+                    document.last_processed = now()
+                    document.save()
+                    logger.info(f"Document {document_id} reused {chunks_linked} chunks from document {duplicate.id}")
+                    return
+            except Exception as e:
+                logger.warning(f"Could not link document {document_id} to {duplicate.id}, processing normally: {str(e)}")
             
-        # Get content
+        # Get content; PDFs are parsed page by page while they are uploaded instead
+        from .file_processor import is_streamable
         content = document.content
-        if not content and document.file:
+        stream = bool(not content and document.file and is_streamable(document.file))
+        if not content and document.file and not stream:
             # Read file content
             from .file_processor import extract_content_from_file
             try:
-                content = extract_content_from_file(document.file)
+                content = extract_content_from_file(document.file, parallel=True)
                 document.content = content[:1000000]  # Limit content size if needed
                 document.save()
             except Exception as e:
@@ -51,7 +88,7 @@ def process_document_background(document_id):
                 logger.error(f"Background task: File read error for document {document_id}: {str(e)}")
                 return
         
-        if not content:
+        if not content and not stream:
             document.processing_error = "No content found in document"
             document.processing_status = "Failed - Empty content"
             document.save()
@@ -60,18 +97,37 @@ def process_document_background(document_id):
             
         # Process document with Colab API
         try:
-            logger.info(f"Processing document {document_id} with {len(content)} characters")
+            logger.info(f"Processing document {document_id} with {len(content) if content else 'streamed'} characters")
             document.processing_status = "Processing with API..."
             document.save()
             
-            # Process the document in chunks if needed
-            chunks_created = colab_client.process_document(
-                document_id=str(document.id),
-                content=content,
-                user_id=str(document.uploaded_by.id)
-            )
+            from .embeddings import embedding_backend
+            from .file_processor import LeadingText
+            # Streamed files keep the start of their text for previews and re-processing
+            leading_text = LeadingText()
+            if settings.INGEST_MODE == 'local' and colab_client.accepts_vectors_from(embedding_backend()):
+                chunks_created = ingest_locally(document, content, colab_client, on_page=leading_text)
+            elif stream:
+                from .file_processor import iter_document_pages
+                chunks_created = colab_client.process_document_pages(
+                    document_id=str(document.id),
+                    pages=(text for _, text in iter_document_pages(document.file, on_page=leading_text, parallel=True)),
+                    user_id=str(document.uploaded_by.id),
+                    content_hash=document.content_hash
+                )
+            else:
+                if settings.INGEST_MODE == 'local':
+                    logger.warning(f"API embeds with another model or backend, sending document {document_id} for remote embedding")
+                # Process the document in chunks if needed
+                chunks_created = colab_client.process_document(
+                    document_id=str(document.id),
+                    content=content,
+                    user_id=str(document.uploaded_by.id)
+                )
             
             # Update document status
+            if stream and leading_text.text:
+                document.content = leading_text.text
             document.is_processed = True
             document.chunks = chunks_created
             document.processing_status = "Complete"
@@ -99,11 +155,35 @@ def process_document_background(document_id):
         except:
             pass
 
+def ingest_locally(document, content, colab_client, on_page=None):
+    """Chunk and embed a document in this worker, sending the API only the vectors
+
+    Without content, the document's file is chunked page by page as the batches are
+    embedded, and on_page is called with the text of each page.
+    """
+    from .embeddings import embedding_backend, get_embedding_model
+    from .file_processor import iter_document_chunks, process_document_text
+    
+    # Queries are embedded by the API, so chunks must use the same model and backend
+    model_name = colab_client.embedding_model
+    if content:
+        chunks = process_document_text(content, document.id, document.uploaded_by.id)
+    else:
+        chunks = iter_document_chunks(document.file, document.id, document.uploaded_by.id, on_page=on_page, parallel=True)
+    return colab_client.ingest_chunks(
+        document_id=str(document.id),
+        user_id=str(document.uploaded_by.id),
+        chunks=chunks,
+        embedding_model=get_embedding_model(model_name),
+        model_name=model_name,
+        backend=embedding_backend()
+    )
+
 @background(schedule=30)
 def check_document_completion(document_id):
     """Final check for document processing status after giving API time to finish."""
     from .models import Document
-    from .colab_client import ColabClient
+    from .colab_client import get_colab_client
     import os
     
     try:
@@ -115,7 +195,7 @@ def check_document_completion(document_id):
             
             # Get the Colab API URL
             api_url = os.environ.get('COLAB_API_URL', 'http://localhost:5000')
-            colab_client = ColabClient(api_url=api_url)
+            colab_client = get_colab_client(api_url)
             
             # Check status
             status_info = colab_client.check_document_status(
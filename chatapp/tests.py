@@ -4,7 +4,7 @@ from django.contrib.auth.models import User
 from .models import Document, ChatSession, ChatMessage
 import json
 import os
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 
 class DocumentModelTest(TestCase):
     def setUp(self):
@@ -19,6 +19,26 @@ class DocumentModelTest(TestCase):
         self.assertEqual(document.title, 'Test Document')
         self.assertEqual(document.uploaded_by, self.user)
 
+    def test_find_processed_duplicate(self):
+        """Only processed documents with the same hash, owned by the same user, are reused."""
+        other_user = User.objects.create_user(username='otheruser', password='12345')
+        content = 'Identical contract text.'
+        original = Document.objects.create(
+            title='Original', content=content, uploaded_by=self.user,
+            is_processed=True, chunks=3
+        )
+        original.content_hash = original.compute_content_hash()
+        original.save()
+        
+        reupload = Document.objects.create(title='Re-upload', content=content, uploaded_by=self.user)
+        reupload.content_hash = reupload.compute_content_hash()
+        self.assertEqual(reupload.find_processed_duplicate(), original)
+        
+        foreign = Document.objects.create(title='Foreign', content=content, uploaded_by=other_user)
+        foreign.content_hash = foreign.compute_content_hash()
+        self.assertIsNone(foreign.find_processed_duplicate())
+        self.assertEqual(foreign.find_processed_duplicate(across_users=True), original)
+
 class ChatSessionTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='12345')
@@ -104,8 +124,8 @@ class APIViewTests(TestCase):
         # Create a test client with a dummy URL
         test_client = ColabClient(api_url="http://test-url.com")
         
-        # Mock the requests.post method
-        with patch('chatapp.colab_client.requests.post') as mock_post:
+        # Mock the pooled session's post method
+        with patch.object(test_client.session, 'post') as mock_post:
             # Set up mock for process_document
             mock_response_process = MagicMock()
             mock_response_process.status_code = 200
@@ -129,7 +149,7 @@ class APIViewTests(TestCase):
             # Check the result
             self.assertEqual(result, 5)  # We expect 5 chunks
             
-            # Check that requests.post was called with correct arguments for process_document
+            # Check that session.post was called with correct arguments for process_document
             self.assertEqual(mock_post.call_count, 1)
             args, kwargs = mock_post.call_args_list[0]
             self.assertEqual(args[0], 'http://test-url.com/process_document')
@@ -145,8 +165,915 @@ class APIViewTests(TestCase):
             # Check the response
             self.assertEqual(response, 'This is a test response')
             
-            # Check that requests.post was called with correct arguments for generate
+            # Check that session.post was called with correct arguments for generate
             self.assertEqual(mock_post.call_count, 2)
             args, kwargs = mock_post.call_args_list[1]
             self.assertEqual(args[0], 'http://test-url.com/generate')
             self.assertEqual(kwargs['json']['query'], "What is this document about?")
+
+class FileProcessorTests(TestCase):
+    def test_streamed_pdf_pages_match_single_shot_chunks(self):
+        """Chunking pages in windows should give the same chunks as chunking the whole text."""
+        import random
+        from chatapp.file_processor import process_document_pages, process_document_text
+        
+        words = "alpha beta gamma delta. epsilon zeta eta theta iota kappa. lambda mu".split(" ")
+        for seed in range(20):
+            rng = random.Random(seed)
+            # Irregular pages: empty ones, single long paragraphs, mixed separators
+            pages = []
+            for page in range(1, rng.randint(2, 30)):
+                paragraphs = [" ".join(rng.choice(words) for _ in range(rng.randint(1, 250))) for _ in range(rng.randint(0, 6))]
+                pages.append((page, rng.choice(["\n\n", "\n", " "]).join(paragraphs)))
+            
+            streamed = list(process_document_pages(iter(pages), 1, 2, total_pages=len(pages), window_chars=1500))
+            single_shot = process_document_text("\n".join(text for _, text in pages if text), 1, 2)
+            
+            self.assertEqual([chunk.page_content for chunk in streamed], [chunk.page_content for chunk in single_shot])
+            self.assertEqual([chunk.metadata["chunk_id"] for chunk in streamed], list(range(len(single_shot))))
+            if streamed:
+                self.assertEqual(streamed[0].metadata["page_number"], next(page for page, text in pages if text))
+    
+    def test_batch_extraction_preserves_order(self):
+        """Files extracted in worker processes should come back in upload order."""
+        import io
+        from chatapp.file_processor import extract_contents_from_files
+        
+        files = []
+        for i in range(4):
+            file = io.BytesIO(f"Contents of file {i}".encode('utf-8'))
+            file.name = f"file_{i}.txt"
+            files.append(file)
+        
+        results = extract_contents_from_files(files, max_workers=2)
+        self.assertEqual(results, [f"Contents of file {i}" for i in range(4)])
+
+class ColabClientTests(TestCase):
+    def test_reindex_document_finalizes_sliced_content(self):
+        """Sliced re-indexing should sum slice stats and delete stale chunks on finalize."""
+        from chatapp.colab_client import ColabClient
+        
+        test_client = ColabClient(api_url="http://test-url.com")
+        responses = [
+            {"chunks": 20, "added": 2, "reused": 18, "deleted": 0},
+            {"chunks": 5, "added": 0, "reused": 5, "deleted": 0},
+            {"status": "success", "chunks": 25, "deleted": 3},
+        ]
+        
+        with patch.object(ColabClient, '_make_api_request', side_effect=responses) as mock_request:
+            content = "\n\n".join(f"Paragraph {i} " + "word " * 150 for i in range(40))
+            stats = test_client.reindex_document(document_id="1", content=content, user_id="2")
+        
+        self.assertEqual(stats, {"chunks": 25, "added": 2, "reused": 23, "deleted": 3})
+        self.assertEqual(mock_request.call_args_list[0].kwargs['endpoint'], "reindex_document")
+        self.assertTrue(mock_request.call_args_list[2].kwargs['payload']['reindex'])
+    
+    def test_clients_share_pooled_session_per_url(self):
+        """Clients for the same API URL should reuse one keep-alive session and pool."""
+        from django.conf import settings
+        from chatapp.colab_client import ColabClient, get_colab_client
+        
+        first = ColabClient(api_url="http://pool-test.com/")
+        second = ColabClient(api_url="http://pool-test.com")
+        other = ColabClient(api_url="http://other-pool-test.com")
+        
+        self.assertIs(first.session, second.session)
+        self.assertIsNot(first.session, other.session)
+        self.assertIs(get_colab_client("http://pool-test.com"), get_colab_client("http://pool-test.com/"))
+        self.assertEqual(first.session.get_adapter("https://pool-test.com")._pool_maxsize, settings.COLAB_POOL_MAXSIZE)
+
+    def test_sliced_upload_resumes_from_checkpoint(self):
+        """A failed sliced upload should resume with only the slices that are missing."""
+        import tempfile
+        from django.test import override_settings
+        from chatapp.colab_client import ColabClient
+        
+        test_client = ColabClient(api_url="http://test-url.com")
+        content = "\n\n".join(f"Paragraph {i} " + "word " * 150 for i in range(5))
+        sent = []
+        
+        def fake_request(endpoint, payload, **kwargs):
+            if endpoint == "finalize_document":
+                return {"status": "success"}
+            sent.append(payload["slice_id"])
+            if payload["chunk_number"] == 3 and sent.count(payload["slice_id"]) == 1:
+                raise Exception("Slice failed")
+            return {"chunks": 2}
+        
+        with tempfile.TemporaryDirectory() as checkpoint_dir, \
+             override_settings(COLAB_UPLOAD_CHECKPOINT_DIR=checkpoint_dir, COLAB_UPLOAD_SLICE_CHARS=1000,
+                               COLAB_UPLOAD_CONCURRENCY=1), \
+             patch.object(test_client, '_make_api_request', side_effect=fake_request):
+            with self.assertRaises(Exception):
+                test_client.process_document(document_id="7", content=content, user_id="8")
+            first_attempt = list(sent)
+            
+            self.assertEqual(test_client.process_document(document_id="7", content=content, user_id="8"), 10)
+            self.assertEqual(os.listdir(checkpoint_dir), [])
+        
+        # Only the failed slice was sent twice, with the same ID both times
+        self.assertEqual(len(set(sent)), 5)
+        self.assertEqual(len(sent), 6)
+        self.assertEqual(sent[len(first_attempt)], first_attempt[3])
+
+class UploadSlicingTests(TestCase):
+    def test_slices_chunk_like_the_whole_text(self):
+        """Chunks kept from each slice should equal the chunks of the whole text, in order."""
+        from utils.slicing import iter_slices_for_upload, make_text_splitter, slice_for_upload
+        
+        words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta"]
+        paragraphs = []
+        for i in range(300):
+            sentences = [" ".join(words[(i * j + k) % len(words)] for k in range(3 + (i + j) % 20)) + "." for j in range(1 + i % 9)]
+            paragraphs.append(" ".join(sentences) + ("\nNote on line two." if i % 4 == 0 else ""))
+        text = "\n\n".join(paragraphs)
+        
+        splitter = make_text_splitter(add_start_index=True)
+        whole = [chunk.page_content for chunk in splitter.create_documents([text])]
+        
+        slices = slice_for_upload(text, max_chars=4000)
+        self.assertGreater(len(slices), 5)
+        self.assertTrue(all(len(piece["text"]) <= 4000 for piece in slices))
+        
+        chunks = []
+        for piece in slices:
+            self.assertEqual(piece["first_chunk"], len(chunks))
+            chunks.extend(
+                chunk.page_content for chunk in splitter.create_documents([piece["text"]])
+                if chunk.metadata["start_index"] < piece["owned"]
+            )
+        self.assertEqual(chunks, whole)
+        
+        # Slicing pages as they arrive keeps the same chunks
+        pages = ["\n\n".join(paragraphs[start:start + 7]) for start in range(0, len(paragraphs), 7)]
+        paged_text = "\n".join(pages)
+        paged_whole = [chunk.page_content for chunk in splitter.create_documents([paged_text])]
+        chunks = []
+        for piece in iter_slices_for_upload(iter(pages), max_chars=4000):
+            self.assertEqual(piece["first_chunk"], len(chunks))
+            self.assertEqual(paged_text[piece["offset"]:piece["offset"] + len(piece["text"])], piece["text"])
+            chunks.extend(
+                chunk.page_content for chunk in splitter.create_documents([piece["text"]])
+                if chunk.metadata["start_index"] < piece["owned"]
+            )
+        self.assertEqual(chunks, paged_whole)
+
+class HealthMonitorTests(TestCase):
+    def test_health_is_cached_and_refreshed_in_background(self):
+        """Fresh results should be reused, and stale ones returned while a refresh runs."""
+        from chatapp.colab_client import HealthMonitor
+        
+        probe = MagicMock(side_effect=[(True, "model-a"), (True, "model-b")])
+        monitor = HealthMonitor(probe, ttl=10)
+        
+        with patch('chatapp.colab_client.time.monotonic', return_value=100.0):
+            self.assertEqual(monitor.status(), (True, "model-a"))
+            self.assertEqual(monitor.status(), (True, "model-a"))
+        self.assertEqual(probe.call_count, 1)
+        
+        with patch('chatapp.colab_client.time.monotonic', return_value=120.0):
+            self.assertEqual(monitor.status(), (True, "model-a"))
+            monitor._refresh_thread.join()
+            self.assertEqual(monitor.status(), (True, "model-b"))
+        self.assertEqual(probe.call_count, 2)
+    
+    def test_circuit_opens_after_failures_and_fails_fast(self):
+        """Consecutive connection failures should stop further requests until the reset timeout."""
+        import requests
+        from chatapp.colab_client import ColabClient, CircuitOpenError
+        
+        test_client = ColabClient(api_url="http://breaker-test.com")
+        test_client.health.failure_threshold = 2
+        test_client.health.reset_timeout = 30
+        
+        with patch.object(test_client.session, 'post', side_effect=requests.exceptions.ConnectionError("down")) as mock_post, \
+             patch('chatapp.colab_client.time.sleep') as mock_sleep, \
+             patch('chatapp.colab_client.time.monotonic', return_value=100.0):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                test_client._make_api_request(endpoint="generate", payload={})
+            # The circuit opened on the second failure, so the last retry was skipped
+            self.assertEqual(mock_post.call_count, 2)
+            self.assertEqual(mock_sleep.call_count, 1)
+            
+            with self.assertRaises(CircuitOpenError):
+                test_client._make_api_request(endpoint="generate", payload={})
+            self.assertEqual(mock_post.call_count, 2)
+            self.assertEqual(test_client.check_health(), (False, "Circuit breaker open"))
+        
+        # After the reset timeout a trial request goes through and closes the circuit
+        ok = MagicMock(status_code=200)
+        ok.json.return_value = {"response": "ok"}
+        with patch.object(test_client.session, 'post', return_value=ok), \
+             patch('chatapp.colab_client.time.monotonic', return_value=131.0):
+            self.assertEqual(test_client._make_api_request(endpoint="generate", payload={}), {"response": "ok"})
+        self.assertFalse(test_client.health.is_open)
+
+class TransportTests(TestCase):
+    def test_compressed_body_reaches_app_as_json(self):
+        """The middleware should hand endpoints plain JSON whatever the wire encoding."""
+        import io
+        from utils.transport import DecodingMiddleware, encode_body
+        
+        payload = {"text": "word " * 1000, "document_id": "7"}
+        body, headers = encode_body(payload, encoding="gzip")
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertLess(len(body), len(json.dumps(payload)))
+        
+        seen = {}
+        def app(environ, start_response):
+            seen["body"] = environ["wsgi.input"].read(int(environ["CONTENT_LENGTH"]))
+            seen["encoding"] = environ.get("HTTP_CONTENT_ENCODING")
+            return [b""]
+        
+        DecodingMiddleware(app)({
+            "CONTENT_TYPE": headers["Content-Type"],
+            "HTTP_CONTENT_ENCODING": "gzip",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": io.BytesIO(body)
+        }, MagicMock())
+        self.assertEqual(json.loads(seen["body"]), payload)
+        self.assertIsNone(seen["encoding"])
+        
+        start_response = MagicMock()
+        DecodingMiddleware(app)({
+            "CONTENT_TYPE": "application/json",
+            "HTTP_CONTENT_ENCODING": "gzip",
+            "CONTENT_LENGTH": "9",
+            "wsgi.input": io.BytesIO(b"not gzip!")
+        }, start_response)
+        self.assertEqual(start_response.call_args.args[0], "400 BAD REQUEST")
+    
+    def test_responses_compressed_only_when_accepted_and_large(self):
+        """Small bodies and clients without gzip support should get the JSON unchanged."""
+        import gzip
+        from utils.transport import encode_response
+        
+        large = json.dumps({"response": "answer " * 500}).encode("utf-8")
+        body, headers = encode_response(large, accept_encoding="gzip, deflate")
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(body), large)
+        
+        self.assertIsNone(encode_response(large, accept_encoding="identity"))
+        self.assertIsNone(encode_response(large, accept_encoding="gzip;q=0"))
+        self.assertIsNone(encode_response(b'{"status": "ok"}', accept_encoding="gzip"))
+    
+    def test_client_compresses_once_api_advertises_support(self):
+        """Requests should stay plain JSON until the health check reports the API's encodings."""
+        import gzip
+        from chatapp.colab_client import ColabClient
+        
+        test_client = ColabClient(api_url="http://transport-test.com")
+        ok = MagicMock(status_code=200)
+        ok.json.return_value = {"status": "success"}
+        payload = {"text": "word " * 1000}
+        
+        with patch.object(test_client.session, 'post', return_value=ok) as mock_post:
+            test_client._make_api_request(endpoint="process_document", payload=payload)
+            self.assertEqual(mock_post.call_args.kwargs["json"], payload)
+            
+            health = MagicMock(status_code=200)
+            health.json.return_value = {"status": "ok", "model": "m", "transport": {"encodings": ["gzip"], "formats": ["application/json"]}}
+            with patch.object(test_client.session, 'get', return_value=health):
+                test_client.check_health(force=True)
+            
+            test_client._make_api_request(endpoint="process_document", payload=payload)
+            kwargs = mock_post.call_args.kwargs
+            self.assertEqual(kwargs["headers"]["Content-Encoding"], "gzip")
+            self.assertEqual(json.loads(gzip.decompress(kwargs["data"])), payload)
+
+class LocalIngestTests(TestCase):
+    def test_chunks_are_embedded_locally_and_sent_as_vectors(self):
+        """Local ingestion should send deduplicated vectors in batches, then finalize to drop stale chunks."""
+        from langchain_core.documents import Document as Chunk
+        from chatapp.colab_client import ColabClient
+        from utils.hashing import chunk_hash
+        
+        test_client = ColabClient(api_url="http://ingest-test.com")
+        health = MagicMock(status_code=200)
+        health.json.return_value = {"status": "ok", "model": "llm", "embedding_model": "intfloat/e5-small-v2"}
+        with patch.object(test_client.session, 'get', return_value=health):
+            test_client.check_health(force=True)
+        self.assertEqual(test_client.embedding_model, "intfloat/e5-small-v2")
+        self.assertTrue(test_client.accepts_vectors_from("pytorch"))
+        self.assertFalse(test_client.accepts_vectors_from("onnx-int8"))
+        
+        chunks = [Chunk(page_content=text, metadata={"chunk_id": i, "page_number": None})
+                  for i, text in enumerate(["alpha", "beta", "alpha", "gamma"])]
+        embedding_model = MagicMock()
+        embedding_model.embed_documents.side_effect = lambda texts: [[float(len(text)), 0.5] for text in texts]
+        
+        with patch.object(test_client, '_make_api_request', return_value={"status": "success"}) as mock_request:
+            stored = test_client.ingest_chunks("9", "3", chunks, embedding_model, test_client.embedding_model, batch_size=2)
+        
+        self.assertEqual(stored, 3)
+        upserts = [c.kwargs for c in mock_request.call_args_list if c.kwargs["endpoint"] == "upsert_vectors"]
+        self.assertEqual([u["payload"]["texts"] for u in upserts], [["alpha", "beta"], ["gamma"]])
+        self.assertTrue(all(u["payload"]["is_partial"] for u in upserts))
+        self.assertEqual(upserts[0]["payload"]["ids"][0], f"9:{chunk_hash('alpha')}")
+        self.assertEqual(upserts[0]["payload"]["embeddings"][1], [4.0, 0.5])
+        self.assertEqual(upserts[0]["payload"]["model"], "intfloat/e5-small-v2")
+        self.assertEqual(upserts[0]["payload"]["backend"], "pytorch")
+        self.assertEqual([u["payload"]["batch_number"] for u in upserts], [0, 1])
+        self.assertNotIn("page_number", upserts[0]["payload"]["metadatas"][0])
+        
+        finalize = mock_request.call_args_list[-1].kwargs
+        self.assertEqual(finalize["endpoint"], "finalize_document")
+        self.assertTrue(finalize["payload"]["reindex"])
+
+    def test_local_chunks_match_the_api_chunks(self):
+        """Locally made chunks should be the ones the API makes, so both modes share chunk IDs."""
+        from chatapp.file_processor import process_document_text
+        from utils.slicing import make_text_splitter
+        
+        text = "\n\n".join(f"Section {i}. " + "Some sentence about the topic. " * (i * 7) for i in range(1, 12))
+        local = [chunk.page_content for chunk in process_document_text(text, 1, 2)]
+        remote = [chunk.page_content for chunk in make_text_splitter().create_documents([text])]
+        self.assertEqual(local, remote)
+
+class IngestionPipelineTests(TestCase):
+    def test_full_stage_blocks_submit_until_it_drains(self):
+        """A stalled stage should back up into submit, and every stage should count its work."""
+        import queue
+        import threading
+        from utils.pipeline import Pipeline, Stage
+        
+        release = threading.Event()
+        results, errors = [], []
+        
+        def slow(item):
+            release.wait()
+            if item == 3:
+                raise ValueError("bad item")
+            return None if item == 4 else item
+        
+        pipeline = Pipeline([
+            Stage("first", lambda item: item, queue_size=1),
+            Stage("slow", slow, queue_size=1),
+            Stage("last", results.append, queue_size=1)
+        ], on_error=lambda item, stage, error: errors.append((item, stage)))
+        
+        for item in range(1, 5):
+            pipeline.submit(item)
+        # 1 in the slow stage, 2 queued for it, 3 held by the first stage, 4 queued for that
+        with self.assertRaises(queue.Full):
+            pipeline.submit(5, timeout=0.2)
+        
+        release.set()
+        pipeline.close()
+        pipeline.join(timeout=5)
+        
+        self.assertEqual(results, [1, 2])
+        self.assertEqual(errors, [(3, "slow")])
+        stages = {stage["stage"]: stage for stage in pipeline.stats()["stages"]}
+        self.assertEqual(stages["first"]["processed"], 4)
+        self.assertGreater(stages["first"]["blocked_seconds"], 0)
+        self.assertEqual((stages["slow"]["processed"], stages["slow"]["failed"]), (3, 1))
+        self.assertEqual(stages["last"]["processed"], 2)
+        self.assertEqual(stages["slow"]["queue_depth"], 0)
+    
+    def test_stages_ingest_locally_and_save_document_once(self):
+        """Local ingestion should embed here, upsert vectors and write the result in the finalize stage."""
+        from django.test import override_settings
+        from chatapp import ingestion_pipeline
+        
+        user = User.objects.create_user(username='ingester', password='pw')
+        document = Document.objects.create(title='Doc', content='First paragraph.\n\nSecond paragraph.', uploaded_by=user)
+        
+        client = MagicMock(embedding_model="intfloat/e5-small-v2")
+        client._check_health_simple.return_value = True
+        client.accepts_vectors_from.return_value = True
+        embedding_model = MagicMock()
+        embedding_model.embed_documents.side_effect = lambda texts: [[0.1, 0.2] for _ in texts]
+        
+        job = ingestion_pipeline.IngestionJob(document.id)
+        with override_settings(INGEST_MODE='local'), \
+             patch('chatapp.ingestion_pipeline.get_colab_client', return_value=client), \
+             patch('chatapp.embeddings.get_embedding_model', return_value=embedding_model) as get_model:
+            for stage in ingestion_pipeline.STAGES:
+                job = getattr(ingestion_pipeline, stage)(job) or job
+        
+        self.assertTrue(job.done.is_set())
+        get_model.assert_called_once_with("intfloat/e5-small-v2")
+        upsert = client.upsert_vectors.call_args.kwargs
+        self.assertEqual(upsert["model_name"], "intfloat/e5-small-v2")
+        self.assertEqual(upsert["vectors"], [[0.1, 0.2]])
+        client.finalize_vectors.assert_called_once_with(str(document.id), str(user.id))
+        client.process_document.assert_not_called()
+        
+        document.refresh_from_db()
+        self.assertEqual((document.is_processed, document.chunks, document.processing_status), (True, 1, "Complete"))
+        self.assertTrue(document.content_hash)
+        
+        # Failures keep what extraction found and explain themselves
+        failed = ingestion_pipeline.IngestionJob(document.id)
+        failed.document = document
+        ingestion_pipeline.record_failure(failed, "index", RuntimeError("timeout"))
+        document.refresh_from_db()
+        self.assertEqual(document.processing_status, "Failed - API error: timeout")
+        self.assertTrue(failed.done.is_set())
+    
+    def test_batches_extract_whole_files_together(self):
+        """Non-PDF files of a batch should be extracted in one call before their jobs are queued."""
+        from chatapp.ingestion_pipeline import ingest_documents
+        
+        user = User.objects.create_user(username='batcher', password='pw')
+        notes = Document.objects.create(title='Notes', file='documents/notes.txt', uploaded_by=user)
+        scan = Document.objects.create(title='Scan', file='documents/scan.pdf', uploaded_by=user)
+        pipeline = MagicMock()
+        
+        with patch('chatapp.ingestion_pipeline.extract_contents_from_files', return_value=["Notes text"]) as extract:
+            jobs = list(ingest_documents([notes.id, scan.id], pipeline=pipeline, batch_size=2))
+        
+        self.assertEqual([file.name for file in extract.call_args.args[0]], ['documents/notes.txt'])
+        self.assertEqual([(job.document_id, job.content) for job in jobs], [(notes.id, "Notes text"), (scan.id, None)])
+        self.assertEqual(pipeline.submit.call_count, 2)
+    
+    def test_pdfs_are_parsed_in_extract_and_uploaded_as_pages(self):
+        """PDFs should be parsed page by page by the extract stage, never as one text, and uploaded as pages."""
+        from chatapp import ingestion_pipeline
+        
+        user = User.objects.create_user(username='streamer', password='pw')
+        document = Document.objects.create(title='Scan', file='documents/scan.pdf', content_hash='abc', uploaded_by=user)
+        parsed = []
+        
+        def pages(file, on_page=None, parallel=False):
+            for number, text in enumerate(["Page one text.", "Page two text."], start=1):
+                parsed.append(number)
+                on_page(text)
+                yield number, text
+        
+        def upload(document_id, pages, user_id, content_hash):
+            self.assertEqual(list(pages), ["Page one text.", "Page two text."])
+            return 2
+        
+        client = MagicMock(embedding_model=None)
+        client._check_health_simple.return_value = True
+        client.accepts_vectors_from.return_value = False
+        client.process_document_pages.side_effect = upload
+        
+        job = ingestion_pipeline.IngestionJob(document.id)
+        with patch('chatapp.ingestion_pipeline.get_colab_client', return_value=client), \
+             patch('chatapp.ingestion_pipeline.iter_document_pages', side_effect=pages), \
+             patch('chatapp.ingestion_pipeline.extract_content_from_file') as extract:
+            job = ingestion_pipeline.extract(job)
+            self.assertEqual(parsed, [1, 2])  # The extract stage owns the parsing
+            client.process_document_pages.assert_not_called()
+            for stage in ingestion_pipeline.STAGES[1:]:
+                job = getattr(ingestion_pipeline, stage)(job) or job
+        
+        extract.assert_not_called()
+        document.refresh_from_db()
+        self.assertEqual((document.chunks, document.processing_status), (2, "Complete"))
+        self.assertEqual(document.content, "Page one text.\nPage two text.")
+
+class EmbeddingCacheTests(TestCase):
+    def setUp(self):
+        import tempfile
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+    
+    def test_cached_embeddings_only_embed_new_texts(self):
+        """Repeated and whitespace-variant texts should be served from the cache."""
+        from utils.embedding_cache import CachedEmbeddings, EmbeddingCache
+        
+        base = MagicMock()
+        base.embed_documents.side_effect = lambda texts: [[float(len(t)), 1.0] for t in texts]
+        cache = EmbeddingCache(os.path.join(self.temp_dir.name, 'cache.sqlite3'))
+        embeddings = CachedEmbeddings(base, model_name="test-model", cache=cache)
+        
+        first = embeddings.embed_documents(["alpha", "beta", "alpha"])
+        second = embeddings.embed_documents(["alpha  ", "gamma"])
+        
+        self.assertEqual(first, [[5.0, 1.0], [4.0, 1.0], [5.0, 1.0]])
+        self.assertEqual(second[0], [5.0, 1.0])
+        self.assertEqual(base.embed_documents.call_args_list[0].args[0], ["alpha", "beta"])
+        self.assertEqual(base.embed_documents.call_args_list[1].args[0], ["gamma"])
+        self.assertEqual(cache.stats()["hits"], 1)
+    
+    def test_cache_evicts_least_recently_used(self):
+        """The cache should stay under max_bytes by dropping the oldest vectors."""
+        from utils.embedding_cache import EmbeddingCache
+        
+        cache = EmbeddingCache(os.path.join(self.temp_dir.name, 'cache.sqlite3'), max_bytes=40)
+        cache.put_many([("a", [1.0, 2.0, 3.0, 4.0])])
+        cache.put_many([("b", [1.0, 2.0, 3.0, 4.0])])
+        cache.get_many(["a"])
+        cache.put_many([("c", [1.0, 2.0, 3.0, 4.0])])
+        
+        self.assertLessEqual(cache.total_bytes, 40)
+        self.assertEqual(set(cache.get_many(["a", "b", "c"])), {"a", "c"})
+
+class EmbeddingModelRegistryTests(TestCase):
+    def test_model_is_loaded_once_per_process(self):
+        """Repeated get_embedding_model calls should share a single loaded model."""
+        from chatapp import embeddings
+        
+        with patch.object(embeddings, 'HuggingFaceEmbeddings') as mock_model_class, \
+             patch.dict(embeddings._model_registry, clear=True), \
+             patch.dict(embeddings._model_stats, clear=True), \
+             self.settings(EMBEDDING_CACHE_PATH=''):
+            first = embeddings.get_embedding_model("test-model")
+            second = embeddings.get_embedding_model("test-model")
+            stats = embeddings.get_embedding_model_stats()
+        
+        self.assertIs(first, second)
+        self.assertEqual(mock_model_class.call_count, 1)
+        self.assertEqual(stats[0]["model_name"], "test-model")
+    
+    def test_cache_entries_are_kept_per_backend(self):
+        """ONNX int8 vectors should never be served from, or stored as, PyTorch cache entries."""
+        import tempfile
+        from chatapp import embeddings
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_path = os.path.join(temp_dir, 'cache.sqlite3')
+            names = {}
+            for backend in ('huggingface', 'onnx'):
+                with patch.object(embeddings, 'HuggingFaceEmbeddings'), \
+                     patch('utils.onnx_embeddings.OnnxEmbeddings'), \
+                     patch.dict(embeddings._model_registry, clear=True), \
+                     patch.dict(embeddings._model_stats, clear=True), \
+                     patch.dict(embeddings._embedding_caches, clear=True), \
+                     self.settings(EMBEDDING_CACHE_PATH=cache_path, EMBEDDING_BACKEND=backend, EMBEDDING_MICRO_BATCHING=False):
+                    names[backend] = embeddings.get_embedding_model("test-model").model_name
+        
+        self.assertEqual(names, {'huggingface': "test-model", 'onnx': "test-model@onnx-int8"})
+    
+    def test_micro_batching_merges_concurrent_requests(self):
+        """Concurrent embed calls should share forward passes and get their own vectors back."""
+        import threading
+        from utils.embedding_batcher import MicroBatchingEmbeddings
+        
+        base = MagicMock()
+        base.embed_documents.side_effect = lambda texts: [[float(len(t))] for t in texts]
+        batcher = MicroBatchingEmbeddings(base, max_batch_size=100, max_wait_ms=200)
+        
+        results = {}
+        def embed(i):
+            results[i] = batcher.embed_query("x" * i)
+        
+        threads = [threading.Thread(target=embed, args=(i,)) for i in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(results, {i: [float(i)] for i in range(1, 9)})
+        self.assertLess(base.embed_documents.call_count, 8)
+    
+    def test_queries_go_ahead_of_bulk_documents(self):
+        """Large requests should be embedded in max_batch_size pieces, with a waiting query in the next one."""
+        import threading
+        import time
+        from utils.embedding_batcher import MicroBatchingEmbeddings
+        
+        started, release = threading.Event(), threading.Event()
+        calls = []
+        def embed_documents(texts):
+            calls.append(list(texts))
+            started.set()
+            release.wait(5)
+            return [[float(len(t))] for t in texts]
+        
+        base = MagicMock()
+        base.embed_documents.side_effect = embed_documents
+        batcher = MicroBatchingEmbeddings(base, max_batch_size=4, max_wait_ms=50)
+        
+        results = {}
+        bulk = threading.Thread(target=lambda: results.update(documents=batcher.embed_documents(["d" * i for i in range(1, 11)])))
+        bulk.start()
+        started.wait(5)
+        query = threading.Thread(target=lambda: results.update(query=batcher.embed_query("q")))
+        query.start()
+        while batcher.stats()["queued_requests"] < 2:
+            time.sleep(0.01)
+        release.set()
+        bulk.join(5)
+        query.join(5)
+        
+        self.assertEqual([len(call) for call in calls], [4, 4, 3])
+        self.assertEqual(calls[1][0], "q")
+        self.assertEqual(results["query"], [1.0])
+        self.assertEqual(results["documents"], [[float(i)] for i in range(1, 11)])
+    
+    def test_parity_check_reports_cosine_agreement(self):
+        """check_parity should pass identical backends and fail diverging ones."""
+        from utils.onnx_embeddings import check_parity
+        
+        reference = MagicMock()
+        reference.embed_documents.return_value = [[1.0, 0.0], [0.0, 1.0]]
+        same = MagicMock()
+        same.embed_documents.return_value = [[2.0, 0.0], [0.0, 3.0]]
+        different = MagicMock()
+        different.embed_documents.return_value = [[1.0, 0.0], [1.0, 0.0]]
+        
+        self.assertTrue(check_parity(reference, same, ["a", "b"])["passed"])
+        result = check_parity(reference, different, ["a", "b"])
+        self.assertFalse(result["passed"])
+        self.assertAlmostEqual(result["min_cosine"], 0.0)
+
+class HybridRetrievalTests(TestCase):
+    def test_bm25_ranks_exact_codes_first(self):
+        """BM25 should find the chunk containing a code and survive a save/load round trip."""
+        import tempfile
+        from utils.hybrid_search import BM25Index
+        
+        index = BM25Index.from_texts(
+            ["Invoice INV-2023-001 was paid", "Invoice totals by month", "Customer list and addresses"],
+            ids=["a", "b", "c"]
+        )
+        self.assertEqual(index.search("status of INV-2023-001", k=1)[0][0], "a")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bm25", "index.json")
+            index.save(path)
+            self.assertEqual(BM25Index.load(path).search("customer addresses", k=1)[0][0], "c")
+    
+    def test_hybrid_retriever_fuses_vector_and_keyword_hits(self):
+        """Chunks found by either ranking should be returned, with agreement ranked first."""
+        from langchain_core.documents import Document as LCDocument
+        from chatapp.embeddings import create_hybrid_retriever
+        from utils.hashing import chunk_hash
+        from utils.hybrid_search import BM25Index
+        
+        texts = ["general overview of the product", "part number XK-42 specification", "pricing overview"]
+        index = BM25Index.from_texts(texts)
+        
+        retriever = MagicMock()
+        retriever.get_relevant_documents.return_value = [LCDocument(page_content=texts[2]), LCDocument(page_content=texts[0])]
+        vectorstore = MagicMock()
+        vectorstore.get.return_value = {"documents": [texts[1]], "metadatas": [{"chunk_hash": chunk_hash(texts[1])}]}
+        
+        hybrid = create_hybrid_retriever(retriever, bm25_index=index, vectorstore=vectorstore, k=3)
+        docs = hybrid.get_relevant_documents("XK-42 overview")
+        
+        self.assertEqual({doc.page_content for doc in docs}, set(texts))
+        self.assertIs(create_hybrid_retriever(retriever), retriever)
+
+class NumpyVectorStoreTests(TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        
+        self.embedding = MagicMock()
+        vectors = {"apples": [1.0, 0.0, 0.0], "pears": [0.8, 0.6, 0.0], "cars": [0.0, 0.0, 1.0]}
+        self.embedding.embed_documents.side_effect = lambda texts: [vectors[t] for t in texts]
+        self.embedding.embed_query.side_effect = lambda text: vectors[text]
+    
+    def test_top_k_search_filter_and_reload(self):
+        """Exact top-k should rank by cosine, honour filters and survive reopening from disk."""
+        from utils.numpy_store import NumpyVectorStore
+        
+        path = os.path.join(self.tmp.name, "store")
+        store = NumpyVectorStore.from_texts(
+            ["apples", "pears", "cars"], self.embedding,
+            metadatas=[{"kind": "fruit"}, {"kind": "fruit"}, {"kind": "vehicle"}],
+            ids=["a", "p", "c"], path=path
+        )
+        self.assertEqual([d.page_content for d in store.similarity_search("apples", k=2)], ["apples", "pears"])
+        self.assertEqual([d.page_content for d in store.similarity_search("apples", k=2, filter={"kind": "vehicle"})], ["cars"])
+        
+        # Scores are Chroma-style distances: lower is better
+        scores = [score for _, score in store.similarity_search_with_score("apples", k=3)]
+        self.assertEqual(scores, sorted(scores))
+        self.assertAlmostEqual(scores[0], 0.0, places=5)
+        self.assertAlmostEqual(scores[1], 0.4, places=5)
+        
+        store.delete(ids=["a"])
+        reopened = NumpyVectorStore(path, self.embedding)
+        self.assertEqual(reopened.get(include=[])["ids"], ["p", "c"])
+        self.assertEqual(reopened.similarity_search("apples", k=1)[0].page_content, "pears")
+    
+    def test_mmr_prefers_diverse_candidates(self):
+        """MMR should skip a near-duplicate of the first pick when diversity is weighted in."""
+        from utils.mmr import mmr_select
+        
+        query = [1.0, 0.0]
+        candidates = [[1.0, 0.0], [0.99, 0.01], [0.6, 0.8]]
+        self.assertEqual(mmr_select(query, candidates, k=2, lambda_mult=1.0), [0, 1])
+        self.assertEqual(mmr_select(query, candidates, k=2, lambda_mult=0.3), [0, 2])
+        self.assertEqual(mmr_select(query, [], k=2), [])
+
+class CollectionRegistryTests(TestCase):
+    def test_lru_eviction_by_count_and_size(self):
+        """The registry should evict least recently used stores and reload them lazily."""
+        from utils.collection_registry import CollectionRegistry
+        
+        registry = CollectionRegistry(max_entries=2, max_bytes=250, sizer=lambda store: store["bytes"])
+        loader = MagicMock(side_effect=lambda: {"bytes": 100})
+        
+        registry.get_or_load("a", loader)
+        registry.get_or_load("b", loader)
+        registry.get_or_load("a", loader)  # hit: "b" becomes least recently used
+        registry.get_or_load("c", loader)
+        
+        self.assertEqual(registry.keys(), ["a", "c"])
+        self.assertEqual(loader.call_count, 3)
+        
+        registry["d"] = {"bytes": 200}
+        self.assertEqual(registry.keys(), ["d"])
+        
+        stats = registry.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"]), (1, 3, 3))
+        self.assertEqual(stats["bytes"], 200)
+
+class ShardedStoreTests(TestCase):
+    def test_partition_filters_and_namespaces_chunks(self):
+        """A partition should map to a stable shard and scope every call to its document."""
+        from utils.sharded_store import PartitionedVectorStore, open_partition, shard_for_user
+        
+        self.assertEqual(shard_for_user("42", 16), shard_for_user(42, 16))
+        self.assertTrue(0 <= shard_for_user("42", 16) < 16)
+        
+        shard = MagicMock()
+        shard._collection.get.return_value = {"ids": ["7/3:abc"], "documents": ["text"], "metadatas": [{}]}
+        partition = PartitionedVectorStore(shard, user_id=7, document_id=3)
+        
+        partition.add_texts(["text"], metadatas=[{"chunk_id": 0}], ids=["3:abc"])
+        _, kwargs = shard.add_texts.call_args
+        self.assertEqual(kwargs["ids"], ["7/3:abc"])
+        self.assertEqual(kwargs["metadatas"][0], {"chunk_id": 0, "user_id": "7", "document_id": "3"})
+        
+        self.assertEqual(partition.get()["ids"], ["3:abc"])
+        partition.similarity_search("query", k=2, filter={"is_csv": True})
+        _, kwargs = shard.similarity_search.call_args
+        self.assertEqual(kwargs["filter"], {"$and": [{"user_id": "7"}, {"document_id": "3"}, {"is_csv": True}]})
+        
+        with self.assertRaises(ValueError):
+            open_partition("document_chunks", embedding_function=None)
+
+class MultiDocumentSearchTests(TestCase):
+    def test_scatter_gather_merges_global_top_k(self):
+        """Hits from several documents should be merged by score and tagged with their document."""
+        import tempfile
+        from utils.multi_document_search import CentroidIndex, scatter_gather_search
+        from utils.numpy_store import NumpyVectorStore
+        
+        vectors = {"cats": [1.0, 0.0], "kittens": [0.9, 0.1], "engines": [0.0, 1.0], "pistons": [0.1, 0.9]}
+        embedding = MagicMock()
+        embedding.embed_documents.side_effect = lambda texts: [vectors[t] for t in texts]
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            pets = NumpyVectorStore.from_texts(["cats", "engines"], embedding, path=os.path.join(tmp, "pets"))
+            cars = NumpyVectorStore.from_texts(["kittens", "pistons"], embedding, path=os.path.join(tmp, "cars"))
+            
+            hits = scatter_gather_search([1.0, 0.0], {"1": pets, "2": cars}, k=2)
+            self.assertEqual([(label, doc.page_content) for _, label, doc in hits], [("1", "cats"), ("2", "kittens")])
+            
+            centroids = CentroidIndex(os.path.join(tmp, "centroids.json"))
+            centroids.update("pets", NumpyVectorStore.from_texts(["cats", "kittens"], embedding, path=os.path.join(tmp, "p2")))
+            centroids.update("cars", NumpyVectorStore.from_texts(["engines", "pistons"], embedding, path=os.path.join(tmp, "c2")))
+            self.assertEqual(CentroidIndex(centroids.path).rank([0.0, 1.0], ["pets", "cars", "new"], max_documents=2), ["cars", "pets"])
+    
+    def test_multi_document_view_only_searches_own_documents(self):
+        """The view should pass only the user's processed documents and label sources with titles."""
+        user = User.objects.create_user(username='multi', password='pw')
+        other = User.objects.create_user(username='other', password='pw')
+        mine = Document.objects.create(title='Mine', uploaded_by=user, is_processed=True)
+        Document.objects.create(title='Theirs', uploaded_by=other, is_processed=True)
+        
+        client = Client()
+        client.login(username='multi', password='pw')
+        with patch('chatapp.views.colab_client') as mock_client:
+            mock_client.generate_multi_document_response.return_value = {
+                "response": "Answer [Document %d]" % mine.id,
+                "sources": [{"document_id": str(mine.id), "score": 0.9}]
+            }
+            response = client.post(reverse('multi_document_query'), {'message': 'question'})
+        
+        data = response.json()
+        self.assertEqual(data['status'], 'success')
+        self.assertEqual(data['sources'][0]['document_title'], 'Mine')
+        _, kwargs = mock_client.generate_multi_document_response.call_args
+        self.assertEqual(kwargs['document_ids'], [str(mine.id)])
+        
+        response = client.post(reverse('multi_document_query'), {'message': 'question', 'document_ids': ['1', 'x']})
+        self.assertEqual(response.status_code, 400)
+
+class AnswerCacheTests(TestCase):
+    def test_similar_questions_share_answers_until_invalidated(self):
+        """Near-identical questions should hit, unrelated ones miss, and invalidation clear the scope."""
+        from utils.answer_cache import SemanticAnswerCache
+        
+        cache = SemanticAnswerCache(threshold=0.95, ttl_seconds=3600)
+        scope = ("user_1_doc_1", 1)
+        cache.store(scope, [1.0, 0.0], "What is the total?", "42")
+        
+        self.assertEqual(cache.lookup(scope, [0.99, 0.05]), "42")
+        self.assertIsNone(cache.lookup(scope, [0.0, 1.0]))
+        self.assertIsNone(cache.lookup(("user_1_doc_1", 2), [1.0, 0.0]))
+        
+        cache.invalidate("user_1_doc_1")
+        self.assertIsNone(cache.lookup(scope, [1.0, 0.0]))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+    
+    def test_expired_answers_are_not_served(self):
+        """Answers older than the TTL should be dropped."""
+        from utils.answer_cache import SemanticAnswerCache
+        
+        cache = SemanticAnswerCache(ttl_seconds=60)
+        with patch('utils.answer_cache.time.time', return_value=1000.0):
+            cache.store("scope", [1.0, 0.0], "q", "a")
+        with patch('utils.answer_cache.time.time', return_value=1100.0):
+            self.assertIsNone(cache.lookup("scope", [1.0, 0.0]))
+
+class RetrievalCacheTests(TestCase):
+    def test_repeat_queries_skip_search_until_invalidated(self):
+        """Equivalent queries should reuse results; a new version or invalidation should search again."""
+        from utils.retrieval_cache import RetrievalCache
+        
+        cache = RetrievalCache(max_entries=2)
+        search = MagicMock(return_value=["chunk"])
+        
+        cache.get_or_search("user_1_doc_1", 1, "What is the total?", 6, search)
+        self.assertEqual(cache.get_or_search("user_1_doc_1", 1, "what is  the TOTAL?", 6, search), ["chunk"])
+        self.assertEqual(search.call_count, 1)
+        
+        cache.get_or_search("user_1_doc_1", 2, "What is the total?", 6, search)
+        cache.get_or_search("user_1_doc_1", 1, "What is the total?", 6, search, filter={"is_csv": True})
+        self.assertEqual(search.call_count, 3)
+        self.assertEqual(cache.evictions, 1)
+        
+        cache.invalidate("user_1_doc_1")
+        self.assertEqual(cache.stats()["entries"], 0)
+    
+    def test_delete_view_removes_document_from_api(self):
+        """Deleting a processed document should also delete it on the API."""
+        user = User.objects.create_user(username='deleter', password='pw')
+        document = Document.objects.create(title='Doc', uploaded_by=user, is_processed=True)
+        
+        client = Client()
+        client.login(username='deleter', password='pw')
+        with patch('chatapp.views.colab_client') as mock_client:
+            response = client.post(reverse('delete_document', args=[document.id]))
+        
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Document.objects.filter(id=document.id).exists())
+        mock_client.delete_document.assert_called_once_with(document_id=str(document.id), user_id=str(user.id))
+
+class StreamingChatTests(TestCase):
+    def test_stream_view_relays_tokens_and_saves_answer(self):
+        """Tokens should be streamed as events and the joined answer saved once done."""
+        user = User.objects.create_user(username='streamer', password='pw')
+        document = Document.objects.create(title='Doc', uploaded_by=user, is_processed=True)
+        
+        client = Client()
+        client.login(username='streamer', password='pw')
+        with patch('chatapp.views.colab_client') as mock_client:
+            mock_client.stream_response.return_value = iter(['Hello', ', ', 'world'])
+            response = client.post(reverse('chat_stream', args=[document.id]), {'message': 'Hi?'})
+            body = b''.join(response.streaming_content).decode()
+        
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = [json.loads(line[len('data: '):]) for line in body.split('\n\n') if line.startswith('data: ')]
+        self.assertEqual(events[0]['user_message']['content'], 'Hi?')
+        self.assertEqual([event['token'] for event in events if 'token' in event], ['Hello', ', ', 'world'])
+        self.assertTrue(events[-1]['done'])
+        
+        messages = ChatMessage.objects.filter(session__document=document).order_by('timestamp')
+        self.assertEqual([(m.is_user, m.message) for m in messages], [(True, 'Hi?'), (False, 'Hello, world')])
+
+class AsyncChatTests(TestCase):
+    def test_async_message_endpoint_saves_exchange(self):
+        """The async endpoint should answer through the async client and save both messages."""
+        user = User.objects.create_user(username='asyncer', password='pw')
+        document = Document.objects.create(title='Doc', uploaded_by=user, is_processed=True)
+        
+        client = Client()
+        client.login(username='asyncer', password='pw')
+        with patch('chatapp.views.async_colab_client') as mock_client:
+            mock_client.generate_response = AsyncMock(return_value='Async answer')
+            response = client.post(reverse('chat_message_async', args=[document.id]), {'message': 'Hi?'})
+        
+        data = response.json()
+        self.assertEqual(data['status'], 'success')
+        self.assertEqual(data['ai_message']['content'], 'Async answer')
+        self.assertEqual(mock_client.generate_response.await_args.kwargs['conversation_history'],
+                         [{"role": "user", "content": "Hi?"}])
+        
+        messages = ChatMessage.objects.filter(session__document=document).order_by('timestamp')
+        self.assertEqual([(m.is_user, m.message) for m in messages], [(True, 'Hi?'), (False, 'Async answer')])
+    
+    def test_async_client_reuses_session_and_cached_health(self):
+        """Async requests should share one keep-alive client per URL and the sync client's health cache."""
+        import asyncio
+        import httpx
+        from chatapp.colab_client import AsyncColabClient, get_async_session, get_colab_client
+        
+        paths = []
+        
+        def handler(request):
+            paths.append(request.url.path)
+            return httpx.Response(200, json={"response": "Answer"})
+        
+        async def ask_twice():
+            self.assertIs(get_async_session("http://api.test/"), get_async_session("http://api.test"))
+            client = AsyncColabClient("http://api.test")
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as session:
+                with patch('chatapp.colab_client.get_async_session', return_value=session):
+                    return [await client.generate_response("Hi?", "1", "2") for _ in range(2)]
+        
+        get_colab_client("http://api.test").health.record_success("model")
+        self.assertEqual(asyncio.run(ask_twice()), ["Answer", "Answer"])
+        self.assertEqual(paths, ["/generate", "/generate"])  # No health check per request
@@ -5,6 +5,7 @@ import uuid
 import logging
 from nltk.tokenize import sent_tokenize
 from datetime import datetime
+from utils.numpy_store import chroma_settings
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -116,6 +117,7 @@ def create_vectorstore(chunks, embedding_function, document_id, user_id):
         embedding=embedding_function,
         collection_name=f"user_{user_id}_doc_{document_id}",
         persist_directory="./chroma_db",
+        client_settings=chroma_settings(),
         collection_metadata={
             "document_id": str(document_id),
             "user_id": str(user_id),
@@ -6,10 +6,11 @@ from django.contrib.admin.views.decorators import staff_member_required
 from .forms import CustomUserCreationForm, DocumentUploadForm
 from django.contrib.auth.forms import AuthenticationForm
 from .models import Document, ChatSession, ChatMessage
-from .colab_client import ColabClient
+from .colab_client import AsyncColabClient, get_colab_client
+import json
 import logging
 import os
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.utils.timezone import now
 from django.conf import settings
 from django.utils import timezone
@@ -20,7 +21,8 @@ logger = logging.getLogger(__name__)
 
 # Initialize the Colab client with the URL from settings
 COLAB_API_URL = settings.COLAB_API_URL
-colab_client = ColabClient(api_url=COLAB_API_URL)
+colab_client = get_colab_client(COLAB_API_URL)
+async_colab_client = AsyncColabClient(api_url=COLAB_API_URL)
 
 def register_view(request):
     if request.method == 'POST':
@@ -79,9 +81,6 @@ def chat_view(request, document_id):
     # Fetch chat messages for this session
     chat_messages = ChatMessage.objects.filter(session=session).order_by('timestamp')
     
-    # Check if API is active
-    api_active, _ = colab_client.check_health()
-    
     # When generating response, include previous messages for context
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest' and request.method == 'POST':
         message_text = request.POST.get('message', '').strip()
@@ -160,8 +159,8 @@ def chat_view(request, document_id):
                     # Get document content
                     content = document.content
                     if not content and document.file:
-                        with open(document.file.path, 'r', encoding='utf-8') as f:
-                            content = f.read()
+                        from .file_processor import extract_content_from_file
+                        content = extract_content_from_file(document.file)
                     
                     # Process document using Colab API
                     chunks_created = colab_client.process_document(
@@ -263,7 +262,7 @@ def chat_view(request, document_id):
             
             return redirect('chat', document_id=document_id)
     
-    # Check API status
+    # Check API status (cached by the client's health monitor)
     try:
         api_active, _ = colab_client.check_health()
     except:
@@ -275,6 +274,186 @@ def chat_view(request, document_id):
         'api_active': api_active
     })
 
+def _message_payload(msg):
+    """JSON-ready message with its timestamp in IST, as the chat page displays it"""
+    ist = pytz.timezone('Asia/Kolkata')
+    return {
+        'id': msg.id,
+        'content': msg.message,
+        'timestamp': msg.timestamp.astimezone(ist).strftime('%b %d, %Y, %I:%M %p')
+    }
+
+@login_required
+def chat_stream(request, document_id):
+    """Stream the AI response to a chat message as server-sent events, saving it once complete"""
+    document = get_object_or_404(Document, id=document_id, uploaded_by=request.user)
+    
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'error': 'POST required'}, status=405)
+    
+    message_text = request.POST.get('message', '').strip()
+    if not message_text:
+        return JsonResponse({'status': 'error', 'error': 'Message cannot be empty'})
+    
+    # Continue the latest session, as chat_view does
+    session_id = request.POST.get('session_id')
+    if session_id:
+        session = get_object_or_404(ChatSession, id=session_id, document=document)
+    else:
+        session = ChatSession.objects.filter(user=request.user, document=document).order_by('-created_at').first()
+        if session is None:
+            session = ChatSession.objects.create(user=request.user, document=document)
+    
+    user_msg = ChatMessage.objects.create(session=session, is_user=True, message=message_text)
+    
+    # Get recent message history (last 3 exchanges = 6 messages)
+    recent_messages = ChatMessage.objects.filter(session=session).order_by('-timestamp')[:6]
+    conversation_history = [
+        {"role": "user" if msg.is_user else "assistant", "content": msg.message}
+        for msg in reversed(recent_messages)
+    ]
+    
+    def event(payload):
+        return f"data: {json.dumps(payload)}\n\n"
+    
+    def events():
+        yield event({'user_message': _message_payload(user_msg)})
+        
+        parts = []
+        try:
+            for token in colab_client.stream_response(
+                query=message_text,
+                document_id=str(document.id),
+                user_id=str(request.user.id),
+                conversation_history=conversation_history
+            ):
+                parts.append(token)
+                yield event({'token': token})
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            ai_msg = ChatMessage.objects.create(
+                session=session,
+                is_user=False,
+                message=f"I'm sorry, but I encountered an error trying to answer your question. Error: {str(e)}"
+            )
+            yield event({'status': 'error', 'ai_message': _message_payload(ai_msg)})
+            return
+        
+        # Persist the answer only once the whole of it has arrived
+        ai_msg = ChatMessage.objects.create(session=session, is_user=False, message="".join(parts))
+        yield event({'status': 'success', 'done': True, 'ai_message': _message_payload(ai_msg)})
+    
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+async def chat_message_async(request, document_id):
+    """
+    Async version of chat_view's AJAX message endpoint.
+    
+    Served under ASGI, the worker is free to handle other requests while the
+    LLM answers, since both the API call and the ORM queries are awaited.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'error': 'POST required'}, status=405)
+    
+    user = await request.auser()
+    try:
+        document = await Document.objects.aget(id=document_id, uploaded_by=user)
+    except Document.DoesNotExist:
+        raise Http404("Document not found")
+    
+    message_text = request.POST.get('message', '').strip()
+    if not message_text:
+        return JsonResponse({'status': 'error', 'error': 'Message cannot be empty'})
+    
+    # Continue the latest session, as chat_view does
+    session_id = request.POST.get('session_id')
+    if session_id:
+        try:
+            session = await ChatSession.objects.aget(id=session_id, document=document)
+        except ChatSession.DoesNotExist:
+            raise Http404("Chat session not found")
+    else:
+        session = await ChatSession.objects.filter(user=user, document=document).order_by('-created_at').afirst()
+        if session is None:
+            session = await ChatSession.objects.acreate(user=user, document=document)
+    
+    user_msg = await ChatMessage.objects.acreate(session=session, is_user=True, message=message_text)
+    
+    # Get recent message history (last 3 exchanges = 6 messages)
+    recent_messages = [msg async for msg in ChatMessage.objects.filter(session=session).order_by('-timestamp')[:6]]
+    conversation_history = [
+        {"role": "user" if msg.is_user else "assistant", "content": msg.message}
+        for msg in reversed(recent_messages)
+    ]
+    
+    try:
+        ai_response = await async_colab_client.generate_response(
+            query=message_text,
+            document_id=str(document.id),
+            user_id=str(user.id),
+            conversation_history=conversation_history
+        )
+        status = 'success'
+    except Exception as e:
+        logger.error(f"Error generating response: {str(e)}")
+        ai_response = f"I'm sorry, but I encountered an error trying to answer your question. Error: {str(e)}"
+        status = 'error'
+    
+    ai_msg = await ChatMessage.objects.acreate(session=session, is_user=False, message=ai_response)
+    
+    return JsonResponse({
+        'status': status,
+        'user_message': _message_payload(user_msg),
+        'ai_message': _message_payload(ai_msg)
+    })
+
+@login_required
+def multi_document_query(request):
+    """Answer a question from several of the user's documents, citing the document behind each source"""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'error': 'POST required'}, status=405)
+    
+    query = request.POST.get('message', '').strip()
+    if not query:
+        return JsonResponse({'status': 'error', 'error': 'Message cannot be empty'})
+    
+    # Only search the user's own processed documents (all of them unless a subset was selected)
+    documents = Document.objects.filter(uploaded_by=request.user, is_processed=True)
+    try:
+        selected_ids = [int(document_id) for document_id in request.POST.getlist('document_ids')]
+    except ValueError:
+        return JsonResponse({'status': 'error', 'error': 'Invalid document ID'}, status=400)
+    if selected_ids:
+        documents = documents.filter(id__in=selected_ids)
+    titles = {str(document.id): document.title for document in documents}
+    
+    if not titles:
+        return JsonResponse({'status': 'error', 'error': 'No processed documents to search'})
+    
+    try:
+        result = colab_client.generate_multi_document_response(
+            query=query,
+            user_id=str(request.user.id),
+            document_ids=list(titles.keys())
+        )
+    except Exception as e:
+        logger.error(f"Error in multi-document query: {str(e)}")
+        return JsonResponse({'status': 'error', 'error': str(e)})
+    
+    sources = [
+        dict(source, document_title=titles.get(str(source.get('document_id')), ''))
+        for source in result['sources']
+    ]
+    return JsonResponse({
+        'status': 'success',
+        'response': result['response'],
+        'sources': sources
+    })
+
 @login_required
 def document_list(request):
     """View function that displays all documents uploaded by the current user."""
@@ -289,34 +468,22 @@ def upload_document(request):
         if form.is_valid():
             document = form.save(commit=False)
             document.uploaded_by = request.user
+            # Hashing, duplicate linking and text extraction happen in the background
+            # (the ingestion pipeline's extract stage), so the upload is saved once
+            document.is_processed = False
+            document.processing_status = "processing"
             document.save()
             
             try:
-                # Extract content as before
-                if document.file:
-                    from .file_processor import extract_content_from_file
-                    content = extract_content_from_file(document.file)
-                    document.content = content
-                    document.save()
-                else:
-                    content = document.content
-                    
-                # Start background processing and continue
                 from .tasks import process_document_background
                 process_document_background.delay(document.id)
                 
-                # Mark document as processing
-                document.is_processed = False
-                document.processing_status = "processing"
-                document.save()
-                
                 messages.success(request, "Document uploaded and processing started. You can use it once processing completes.")
                 return redirect('documents')
                 
             except Exception as e:
                 document.processing_error = str(e)
-                document.is_processed = False
-                document.save()
+                document.save(update_fields=['processing_error'])
                 messages.error(request, f"Error preparing document: {str(e)}")
                 
         else:
@@ -337,11 +504,11 @@ def api_status(request):
     from django.conf import settings
     api_url = settings.COLAB_API_URL
     
-    # Initialize the client
-    client = ColabClient(api_url)
+    # Use the shared client (and its pooled connections)
+    client = get_colab_client(api_url)
     
-    # Check health and get status
-    is_healthy, model_info = client.check_health()
+    # Check health and get status; always probe here rather than use the cache
+    is_healthy, model_info = client.check_health(force=True)
     
     # Check if a new URL was submitted
     if request.method == 'POST' and 'api_url' in request.POST:
@@ -353,12 +520,12 @@ def api_status(request):
             messages.success(request, f"API URL updated to: {new_url}")
             
             # Initialize ColabClient globally with new URL
-            global colab_client
-            colab_client = ColabClient(api_url=new_url)
+            global colab_client, async_colab_client
+            colab_client = get_colab_client(new_url)
+            async_colab_client = AsyncColabClient(api_url=new_url)
             
             # Test the new URL
-            test_client = ColabClient(new_url)
-            is_healthy, model_info = test_client.check_health()
+            is_healthy, model_info = colab_client.check_health(force=True)
             
             if is_healthy:
                 messages.success(request, "Successfully connected to the new API URL.")
@@ -368,10 +535,14 @@ def api_status(request):
             # Redirect to refresh the page
             return redirect('api_status')
     
+    # Load time and memory of the embedding models this worker has loaded
+    from .embeddings import get_embedding_model_stats
+    
     context = {
         'is_healthy': is_healthy,
         'model_info': model_info,
         'api_url': api_url,
+        'embedding_models': get_embedding_model_stats(),
     }
     
     return render(request, 'api_status.html', context)
@@ -382,6 +553,40 @@ def reprocess_document(request, document_id):
     document = get_object_or_404(Document, id=document_id, uploaded_by=request.user)
     
     try:
+        # Unchanged content that the API still has indexed needs no work at all
+        previous_hash = document.content_hash
+        document.content_hash = document.compute_content_hash()
+        if document.content_hash == previous_hash and document.is_processed and document.chunks > 0:
+            status_info = colab_client.check_document_status(
+                document_id=str(document.id),
+                user_id=str(request.user.id)
+            )
+            if status_info.get("status") == "ready":
+                messages.success(request, "Document is unchanged and already indexed. Nothing to reprocess.")
+                return redirect('documents')
+        
+        # Reuse the vectors of an identical document that is already processed
+        duplicate = document.find_processed_duplicate(across_users=settings.DEDUP_ACROSS_USERS)
+        if duplicate:
+            try:
+                chunks_linked = colab_client.link_document(
+                    document_id=str(document.id),
+                    user_id=str(request.user.id),
+                    source_document_id=str(duplicate.id),
+                    source_user_id=str(duplicate.uploaded_by.id)
+                )
+                if chunks_linked > 0:
+                    document.is_processed = True
+                    document.chunks = chunks_linked
+                    document.processing_error = None
+                    document.processing_status = "Complete"
+                    document.last_processed = now()
+                    document.save()
+                    messages.success(request, f"Document reprocessed by reusing {chunks_linked} chunks from an identical document.")
+                    return redirect('documents')
+            except Exception as e:
+                logger.warning(f"Could not link document {document.id} to {duplicate.id}: {str(e)}")
+        
         # Get content
         if document.file:
             from .file_processor import extract_content_from_file
@@ -414,11 +619,22 @@ def reprocess_document(request, document_id):
         
         # Process document using Colab API
         try:
-            chunks_created = colab_client.process_document(
-                document_id=str(document.id),
-                content=content,
-                user_id=str(request.user.id)
-            )
+            if request.GET.get('full') == '1':
+                # Full rebuild: every chunk is embedded again
+                chunks_created = colab_client.process_document(
+                    document_id=str(document.id),
+                    content=content,
+                    user_id=str(request.user.id)
+                )
+                reindex_stats = None
+            else:
+                # Incremental: only new or changed chunks are embedded, stale ones are removed
+                reindex_stats = colab_client.reindex_document(
+                    document_id=str(document.id),
+                    content=content,
+                    user_id=str(request.user.id)
+                )
+                chunks_created = reindex_stats["chunks"]
             
             # Update document status
             document.is_processed = True
@@ -427,7 +643,14 @@ def reprocess_document(request, document_id):
             document.last_processed = now()
             document.save()
             
-            if chunks_created > 0:
+            if chunks_created > 0 and reindex_stats:
+                messages.success(
+                    request,
+                    f"Document reprocessed successfully! {chunks_created} chunks: "
+                    f"{reindex_stats['added']} embedded, {reindex_stats['reused']} reused, "
+                    f"{reindex_stats['deleted']} stale removed."
+                )
+            elif chunks_created > 0:
                 messages.success(request, f"Document reprocessed successfully! Created {chunks_created} chunks.")
             else:
                 messages.warning(request, "Document processed but no chunks were created. This might indicate an issue.")
@@ -451,10 +674,18 @@ def delete_document(request, document_id):
     if request.method == 'POST':
         # Get the document title for the success message
         document_title = document.title
+        was_processed = document.is_processed
         
         # Delete the document (this will cascade delete related ChatSessions and ChatMessages)
         document.delete()
         
+        # Drop its vectors and cached retrievals on the API; a failure here only leaves orphaned chunks
+        if was_processed:
+            try:
+                colab_client.delete_document(document_id=str(document_id), user_id=str(request.user.id))
+            except Exception as e:
+                logger.warning(f"Could not remove document {document_id} from the API: {str(e)}")
+        
         # Add success message
         messages.success(request, f'Document "{document_title}" and all related chats have been deleted.')
         
@@ -140,6 +140,57 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Colab API settings
 COLAB_API_URL = os.environ.get('COLAB_API_URL', 'YOUR_COLAB_API_URL_HERE')
 
+# Connection pooling for the (often tunnelled, high-latency) API: each chat turn
+# reuses kept-alive connections instead of paying a new TCP + TLS handshake
+COLAB_POOL_CONNECTIONS = int(os.environ.get('COLAB_POOL_CONNECTIONS', 4))  # Hosts with a cached pool
+COLAB_POOL_MAXSIZE = int(os.environ.get('COLAB_POOL_MAXSIZE', 16))  # Kept-alive connections per host
+COLAB_POOL_BLOCK = os.environ.get('COLAB_POOL_BLOCK', 'true').lower() == 'true'  # Wait rather than exceed maxsize
+
+# Health caching and circuit breaking: a chat turn reuses the last known health
+# instead of probing the API, and after repeated failures requests fail fast
+COLAB_HEALTH_TTL = float(os.environ.get('COLAB_HEALTH_TTL', 15))  # Seconds a health result is fresh
+COLAB_BREAKER_FAILURES = int(os.environ.get('COLAB_BREAKER_FAILURES', 3))  # Consecutive failures that open the circuit
+COLAB_BREAKER_RESET = float(os.environ.get('COLAB_BREAKER_RESET', 30))  # Seconds before a trial request is let through
+
+# Sliced uploads of large documents, resumed from the checkpoints in COLAB_UPLOAD_CHECKPOINT_DIR
+COLAB_UPLOAD_SLICE_CHARS = int(os.environ.get('COLAB_UPLOAD_SLICE_CHARS', 20000))  # Characters per request
+COLAB_UPLOAD_CONCURRENCY = int(os.environ.get('COLAB_UPLOAD_CONCURRENCY', 4))  # Slices in flight at once
+COLAB_UPLOAD_CHECKPOINT_DIR = os.environ.get('COLAB_UPLOAD_CHECKPOINT_DIR', os.path.join(BASE_DIR, 'upload_checkpoints'))
+COLAB_UPSERT_BATCH_SIZE = int(os.environ.get('COLAB_UPSERT_BATCH_SIZE', 256))  # Locally embedded chunks per request
+
+# Where documents are chunked and embedded: 'remote' sends the text to the API,
+# 'local' embeds it in the background workers and sends the API only vectors
+INGEST_MODE = os.environ.get('INGEST_MODE', 'remote')
+
+# Run ingestion as a staged pipeline (extract -> chunk -> embed -> index -> finalize) on worker
+# threads, with a bounded queue of INGEST_PIPELINE_QUEUE_SIZE documents in front of each stage.
+# Off by default: uploads are then processed by the background task one document at a time
+INGEST_PIPELINE = os.environ.get('INGEST_PIPELINE', 'False') == 'True'
+INGEST_PIPELINE_QUEUE_SIZE = int(os.environ.get('INGEST_PIPELINE_QUEUE_SIZE', 8))
+INGEST_PIPELINE_WORKERS = {'extract': 2, 'chunk': 2, 'embed': 1, 'index': 4, 'finalize': 1}
+
+# Shared collections that the migrate_vector_collections command spreads users over
+VECTOR_SHARD_COUNT = int(os.environ.get('VECTOR_SHARD_COUNT', 16))
+
+# Reuse vectors of identical files uploaded by other users (only within a user when False)
+DEDUP_ACROSS_USERS = os.environ.get('DEDUP_ACROSS_USERS', 'False') == 'True'
+
+# Persistent embedding cache (set EMBEDDING_CACHE_PATH to an empty string to disable)
+EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', os.path.join(BASE_DIR, 'embedding_cache.sqlite3'))
+EMBEDDING_CACHE_MAX_MB = int(os.environ.get('EMBEDDING_CACHE_MAX_MB', 512))
+
+# Embedding backend: 'huggingface' (PyTorch) or 'onnx' (int8 quantized, needs onnxruntime)
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'huggingface')
+ONNX_MODEL_DIR = os.environ.get('ONNX_MODEL_DIR', os.path.join(BASE_DIR, 'onnx_models'))
+
+# Micro-batch concurrent embedding requests (queries and chunks) into single forward passes
+EMBEDDING_MICRO_BATCHING = os.environ.get('EMBEDDING_MICRO_BATCHING', 'True') == 'True'
+EMBEDDING_MAX_BATCH_SIZE = int(os.environ.get('EMBEDDING_MAX_BATCH_SIZE', 64))
+EMBEDDING_MAX_WAIT_MS = int(os.environ.get('EMBEDDING_MAX_WAIT_MS', 10))
+
+# Load and warm up the embedding model when a worker process starts
+EMBEDDING_WARMUP = os.environ.get('EMBEDDING_WARMUP', 'False') == 'True'
+
     
 # Background task settings - more practical values
 BACKGROUND_TASK_RUN_ASYNC = True  # Run tasks asynchronously
@@ -41,6 +41,9 @@ urlpatterns = [
     path('documents/', views.document_list, name='documents'),
     path('upload/', views.upload_document, name='upload_document'),
     path('chat/<int:document_id>/', views.chat_view, name='chat'),
+    path('chat/<int:document_id>/stream/', views.chat_stream, name='chat_stream'),
+    path('chat/<int:document_id>/message/', views.chat_message_async, name='chat_message_async'),
+    path('documents/search/', views.multi_document_query, name='multi_document_query'),
     #path('process-with-api/', views.process_with_api, name='process_with_api'),
     path('api-status/', views.api_status, name='api_status'),
     path('documents/<int:document_id>/reprocess/', views.reprocess_document, name='reprocess_document'),
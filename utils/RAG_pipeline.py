@@ -42,56 +42,245 @@ main_chain.invoke({"text":"hi"}).content
 !pip install langchain-huggingface
 !pip install --upgrade sentence-transformers
 !pip install --upgrade huggingface_hub
+!pip install zstandard msgpack
+
+# Shared helpers (embedding cache, ...) live in the repo's utils package
+!git clone -q https://github.com/hextessellation/ragbot.git /content/ragbot
+import sys
+sys.path.insert(0, "/content/ragbot/ragchatbot")
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
+from utils.embedding_batcher import MicroBatchingEmbeddings
+from utils.embedding_cache import CachedEmbeddings, EmbeddingCache, cache_model_name, embedding_cache_key
+
+EMBEDDING_MODEL_NAME = "intfloat/e5-small-v2"
+
+# Set to True to serve embeddings from an int8 ONNX export (needs: !pip install onnxruntime)
+USE_ONNX_EMBEDDINGS = False
 
 # Initialize embeddings
-embeddings = HuggingFaceEmbeddings(
-    model_name="intfloat/e5-small-v2",
-    model_kwargs={"device": "cpu"},
-    encode_kwargs={"normalize_embeddings": True}
-)
+if USE_ONNX_EMBEDDINGS:
+    from utils.onnx_embeddings import OnnxEmbeddings
+    base_embeddings = OnnxEmbeddings(model_name=EMBEDDING_MODEL_NAME, cache_dir="./onnx_models", quantize=True)
+    EMBEDDING_BACKEND = base_embeddings.backend
+else:
+    base_embeddings = HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs={"device": "cpu"},
+        encode_kwargs={"normalize_embeddings": True}
+    )
+    EMBEDDING_BACKEND = "pytorch"
 
-# Simple text splitter
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=200,
-    separators=["\n\n", "\n", ". ", " ", ""],
-    length_function=len
-)
+# int8 vectors differ slightly from PyTorch ones, so each backend gets its own cache entries
+EMBEDDING_CACHE_NAME = cache_model_name(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND)
 
-def process_document_optimized(text, document_id, user_id):
+# Never embed the same text twice: vectors persist across reprocessing in a 1 GB SQLite cache
+embedding_cache = EmbeddingCache("./embedding_cache.sqlite3", max_bytes=1024 * 1024 * 1024)
+# Concurrent chat queries and chunk batches share forward passes (<= 64 texts, <= 10 ms wait)
+batched_embeddings = MicroBatchingEmbeddings(base_embeddings, max_batch_size=64, max_wait_ms=10)
+embeddings = CachedEmbeddings(batched_embeddings, model_name=EMBEDDING_CACHE_NAME, cache=embedding_cache)
+
+# Warm up the model once so the first request doesn't pay for lazy initialisation
+import time
+warmup_start = time.time()
+warmup_vectors = base_embeddings.embed_documents([f"warm-up sentence {i}" for i in range(8)])
+EMBEDDING_DIMENSION = len(warmup_vectors[0])
+print(f"Embedding model warm-up took {time.time() - warmup_start:.2f}s")
+
+# Simple text splitter, shared with the client so it can slice uploads on chunk boundaries
+from utils.slicing import make_text_splitter
+text_splitter = make_text_splitter(add_start_index=True)
+
+from utils.hashing import chunk_hash
+from utils.hybrid_search import BM25Index, HybridRetriever, bm25_index_path
+from utils.answer_cache import SemanticAnswerCache
+from utils.mmr import MMRRetriever
+from utils.retrieval_cache import RetrievalCache
+from utils.multi_document_search import CentroidIndex, scatter_gather_search
+from utils.numpy_store import chroma_settings, enforce_size_threshold, open_document_store
+from utils.sharded_store import open_partition, open_shard, shard_collection_name
+
+# Documents up to this many chunks are searched brute-force with NumPy instead of an HNSW collection
+NUMPY_STORE_MAX_CHUNKS = 500
+
+# "per_document": one NumPy store or Chroma collection per document
+# "sharded": all chunks in SHARD_COUNT shared collections, partitioned by user/document metadata
+#            (move existing documents first with utils.sharded_store.migrate_to_shards("./chroma_db", SHARD_COUNT),
+#             or `python manage.py migrate_vector_collections` where the Django app shares this chroma_db)
+STORAGE_MODE = "per_document"
+SHARD_COUNT = 16
+
+def open_collection(collection_name):
+    """Open a document's chunk store in the configured storage mode"""
+    if STORAGE_MODE == "sharded":
+        return open_partition(collection_name, embeddings, persist_directory="./chroma_db", shard_count=SHARD_COUNT)
+    return open_document_store(collection_name, embeddings, persist_directory="./chroma_db")
+
+def process_document_optimized(text, document_id, user_id, owned=None, first_chunk=0):
     """Simple document processing without CSV assumptions"""
 
+    vectorstore, ids, _ = index_document_chunks(text, document_id, user_id, owned=owned, first_chunk=first_chunk)
+    return vectorstore, len(ids)
+
+# Slices of one document may arrive in parallel; their writes to the collection are serialized
+import threading
+collection_locks = {}
+collection_locks_guard = threading.Lock()
+
+def collection_lock(collection_name):
+    """Lock guarding writes to one collection"""
+    with collection_locks_guard:
+        return collection_locks.setdefault(collection_name, threading.Lock())
+
+def index_document_chunks(text, document_id, user_id, owned=None, first_chunk=0):
+    """Chunk text and upsert it by content hash, embedding only chunks the collection doesn't hold.
+
+    For a slice made by utils.slicing.slice_for_upload, ``owned`` drops the chunks
+    the next slice produces and ``first_chunk`` numbers chunks as in the whole document.
+
+    Returns (vectorstore, chunk ids, stats) where stats counts added and reused chunks.
+    """
+
     print(f"DEBUG: Processing document length: {len(text)}")
 
     # Split text normally
-    chunks = text_splitter.split_text(text)
+    chunks = [
+        chunk.page_content for chunk in text_splitter.create_documents([text])
+        if owned is None or chunk.metadata["start_index"] < owned
+    ]
     print(f"DEBUG: Created {len(chunks)} chunks")
 
-    # Create simple metadata
+    # Content-addressed IDs: repeated chunks collapse into one vector
+    ids = []
+    texts = []
     metadatas = []
+    seen = set()
     for i, chunk in enumerate(chunks):
-        metadata = {
+        content_hash = chunk_hash(chunk)
+        chunk_key = f"{document_id}:{content_hash}"
+        if chunk_key in seen:
+            continue
+        seen.add(chunk_key)
+        ids.append(chunk_key)
+        texts.append(chunk)
+        metadatas.append({
             "document_id": str(document_id),
             "user_id": str(user_id),
-            "chunk_id": i,
-            "chunk_length": len(chunk)
-        }
-        metadatas.append(metadata)
-
-    # Create vectorstore
-    vectorstore = Chroma.from_texts(
-        texts=chunks,
-        embedding=embeddings,
-        metadatas=metadatas,
-        collection_name=f"user_{user_id}_doc_{document_id}",
-        persist_directory="./chroma_db"
-    )
+            "chunk_id": first_chunk + i,
+            "chunk_length": len(chunk),
+            "chunk_hash": content_hash
+        })
 
-    return vectorstore, len(chunks)
+    # Only chunks the collection doesn't hold yet need embedding. Embed them outside
+    # the lock, so parallel slices share the batcher's forward passes; add_texts
+    # below then gets these vectors from the embedding cache. The lookup itself
+    # takes the lock: a concurrent write may be moving the collection to Chroma
+    collection_name = f"user_{user_id}_doc_{document_id}"
+    with collection_lock(collection_name):
+        stored_ids = set(open_collection(collection_name).get(ids=ids, include=[])["ids"]) if ids else set()
+    new_texts = [text for chunk_key, text in zip(ids, texts) if chunk_key not in stored_ids]
+    if new_texts:
+        embeddings.embed_documents(new_texts)
+
+    with collection_lock(collection_name):
+        return upsert_document_chunks(collection_name, ids, texts, metadatas)
+
+def upsert_document_chunks(collection_name, ids, texts, metadatas):
+    """Add the chunks a collection doesn't hold yet and refresh the metadata of moved ones"""
+    vectorstore = open_collection(collection_name)
+
+    # Only embed chunks the collection doesn't already hold (re-sent slices, unchanged reprocessing)
+    existing = vectorstore.get(ids=ids, include=["metadatas"]) if ids else {"ids": [], "metadatas": []}
+    existing_metadata = dict(zip(existing["ids"], existing["metadatas"]))
+    new_positions = [i for i, chunk_key in enumerate(ids) if chunk_key not in existing_metadata]
+    if new_positions:
+        vectorstore.add_texts(
+            texts=[texts[i] for i in new_positions],
+            metadatas=[metadatas[i] for i in new_positions],
+            ids=[ids[i] for i in new_positions]
+        )
+
+    # Reused chunks may have moved within the document; metadata updates need no embedding
+    moved = [i for i, chunk_key in enumerate(ids) if chunk_key in existing_metadata and existing_metadata[chunk_key] != metadatas[i]]
+    if moved:
+        moved_ids = [ids[i] for i in moved]
+        moved_metadatas = [metadatas[i] for i in moved]
+        if hasattr(vectorstore, "update_metadata"):
+            vectorstore.update_metadata(moved_ids, moved_metadatas)
+        else:
+            vectorstore._collection.update(ids=moved_ids, metadatas=moved_metadatas)
+
+    if new_positions or moved:
+        bump_index_version(collection_name)
+
+    # Small documents stay in NumPy; switch to HNSW once the document outgrows it
+    vectorstore = enforce_size_threshold(vectorstore, collection_name, "./chroma_db", NUMPY_STORE_MAX_CHUNKS)
+
+    stats = {"added": len(new_positions), "reused": len(existing_metadata)}
+    print(f"DEBUG: Embedded {stats['added']} new chunks, reused {stats['reused']} stored chunks")
+
+    return vectorstore, ids, stats
+
+def delete_stale_chunks(vectorstore, keep_ids):
+    """Delete every chunk of a collection whose ID is not in keep_ids, returning how many were removed"""
+    stored_ids = vectorstore.get(include=[])["ids"]
+    stale_ids = [chunk_key for chunk_key in stored_ids if chunk_key not in keep_ids]
+    if stale_ids:
+        vectorstore.delete(ids=stale_ids)
+    print(f"DEBUG: Deleted {len(stale_ids)} stale chunks")
+    return len(stale_ids)
+
+# BM25 keyword indexes by collection name, loaded from ./chroma_db/bm25 on demand
+bm25_indexes = {}
+
+def rebuild_bm25_index(vectorstore, collection_name):
+    """Rebuild the keyword index of a collection from the chunks it currently holds"""
+    stored = vectorstore.get(include=["documents", "metadatas"])
+    index = BM25Index.from_texts(
+        stored["documents"],
+        ids=[(metadata or {}).get("chunk_hash") or chunk_hash(text)
+             for text, metadata in zip(stored["documents"], stored["metadatas"])]
+    )
+    index.save(bm25_index_path(collection_name))
+    bm25_indexes[collection_name] = index
+    print(f"DEBUG: Built BM25 index for {collection_name} with {len(index)} chunks")
+    return index
+
+# Mean chunk vector per collection, used to skip irrelevant documents in cross-document search
+centroid_index = CentroidIndex("./chroma_db/centroids.json")
+
+# Answers to near-identical questions (cosine >= threshold) are reused until the document changes or the TTL passes
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_TTL_SECONDS = 3600
+answer_cache = SemanticAnswerCache(threshold=ANSWER_CACHE_THRESHOLD, ttl_seconds=ANSWER_CACHE_TTL_SECONDS)
+
+# Chunks retrieved per (collection, version, query, k, filter), reused even when the answer is regenerated
+retrieval_cache = RetrievalCache(max_entries=1024)
+
+# Bumped whenever a collection's chunks change, so cached answers never outlive the content they came from
+index_versions = {}
+
+def bump_index_version(collection_name):
+    """Mark a collection's content as changed, dropping answers and retrievals cached for it"""
+    index_versions[collection_name] = index_versions.get(collection_name, 0) + 1
+    answer_cache.invalidate(collection_name)
+    retrieval_cache.invalidate(collection_name)
+
+def refresh_search_indexes(vectorstore, collection_name):
+    """Rebuild the keyword index and centroid of a collection after its chunks changed"""
+    rebuild_bm25_index(vectorstore, collection_name)
+    centroid_index.update(collection_name, vectorstore)
+    bump_index_version(collection_name)
+
+def get_bm25_index(collection_name):
+    """Keyword index of a collection, or None if it was never built"""
+    if collection_name not in bm25_indexes:
+        index = BM25Index.load(bm25_index_path(collection_name))
+        if index is None:
+            return None
+        bm25_indexes[collection_name] = index
+    return bm25_indexes[collection_name]
 
 # Add this as a new cell after Cell 9
 
@@ -133,20 +322,30 @@ def csv_aware_retrieve_documents(query, vectorstore, k=6):
 
     return docs
 
-def create_generic_rag_chain(vectorstore):
-    """Create generic RAG chain without CSV bias"""
+def create_generic_rag_chain(vectorstore, bm25_index=None, on_answer=None, collection_name=None, stream=False):
+    """Create generic RAG chain without CSV bias (on_answer is called with each answer the LLM produced).
 
-    def rag_function(query):
-        print(f"DEBUG: Processing query: '{query}'")
+    With stream=True the chain is a generator function yielding the answer token by token.
+    """
 
-        # Simple document retrieval without CSV assumptions
-        docs = vectorstore.similarity_search(query, k=6)
-
-        if not docs:
-            return "I couldn't find any relevant information in the document."
+    # Keyword hits (IDs, names, codes) are fused in, so fewer vector results are needed
+    retriever = HybridRetriever(vectorstore, bm25_index, k=6, vector_k=4, lexical_k=4) if bm25_index else None
 
-        print(f"DEBUG: Retrieved {len(docs)} documents")
+    def retrieve(query):
+        # Simple document retrieval without CSV assumptions
+        if retriever:
+            return retriever.get_relevant_documents(query)
+        return vectorstore.similarity_search(query, k=6)
+
+    def retrieve_cached(query):
+        if collection_name:
+            # Repeated questions reuse the chunks found last time for this version of the document
+            return retrieval_cache.get_or_search(
+                collection_name, index_versions.get(collection_name, 0), query, 6, lambda: retrieve(query)
+            )
+        return retrieve(query)
 
+    def build_prompt(query, docs):
         # Clean context without CSV assumptions
         context = ""
         for i, doc in enumerate(docs):
@@ -154,7 +353,7 @@ def create_generic_rag_chain(vectorstore):
             context += doc.page_content + "\n\n"
 
         # Generic prompt template
-        template = f"""Based on the following document content, answer the question accurately:
+        return f"""Based on the following document content, answer the question accurately:
 
 {context}
 
@@ -162,14 +361,44 @@ Question: {query}
 
 Answer based only on the provided content. If the information isn't available in the document, say "I don't have enough information to answer that question."""
 
+    def rag_function(query):
+        print(f"DEBUG: Processing query: '{query}'")
+
+        docs = retrieve_cached(query)
+        if not docs:
+            return "I couldn't find any relevant information in the document."
+
+        print(f"DEBUG: Retrieved {len(docs)} documents")
+        template = build_prompt(query, docs)
+
         try:
             response = llm.invoke(template).content
+            if on_answer:
+                on_answer(response)
             return response
         except Exception as e:
             print(f"DEBUG: LLM error: {e}")
             return f"I encountered an error generating the response: {str(e)}"
 
-    return rag_function
+    def rag_stream(query):
+        print(f"DEBUG: Streaming query: '{query}'")
+
+        docs = retrieve_cached(query)
+        if not docs:
+            yield "I couldn't find any relevant information in the document."
+            return
+
+        # Tokens are forwarded as Ollama produces them; errors propagate to the caller
+        parts = []
+        for chunk in llm.stream(build_prompt(query, docs)):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield chunk.content
+
+        if on_answer:
+            on_answer("".join(parts))
+
+    return rag_stream if stream else rag_function
 
 # Cell 10 - Simplified retrieval
 def optimized_retrieve_documents(query, vectorstore, k=6):
@@ -199,11 +428,8 @@ def optimized_retrieve_documents(query, vectorstore, k=6):
             # Fallback to regular search
             pass
 
-    # Regular MMR search
-    retriever = vectorstore.as_retriever(
-        search_type="mmr",
-        search_kwargs={"k": k, "fetch_k": k*2, "lambda_mult": 0.7}
-    )
+    # Regular MMR search (vectorized, so a wide candidate pool stays cheap)
+    retriever = MMRRetriever(vectorstore, k=k, fetch_k=max(100, k*10), lambda_mult=0.7)
 
     return retriever.get_relevant_documents(query)
 
@@ -276,10 +502,11 @@ monitor_ollama()
 
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import time
 import threading
 import os
+import json
 import traceback
 import re
 
@@ -295,10 +522,106 @@ llm = ChatOllama(
 
 app = Flask(__name__)
 
-# Storage
-document_vectorstores = {}
+# Compressed / msgpack request bodies are decoded before Flask sees them, and
+# JSON responses are re-encoded for what the client accepts (see utils/transport.py)
+from utils.transport import DecodingMiddleware, capabilities as transport_capabilities, encode_response
+app.wsgi_app = DecodingMiddleware(app.wsgi_app)
+
+@app.after_request
+def encode_response_body(response):
+    """Compress JSON responses (or send them as msgpack) when the client accepts it"""
+    if response.is_streamed or response.direct_passthrough or response.mimetype != "application/json" or "Content-Encoding" in response.headers:
+        return response
+    encoded = encode_response(
+        response.get_data(),
+        accept=request.headers.get("Accept", ""),
+        accept_encoding=request.headers.get("Accept-Encoding", "")
+    )
+    if encoded:
+        body, headers = encoded
+        response.set_data(body)
+        for name, value in headers.items():
+            response.headers[name] = value
+    return response
+
+from utils.collection_registry import CollectionRegistry
+
+# Storage: open vectorstores are kept in a bounded LRU registry and reopened from disk after eviction
+document_vectorstores = CollectionRegistry(max_entries=256, max_bytes=2 * 1024 ** 3)
 conversation_history = {}
 
+# Chunk IDs seen so far while a sliced document is re-indexed: key -> set of IDs
+pending_reindex = {}
+
+# Responses to slices of an upload that were already indexed: key -> {slice_id: response}.
+# A retried slice (same slice_id) gets the recorded response instead of being processed again.
+completed_slices = {}
+
+# Documents reusing the collection of an identical document: key -> source collection name
+ALIASES_PATH = "./chroma_db/document_aliases.json"
+document_aliases = {}
+if os.path.exists(ALIASES_PATH):
+    with open(ALIASES_PATH) as f:
+        document_aliases = json.load(f)
+
+def save_document_aliases():
+    os.makedirs(os.path.dirname(ALIASES_PATH), exist_ok=True)
+    with open(ALIASES_PATH, "w") as f:
+        json.dump(document_aliases, f)
+
+def collection_name_for(document_id, user_id):
+    """Collection holding a document's chunks, following links to identical documents"""
+    return document_aliases.get(f"{user_id}_{document_id}", f"user_{user_id}_doc_{document_id}")
+
+def detach_linked_documents(collection_name):
+    """Give documents linked to a collection their own copy before the collection changes.
+
+    The first linked document gets a copy of the current chunks, stored with their
+    vectors so nothing is embedded again; the other links move to that copy.
+    Returns the name of the copy, or None when nothing was linked.
+    """
+    with collection_lock(collection_name):
+        linked = [key for key, source in document_aliases.items() if source == collection_name]
+        if not linked:
+            return None
+
+        stored = open_collection(collection_name).get(include=["documents", "metadatas", "embeddings"])
+        user_id, document_id = linked[0].split("_", 1)
+        copy_name = f"user_{user_id}_doc_{document_id}"
+        ids = [f"{document_id}:{chunk_key.split(':', 1)[-1]}" for chunk_key in stored["ids"]]
+        metadatas = [
+            {**(metadata or {}), "document_id": str(document_id), "user_id": str(user_id)}
+            for metadata in stored["metadatas"]
+        ]
+
+        # add_texts gets the stored vectors from the embedding cache instead of running the model
+        embedding_cache.put_many([
+            (embedding_cache_key(EMBEDDING_CACHE_NAME, text), vector)
+            for text, vector in zip(stored["documents"], stored["embeddings"])
+        ])
+        with collection_lock(copy_name):
+            copy_store, _, _ = upsert_document_chunks(copy_name, ids, stored["documents"], metadatas)
+            delete_stale_chunks(copy_store, set(ids))
+        refresh_search_indexes(copy_store, copy_name)
+
+        document_aliases.pop(linked[0])
+        for key in linked[1:]:
+            document_aliases[key] = copy_name
+        save_document_aliases()
+        for key in linked:
+            document_vectorstores.pop(key, None)
+
+    print(f"DEBUG: Copied {collection_name} to {copy_name} for {len(linked)} linked documents")
+    return copy_name
+
+def load_document_vectorstore(document_id, user_id):
+    """Return the vectorstore for a document, loading it from disk if needed"""
+    key = f"{user_id}_{document_id}"
+    return document_vectorstores.get_or_load(
+        key,
+        lambda: open_collection(collection_name_for(document_id, user_id))
+    )
+
 # Optimized retrieval function
 def optimized_retrieve_documents(query, vectorstore, k=6):
     """Simplified document retrieval"""
@@ -327,11 +650,8 @@ def optimized_retrieve_documents(query, vectorstore, k=6):
             # Fallback to regular search
             pass
 
-    # Regular MMR search
-    retriever = vectorstore.as_retriever(
-        search_type="mmr",
-        search_kwargs={"k": k, "fetch_k": k*2, "lambda_mult": 0.7}
-    )
+    # Regular MMR search (vectorized, so a wide candidate pool stays cheap)
+    retriever = MMRRetriever(vectorstore, k=k, fetch_k=max(100, k*10), lambda_mult=0.7)
 
     return retriever.get_relevant_documents(query)
 
@@ -381,8 +701,24 @@ Question: {query}"""
 
 @app.route('/healthcheck', methods=['GET'])
 def healthcheck():
-    """Simple endpoint to check if the API is running"""
-    return jsonify({"status": "ok", "model": "llama3.1:8b-instruct-q4_0"})
+    """Simple endpoint to check if the API is running, and which body encodings it accepts"""
+    return jsonify({
+        "status": "ok",
+        "model": "llama3.1:8b-instruct-q4_0",
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "embedding_backend": EMBEDDING_BACKEND,
+        "transport": transport_capabilities()
+    })
+
+@app.route('/debug/embedding_cache', methods=['GET'])
+def debug_embedding_cache():
+    """Hit/miss counters and size of the embedding cache, plus micro-batching, answer and retrieval cache stats"""
+    return jsonify({
+        **embedding_cache.stats(),
+        "batching": batched_embeddings.stats(),
+        "answer_cache": answer_cache.stats(),
+        "retrieval_cache": retrieval_cache.stats()
+    })
 
 # Replace the process_document_api function in Cell 87
 
@@ -398,10 +734,25 @@ def process_document_api():
         if not all([text, document_id, user_id]):
             return jsonify({"error": "Missing required fields"}), 400
 
+        key = f"{user_id}_{document_id}"
+        slice_id = data.get('slice_id')
+        if slice_id and slice_id in completed_slices.get(key, {}):
+            print(f"DEBUG: Slice {slice_id} already indexed, skipping")
+            return jsonify({**completed_slices[key][slice_id], "duplicate": True})
+
         print(f"Processing document {document_id} - Length: {len(text)}")
 
+        # The document gets its own chunks again, so stop following any link
+        if document_aliases.pop(key, None):
+            save_document_aliases()
+            document_vectorstores.pop(key, None)
+        # Documents linked to this one keep the chunks they linked to
+        detach_linked_documents(f"user_{user_id}_doc_{document_id}")
+
         # Use optimized processing with fixed metadata
-        vectorstore, chunk_count = process_document_optimized(text, document_id, user_id)
+        vectorstore, chunk_count = process_document_optimized(
+            text, document_id, user_id, owned=data.get('owned'), first_chunk=data.get('first_chunk', 0)
+        )
 
         # Force persistence for large documents
         try:
@@ -411,9 +762,12 @@ def process_document_api():
             print(f"DEBUG: Persist warning: {persist_error}")
 
         # Store in memory
-        key = f"{user_id}_{document_id}"
         document_vectorstores[key] = vectorstore
 
+        # Sliced uploads build the keyword index once, in /finalize_document
+        if not data.get('is_partial'):
+            refresh_search_indexes(vectorstore, collection_name_for(document_id, user_id))
+
         # Test the vectorstore immediately
         try:
             test_docs = vectorstore.similarity_search("customer data", k=5)
@@ -422,23 +776,148 @@ def process_document_api():
             # Calculate stats safely
             structured_count = sum(1 for doc in test_docs if doc.metadata.get("is_csv", False))
 
-            return jsonify({
+            result = {
                 "status": "success",
                 "chunks": chunk_count,
                 "structured_chunks": structured_count,
                 "text_chunks": chunk_count - structured_count,
                 "message": f"Processed {chunk_count} chunks successfully",
                 "vectorstore_key": key
-            })
+            }
 
         except Exception as test_error:
             print(f"DEBUG: Vectorstore test failed: {test_error}")
-            return jsonify({
+            result = {
                 "status": "success",
                 "chunks": chunk_count,
                 "message": f"Processed {chunk_count} chunks successfully (test failed)",
                 "warning": str(test_error)
-            })
+            }
+
+        if slice_id:
+            completed_slices.setdefault(key, {})[slice_id] = result
+        return jsonify(result)
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/reindex_document', methods=['POST'])
+def reindex_document_api():
+    """Diff-based re-indexing: upsert new/changed chunks, keep unchanged ones, drop stale ones"""
+    try:
+        data = request.json
+        text = data.get('text', '')
+        document_id = data.get('document_id', '')
+        user_id = data.get('user_id', '')
+        is_partial = data.get('is_partial', False)
+
+        if not all([text, document_id, user_id]):
+            return jsonify({"error": "Missing required fields"}), 400
+
+        key = f"{user_id}_{document_id}"
+        if document_aliases.pop(key, None):
+            save_document_aliases()
+            document_vectorstores.pop(key, None)
+        detach_linked_documents(f"user_{user_id}_doc_{document_id}")
+
+        vectorstore, ids, stats = index_document_chunks(
+            text, document_id, user_id, owned=data.get('owned'), first_chunk=data.get('first_chunk', 0)
+        )
+        document_vectorstores[key] = vectorstore
+
+        if is_partial:
+            # Stale chunks can only be known once every slice is in; see /finalize_document.
+            # Slices are sent in order, so slice 0 starts a new re-index and drops IDs a failed one left
+            if data.get('chunk_number', 0) == 0:
+                pending_reindex[key] = set()
+            pending_reindex.setdefault(key, set()).update(ids)
+            deleted = 0
+        else:
+            deleted = delete_stale_chunks(vectorstore, set(ids))
+            refresh_search_indexes(vectorstore, collection_name_for(document_id, user_id))
+
+        return jsonify({
+            "status": "success",
+            "chunks": len(ids),
+            "added": stats["added"],
+            "reused": stats["reused"],
+            "deleted": deleted
+        })
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/upsert_vectors', methods=['POST'])
+def upsert_vectors_api():
+    """Store chunks the client already chunked and embedded, so ingestion costs no model time here"""
+    try:
+        data = request.json
+        document_id = data.get('document_id', '')
+        user_id = data.get('user_id', '')
+        ids = data.get('ids') or []
+        vectors = data.get('embeddings') or []
+        texts = data.get('texts') or []
+        metadatas = data.get('metadatas') or []
+        is_partial = data.get('is_partial', False)
+
+        if not all([document_id, user_id, ids]):
+            return jsonify({"error": "Missing required fields"}), 400
+        if not len(ids) == len(vectors) == len(texts) == len(metadatas):
+            return jsonify({"error": "ids, embeddings, texts and metadatas must have the same length"}), 400
+
+        # Queries are embedded here, so stored vectors must come from the same model
+        if data.get('model') != EMBEDDING_MODEL_NAME:
+            return jsonify({
+                "error": f"Vectors were made with {data.get('model')}, but this API embeds with {EMBEDDING_MODEL_NAME}",
+                "embedding_model": EMBEDDING_MODEL_NAME
+            }), 409
+        # int8 ONNX vectors differ from PyTorch ones; the backend has to match as well
+        if data.get('backend', 'pytorch') != EMBEDDING_BACKEND:
+            return jsonify({
+                "error": f"Vectors were made with the {data.get('backend', 'pytorch')} backend, but this API embeds with {EMBEDDING_BACKEND}",
+                "embedding_backend": EMBEDDING_BACKEND
+            }), 409
+        if any(len(vector) != EMBEDDING_DIMENSION for vector in vectors):
+            return jsonify({"error": f"Embeddings must have {EMBEDDING_DIMENSION} dimensions"}), 400
+
+        key = f"{user_id}_{document_id}"
+        if document_aliases.pop(key, None):
+            save_document_aliases()
+            document_vectorstores.pop(key, None)
+        detach_linked_documents(f"user_{user_id}_doc_{document_id}")
+
+        # Seed the embedding cache, so the store's add_texts gets these vectors instead of running the model
+        embedding_cache.put_many([
+            (embedding_cache_key(EMBEDDING_CACHE_NAME, text), vector) for text, vector in zip(texts, vectors)
+        ])
+
+        collection_name = collection_name_for(document_id, user_id)
+        with collection_lock(collection_name):
+            vectorstore, ids, stats = upsert_document_chunks(collection_name, ids, texts, metadatas)
+        document_vectorstores[key] = vectorstore
+
+        if is_partial:
+            # Stale chunks can only be known once every batch is in; see /finalize_document.
+            # The first batch starts a new upload, dropping IDs left by one that failed
+            if data.get('batch_number', 0) == 0:
+                pending_reindex[key] = set()
+            pending_reindex.setdefault(key, set()).update(ids)
+            deleted = 0
+        else:
+            deleted = delete_stale_chunks(vectorstore, set(ids))
+            refresh_search_indexes(vectorstore, collection_name)
+
+        return jsonify({
+            "status": "success",
+            "chunks": len(ids),
+            "added": stats["added"],
+            "reused": stats["reused"],
+            "deleted": deleted
+        })
 
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -456,11 +935,36 @@ def finalize_document():
         return jsonify({"error": "Missing required fields"}), 400
 
     key = f"{user_id}_{document_id}"
-    collection_name = f"user_{user_id}_doc_{document_id}"
+    collection_name = collection_name_for(document_id, user_id)
+
+    if data.get('reindex'):
+        # All slices of a re-index are in: remove chunks none of them produced
+        seen_ids = pending_reindex.pop(key, set())
+        if not seen_ids:
+            return jsonify({"status": "error", "error": "No re-indexed slices found"}), 404
+        detach_linked_documents(collection_name)
+        vectorstore = load_document_vectorstore(document_id, user_id)
+        deleted = delete_stale_chunks(vectorstore, seen_ids)
+        document_vectorstores.refresh_size(key)
+        refresh_search_indexes(vectorstore, collection_name)
+        return jsonify({
+            "status": "success",
+            "chunks": len(seen_ids),
+            "deleted": deleted,
+            "message": "Document re-index finalized"
+        })
 
     print(f"DEBUG: Finalizing document {key}")
     print(f"DEBUG: Collection name: {collection_name}")
 
+    # The upload is complete; a later upload of the document starts with no recorded slices
+    completed_slices.pop(key, None)
+
+    try:
+        refresh_search_indexes(load_document_vectorstore(document_id, user_id), collection_name)
+    except Exception as index_error:
+        print(f"DEBUG: Search index build failed: {index_error}")
+
     try:
         # First check if it's already in memory
         if key in document_vectorstores:
@@ -488,21 +992,23 @@ def finalize_document():
                     vectorstore = Chroma(
                         collection_name=collection_name,
                         embedding_function=embeddings,
-                        persist_directory="./chroma_db"
+                        persist_directory="./chroma_db",
+                        client_settings=chroma_settings()
                     )
                 elif attempt == 1:
                     # Try with explicit creation
                     vectorstore = Chroma(
                         collection_name=collection_name,
                         embedding_function=embeddings,
-                        persist_directory="./chroma_db"
+                        persist_directory="./chroma_db",
+                        client_settings=chroma_settings()
                     )
                     # Force load
                     vectorstore._collection.get()
                 else:
                     # Last attempt - check if collection exists
                     import chromadb
-                    client = chromadb.PersistentClient(path="./chroma_db")
+                    client = chromadb.PersistentClient(path="./chroma_db", settings=chroma_settings())
                     collections = client.list_collections()
                     collection_names = [c.name for c in collections]
                     print(f"DEBUG: Available collections: {collection_names}")
@@ -511,7 +1017,8 @@ def finalize_document():
                         vectorstore = Chroma(
                             collection_name=collection_name,
                             embedding_function=embeddings,
-                            persist_directory="./chroma_db"
+                            persist_directory="./chroma_db",
+                            client_settings=chroma_settings()
                         )
                     else:
                         # Try to find similar collection names
@@ -521,7 +1028,8 @@ def finalize_document():
                             vectorstore = Chroma(
                                 collection_name=similar_names[0],
                                 embedding_function=embeddings,
-                                persist_directory="./chroma_db"
+                                persist_directory="./chroma_db",
+                                client_settings=chroma_settings()
                             )
                         else:
                             raise Exception(f"No collections found for user {user_id} and document {document_id}")
@@ -573,6 +1081,86 @@ def finalize_document():
 
 # Replace the /generate route in Cell 87
 
+@app.route('/link_document', methods=['POST'])
+def link_document():
+    """Reuse the collection of an identical, already processed document instead of re-embedding"""
+    data = request.json
+    document_id = data.get('document_id', '')
+    user_id = data.get('user_id', '')
+    source_document_id = data.get('source_document_id', '')
+    source_user_id = data.get('source_user_id', '')
+
+    if not all([document_id, user_id, source_document_id, source_user_id]):
+        return jsonify({"error": "Missing required fields"}), 400
+
+    source_collection = collection_name_for(source_document_id, source_user_id)
+
+    try:
+        source_store = open_collection(source_collection)
+        chunk_count = len(source_store.get(include=[])["ids"])
+    except Exception as e:
+        return jsonify({"error": f"Source document not found: {str(e)}"}), 404
+
+    if chunk_count == 0:
+        return jsonify({"error": "Source document has no chunks"}), 404
+
+    key = f"{user_id}_{document_id}"
+    document_aliases[key] = source_collection
+    save_document_aliases()
+    document_vectorstores.pop(key, None)
+
+    print(f"DEBUG: Linked {key} to {source_collection} ({chunk_count} chunks)")
+    return jsonify({
+        "status": "success",
+        "chunks": chunk_count,
+        "collection_name": source_collection
+    })
+
+@app.route('/delete_document', methods=['POST'])
+def delete_document_api():
+    """Remove a document's chunks, indexes and cached results"""
+    data = request.json
+    document_id = data.get('document_id', '')
+    user_id = data.get('user_id', '')
+
+    if not all([document_id, user_id]):
+        return jsonify({"error": "Missing required fields"}), 400
+
+    key = f"{user_id}_{document_id}"
+    collection_name = collection_name_for(document_id, user_id)
+
+    try:
+        vectorstore = load_document_vectorstore(document_id, user_id)
+        document_vectorstores.pop(key, None)
+        conversation_history.pop(key, None)
+        pending_reindex.pop(key, None)
+        completed_slices.pop(key, None)
+
+        if document_aliases.pop(key, None):
+            save_document_aliases()
+
+        # Other documents may be linked to this collection; only delete chunks nobody else uses
+        still_linked = any(source == collection_name for source in document_aliases.values())
+        own_collection = collection_name == f"user_{user_id}_doc_{document_id}"
+        deleted_chunks = False
+        if own_collection and not still_linked:
+            vectorstore.delete_collection()
+            bm25_indexes.pop(collection_name, None)
+            bm25_path = bm25_index_path(collection_name)
+            if os.path.exists(bm25_path):
+                os.remove(bm25_path)
+            centroid_index.remove(collection_name)
+            deleted_chunks = True
+
+        bump_index_version(collection_name)
+
+        return jsonify({"status": "success", "deleted_chunks": deleted_chunks})
+
+    except Exception as e:
+        print(f"Delete error: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/generate', methods=['POST'])
 def generate_response():
     data = request.json
@@ -587,35 +1175,217 @@ def generate_response():
         key = f"{user_id}_{document_id}"
 
         # Load vectorstore if needed
-        if key not in document_vectorstores:
-            try:
-                vectorstore = Chroma(
-                    collection_name=f"user_{user_id}_doc_{document_id}",
-                    embedding_function=embeddings,
-                    persist_directory="./chroma_db"
+        try:
+            vectorstore = load_document_vectorstore(document_id, user_id)
+        except Exception as e:
+            return jsonify({"error": f"Document not found: {str(e)}"}), 404
+
+        # Reuse the answer to a near-identical question about the same version of the document
+        collection_name = collection_name_for(document_id, user_id)
+        scope = (collection_name, index_versions.get(collection_name, 0))
+        query_vector = embeddings.embed_query(query)
+        response = answer_cache.lookup(scope, query_vector)
+
+        if response is None:
+            # Use generic RAG chain (not CSV-optimized)
+            rag_chain = create_generic_rag_chain(
+                vectorstore,
+                get_bm25_index(collection_name),
+                on_answer=lambda answer: answer_cache.store(scope, query_vector, query, answer),
+                collection_name=collection_name
+            )
+            response = rag_chain(query)
+        else:
+            print(f"DEBUG: Answer cache hit for '{query}'")
+
+        # Update conversation history
+        remember_exchange(key, query, response)
+
+        return jsonify({"response": response})
+
+    except Exception as e:
+        print(f"Generation error: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+def remember_exchange(key, query, response):
+    """Append a question/answer pair to the conversation history, keeping the last 10 messages"""
+    history = conversation_history.setdefault(key, [])
+    history.extend([
+        {"role": "user", "content": query},
+        {"role": "assistant", "content": response}
+    ])
+    if len(history) > 10:
+        conversation_history[key] = history[-10:]
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+@app.route('/generate_stream', methods=['POST'])
+def generate_stream():
+    """Like /generate, but streams the answer as server-sent events: {"token"}..., then {"done", "response"}"""
+    data = request.json
+    query = data.get('query', '')
+    document_id = data.get('document_id', '')
+    user_id = data.get('user_id', '')
+
+    if not all([query, document_id, user_id]):
+        return jsonify({"error": "Missing required fields"}), 400
+
+    key = f"{user_id}_{document_id}"
+    try:
+        vectorstore = load_document_vectorstore(document_id, user_id)
+    except Exception as e:
+        return jsonify({"error": f"Document not found: {str(e)}"}), 404
+
+    collection_name = collection_name_for(document_id, user_id)
+    scope = (collection_name, index_versions.get(collection_name, 0))
+
+    def events():
+        try:
+            query_vector = embeddings.embed_query(query)
+            cached = answer_cache.lookup(scope, query_vector)
+            if cached is not None:
+                parts = [cached]
+                yield sse_event({"token": cached})
+            else:
+                rag_stream = create_generic_rag_chain(
+                    vectorstore,
+                    get_bm25_index(collection_name),
+                    on_answer=lambda answer: answer_cache.store(scope, query_vector, query, answer),
+                    collection_name=collection_name,
+                    stream=True
                 )
-                document_vectorstores[key] = vectorstore
-            except Exception as e:
-                return jsonify({"error": f"Document not found: {str(e)}"}), 404
+                parts = []
+                for token in rag_stream(query):
+                    parts.append(token)
+                    yield sse_event({"token": token})
 
-        # Use generic RAG chain (not CSV-optimized)
-        rag_chain = create_generic_rag_chain(document_vectorstores[key])
-        response = rag_chain(query)
+            response = "".join(parts)
+            remember_exchange(key, query, response)
+            yield sse_event({"done": True, "response": response})
 
-        # Update conversation history
-        if key not in conversation_history:
-            conversation_history[key] = []
+        except Exception as e:
+            print(f"Streaming error: {str(e)}")
+            traceback.print_exc()
+            yield sse_event({"error": str(e)})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-        conversation_history[key].extend([
-            {"role": "user", "content": query},
-            {"role": "assistant", "content": response}
-        ])
+# Cross-document search: centroid pruning, parallel per-document search, global top-k
+MULTI_DOC_MAX_DOCUMENTS = 50
+MULTI_DOC_WORKERS = 8
+
+def stored_document_ids(user_id):
+    """IDs of every document of a user with chunks in storage, whether or not its centroid was computed"""
+    prefix = f"user_{user_id}_doc_"
+    names = set(centroid_index.names(prefix))
+    if STORAGE_MODE == "sharded":
+        shard = open_shard(shard_collection_name(user_id, SHARD_COUNT), embeddings, persist_directory="./chroma_db")
+        stored = shard.get(where={"user_id": str(user_id)}, include=["metadatas"])
+        names.update(prefix + str(metadata["document_id"]) for metadata in stored["metadatas"] if metadata and metadata.get("document_id"))
+    else:
+        import chromadb
+        client = chromadb.PersistentClient(path="./chroma_db", settings=chroma_settings())
+        names.update(collection.name for collection in client.list_collections() if collection.name.startswith(prefix))
+        numpy_root = os.path.join("./chroma_db", "numpy")
+        if os.path.isdir(numpy_root):
+            names.update(name for name in os.listdir(numpy_root) if name.startswith(prefix))
+    return [name[len(prefix):] for name in names]
+
+def multi_document_search(query, user_id, document_ids=None, k=8):
+    """Search several of a user's documents at once, returning (score, document_id, Document) hits"""
+    if document_ids:
+        document_ids = [str(document_id) for document_id in document_ids]
+    else:
+        # Every document of the user that has been indexed; documents stored before
+        # centroids existed have none, so look at storage rather than the centroid index
+        document_ids = stored_document_ids(user_id)
+        document_ids += [key.split("_", 1)[1] for key in document_aliases if key.startswith(f"{user_id}_")]
+
+    # Linked documents share a collection: search each collection once
+    documents_by_collection = {}
+    for document_id in document_ids:
+        documents_by_collection.setdefault(collection_name_for(document_id, user_id), document_id)
+
+    query_vector = embeddings.embed_query(query)
+    selected = centroid_index.rank(query_vector, list(documents_by_collection), max_documents=MULTI_DOC_MAX_DOCUMENTS)
+    print(f"DEBUG: Searching {len(selected)} of {len(documents_by_collection)} documents")
+
+    stores = {}
+    for collection_name in selected:
+        document_id = documents_by_collection[collection_name]
+        try:
+            stores[document_id] = load_document_vectorstore(document_id, user_id)
+        except Exception as e:
+            print(f"DEBUG: Could not open document {document_id}: {e}")
+
+    return scatter_gather_search(query_vector, stores, k=k, per_document_k=k, max_workers=MULTI_DOC_WORKERS)
+
+def format_sources(hits):
+    return [
+        {
+            "document_id": document_id,
+            "score": round(score, 4),
+            "chunk_id": doc.metadata.get("chunk_id"),
+            "page_number": doc.metadata.get("page_number"),
+            "preview": doc.page_content[:200]
+        }
+        for score, document_id, doc in hits
+    ]
+
+@app.route('/search_documents', methods=['POST'])
+def search_documents():
+    """Return the best chunks across a user's documents, with the document each came from"""
+    data = request.json
+    query = data.get('query', '')
+    user_id = data.get('user_id', '')
 
-        # Keep last 10 messages
-        if len(conversation_history[key]) > 10:
-            conversation_history[key] = conversation_history[key][-10:]
+    if not all([query, user_id]):
+        return jsonify({"error": "Missing required fields"}), 400
 
-        return jsonify({"response": response})
+    try:
+        hits = multi_document_search(query, user_id, data.get('document_ids'), k=int(data.get('k', 8)))
+        return jsonify({"status": "success", "results": format_sources(hits)})
+    except Exception as e:
+        print(f"Search error: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/generate_multi', methods=['POST'])
+def generate_multi_document_response():
+    """Answer a question from several documents, citing which document each fact came from"""
+    data = request.json
+    query = data.get('query', '')
+    user_id = data.get('user_id', '')
+
+    if not all([query, user_id]):
+        return jsonify({"error": "Missing required fields"}), 400
+
+    try:
+        hits = multi_document_search(query, user_id, data.get('document_ids'), k=int(data.get('k', 8)))
+        if not hits:
+            return jsonify({"response": "I couldn't find any relevant information in your documents.", "sources": []})
+
+        context = ""
+        for score, document_id, doc in hits:
+            context += f"--- [Document {document_id}] ---\n"
+            context += doc.page_content + "\n\n"
+
+        template = f"""Based on the following excerpts from several documents, answer the question accurately:
+
+{context}
+
+Question: {query}
+
+Answer based only on the provided content and cite the document each fact comes from as [Document N]. If the information isn't available, say "I don't have enough information to answer that question."""
+
+        response = llm.invoke(template).content
+        return jsonify({"response": response, "sources": format_sources(hits)})
 
     except Exception as e:
         print(f"Generation error: {str(e)}")
@@ -632,7 +1402,7 @@ def document_status():
         return jsonify({"error": "Missing document_id or user_id"}), 400
 
     key = f"{user_id}_{document_id}"
-    collection_name = f"user_{user_id}_doc_{document_id}"
+    collection_name = collection_name_for(document_id, user_id)
 
     # Check if document is available in memory
     if key in document_vectorstores:
@@ -654,13 +1424,10 @@ def document_status():
 
     # Try loading from disk
     try:
-        vectorstore = Chroma(
-            collection_name=collection_name,
-            embedding_function=embeddings,
-            persist_directory="./chroma_db"
-        )
+        vectorstore = load_document_vectorstore(document_id, user_id)
         docs = vectorstore.similarity_search("test", k=10)
-        document_vectorstores[key] = vectorstore
+        if not docs:
+            raise Exception(f"No stored chunks in {collection_name}")
         return jsonify({
             "status": "ready",
             "in_memory": True,
@@ -668,10 +1435,12 @@ def document_status():
             "collection_name": collection_name
         })
     except Exception as e:
+        document_vectorstores.pop(key, None)
+
         # List available collections for debugging
         try:
             import chromadb
-            client = chromadb.PersistentClient(path="./chroma_db")
+            client = chromadb.PersistentClient(path="./chroma_db", settings=chroma_settings())
             collections = [c.name for c in client.list_collections()]
             return jsonify({
                 "status": "not_found",
@@ -687,7 +1456,7 @@ def debug_collections():
     """Debug endpoint to see all collections"""
     try:
         import chromadb
-        client = chromadb.PersistentClient(path="./chroma_db")
+        client = chromadb.PersistentClient(path="./chroma_db", settings=chroma_settings())
         collections = client.list_collections()
 
         collection_info = []
@@ -707,7 +1476,8 @@ def debug_collections():
         return jsonify({
             "collections": collection_info,
             "total_collections": len(collections),
-            "in_memory_vectorstores": list(document_vectorstores.keys())
+            "in_memory_vectorstores": document_vectorstores.keys(),
+            "registry": document_vectorstores.stats()
         })
     except Exception as e:
         return jsonify({"error": str(e)})
@@ -737,14 +1507,7 @@ def evaluate_chunk_quality(document_id, user_id):
 
     # Try to get vectorstore
     try:
-        if key in document_vectorstores:
-            vectorstore = document_vectorstores[key]
-        else:
-            vectorstore = Chroma(
-                collection_name=f"user_{user_id}_doc_{document_id}",
-                embedding_function=embeddings,
-                persist_directory="./chroma_db"
-            )
+        vectorstore = load_document_vectorstore(document_id, user_id)
 
         # Get all chunks
         all_docs = vectorstore.similarity_search(
@@ -805,12 +1568,7 @@ def test_rag_performance(document_id, user_id):
     if key not in document_vectorstores:
         try:
             # Try to load from disk
-            vectorstore = Chroma(
-                collection_name=f"user_{user_id}_doc_{document_id}",
-                embedding_function=embeddings,
-                persist_directory="./chroma_db"
-            )
-            document_vectorstores[key] = vectorstore
+            load_document_vectorstore(document_id, user_id)
         except Exception as e:
             return {"error": f"Failed to load document: {str(e)}"}
 
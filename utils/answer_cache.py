@@ -0,0 +1,121 @@
+"""
+Semantic answer cache.
+
+Answers are cached per scope, a (collection name, index version) pair, together
+with the normalized embedding of the question that produced them. A new question
+whose embedding is within ``threshold`` cosine similarity of a cached question
+in the same scope gets the cached answer instead of a retrieval + LLM round trip.
+Bumping a collection's index version (on reprocess) makes its old answers
+unreachable, and ``invalidate`` frees them.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class SemanticAnswerCache:
+    """In-memory cache of answers keyed by scope and question embedding"""
+
+    def __init__(self, threshold=0.95, ttl_seconds=3600, max_entries_per_scope=128, max_scopes=1024):
+        """
+        Args:
+            threshold: Lowest cosine similarity between two questions that share an answer
+            ttl_seconds: How long an answer stays valid
+            max_entries_per_scope: Answers kept per document version (oldest dropped first)
+            max_scopes: Document versions kept (least recently used dropped first)
+        """
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_scope = max_entries_per_scope
+        self.max_scopes = max_scopes
+
+        self.hits = 0
+        self.misses = 0
+
+        # scope -> {"vectors": matrix, "entries": [(question, answer, created_at)]}
+        self._scopes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, scope, query_vector):
+        """Return the cached answer for the most similar question in scope, or None"""
+        query_vector = _normalize(query_vector)
+        with self._lock:
+            cached = self._scopes.get(scope)
+            if cached is None:
+                self.misses += 1
+                return None
+            self._scopes.move_to_end(scope)
+            self._expire(cached)
+
+            if not cached["entries"] or cached["vectors"].shape[1] != query_vector.shape[0]:
+                self.misses += 1
+                return None
+
+            similarities = cached["vectors"] @ query_vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            question, answer, _ = cached["entries"][best]
+            logger.debug(f"Answer cache hit ({similarities[best]:.3f}) for question similar to: {question[:80]}")
+            return answer
+
+    def store(self, scope, query_vector, question, answer):
+        query_vector = _normalize(query_vector)
+        with self._lock:
+            cached = self._scopes.get(scope)
+            if cached is None or cached["vectors"].shape[1] != query_vector.shape[0]:
+                cached = {"vectors": np.zeros((0, query_vector.shape[0]), dtype=np.float32), "entries": []}
+                self._scopes[scope] = cached
+            self._scopes.move_to_end(scope)
+
+            cached["vectors"] = np.vstack([cached["vectors"], query_vector[None, :]])
+            cached["entries"].append((question, answer, time.time()))
+
+            overflow = len(cached["entries"]) - self.max_entries_per_scope
+            if overflow > 0:
+                cached["vectors"] = cached["vectors"][overflow:]
+                cached["entries"] = cached["entries"][overflow:]
+
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+
+    def invalidate(self, collection_name):
+        """Drop every cached answer for a collection, whatever its version"""
+        with self._lock:
+            for scope in [scope for scope in self._scopes if scope[0] == collection_name]:
+                del self._scopes[scope]
+
+    def _expire(self, cached):
+        if not self.ttl_seconds:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        keep = [i for i, (_, _, created_at) in enumerate(cached["entries"]) if created_at >= cutoff]
+        if len(keep) != len(cached["entries"]):
+            cached["vectors"] = cached["vectors"][keep]
+            cached["entries"] = [cached["entries"][i] for i in keep]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "scopes": len(self._scopes),
+            "answers": sum(len(cached["entries"]) for cached in self._scopes.values()),
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds
+        }
@@ -0,0 +1,137 @@
+"""
+Bounded registry of open vectorstores.
+
+The RAG API keeps one vectorstore object per document so repeated questions
+don't reopen it. This registry bounds that cache by entry count and by the
+memory each store holds, evicting the least recently used stores first.
+Evicted documents are reopened from disk on their next request.
+
+Only NumPy stores hold their vectors in the store object itself. A Chroma
+collection's segments live in the shared chromadb client, whose LRU segment
+cache (utils.numpy_store.chroma_settings) bounds and unloads them, so Chroma
+wrappers count as entries here but not as bytes.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+def estimate_store_bytes(store):
+    """Memory held by a vectorstore object (0 for stores whose data chromadb holds)"""
+    if hasattr(store, "nbytes"):
+        # NumpyVectorStore: the matrix plus the texts kept alongside it
+        return int(store.nbytes) + sum(len(text) for text in store.texts)
+    return 0
+
+
+class CollectionRegistry:
+    """LRU cache of vectorstores keyed by document, bounded by count and estimated bytes"""
+
+    def __init__(self, max_entries=256, max_bytes=2 * 1024 ** 3, sizer=estimate_store_bytes):
+        """
+        Args:
+            max_entries: Most vectorstores kept open at once
+            max_bytes: Most estimated bytes kept open at once
+            sizer: Function returning the estimated bytes of one vectorstore
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizer = sizer
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+
+        self._entries = OrderedDict()  # key -> (store, estimated bytes)
+        self._lock = threading.RLock()
+
+    def get_or_load(self, key, loader):
+        """Return the store for key, calling loader() to open it on a miss"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        store = loader()
+        self[key] = store
+        return store
+
+    def refresh_size(self, key):
+        """Re-measure an entry after its store has grown or shrunk"""
+        with self._lock:
+            if key in self._entries:
+                store, size = self._entries[key]
+                new_size = self.sizer(store)
+                self._entries[key] = (store, new_size)
+                self.total_bytes += new_size - size
+                self._evict(keep=key)
+
+    # Dict-style access, so call sites that treated this as a plain dict keep working
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        with self._lock:
+            store = self._entries[key][0]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return store
+
+    def __setitem__(self, key, store):
+        size = self.sizer(store)
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (store, size)
+            self.total_bytes += size
+            self._evict(keep=key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        return self[key] if key in self._entries else default
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            store, size = self._entries.pop(key)
+            self.total_bytes -= size
+            return store
+
+    def keys(self):
+        return list(self._entries.keys())
+
+    def _evict(self, keep=None):
+        """Drop least recently used entries until both limits hold (never the entry just used)"""
+        while self._entries and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            if key == keep:
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(key)
+                continue
+            _, size = self._entries.pop(key)
+            self.total_bytes -= size
+            self.evictions += 1
+            logger.info(f"Evicted vectorstore {key} ({size} bytes) from the registry")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,173 @@
+"""
+In-process micro-batching for embedding requests.
+
+Concurrent callers (chat queries, document chunks) submit texts to a queue; a
+single worker thread collects them into one batch until it is full or the
+oldest request has waited ``max_wait_ms``, runs one forward pass through the
+model and hands each caller its slice of the result.
+
+Requests larger than a batch are embedded ``max_batch_size`` texts at a time,
+and queued queries always go into the next batch ahead of document texts, so a
+chat query never waits behind the rest of a bulk upload.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class _Request:
+    """One caller's texts, taken into batches piece by piece"""
+
+    def __init__(self, texts, kind):
+        self.texts = texts
+        self.kind = kind
+        self.future = Future()
+        self.taken = 0  # Texts already handed to a batch
+        self.vectors = [None] * len(texts)
+        self.embedded = 0
+
+    def take(self, count):
+        """Next piece of at most count texts: (request, offset, texts)"""
+        offset = self.taken
+        self.taken = min(offset + count, len(self.texts))
+        return self, offset, self.texts[offset:self.taken]
+
+    def finish_piece(self, offset, vectors):
+        self.vectors[offset:offset + len(vectors)] = vectors
+        self.embedded += len(vectors)
+        if self.embedded == len(self.texts) and not self.future.done():
+            self.future.set_result(self.vectors)
+
+    def fail(self, error):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """Embeddings wrapper that merges concurrent requests into shared forward passes"""
+
+    def __init__(self, embeddings, max_batch_size=64, max_wait_ms=10, queries_as_documents=True):
+        """
+        Args:
+            embeddings: The underlying Embeddings object (e.g. HuggingFaceEmbeddings)
+            max_batch_size: Number of texts that triggers a forward pass immediately;
+                larger requests are split into pieces of this size
+            max_wait_ms: Longest time the first request in a batch waits for company
+            queries_as_documents: Embed queries in the same pass as documents. Only valid
+                for models whose embed_query equals embed_documents on one text, which is
+                the case for plain sentence-transformers.
+        """
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queries_as_documents = queries_as_documents
+
+        self.batches = 0
+        self.texts = 0
+
+        # Queries are served before documents; a request stays queued until all its texts are taken
+        self._queries = deque()
+        self._documents = deque()
+        self._ready = threading.Condition()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self._submit(list(texts), "document").result()
+
+    def embed_query(self, text):
+        return self._submit([text], "query").result()[0]
+
+    def stats(self):
+        """Number of forward passes and the average number of texts in each"""
+        with self._ready:
+            queued = len(self._queries) + len(self._documents)
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "avg_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "queued_requests": queued
+        }
+
+    def _submit(self, texts, kind):
+        self._ensure_worker()
+        request = _Request(texts, kind)
+        with self._ready:
+            (self._queries if kind == "query" else self._documents).append(request)
+            self._ready.notify()
+        return request.future
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._worker_lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, daemon=True, name="embedding-batcher")
+                    self._worker.start()
+
+    def _take(self, batch, size):
+        """Fill the batch up to max_batch_size texts, queries first; returns the new size"""
+        for pending in (self._queries, self._documents):
+            while pending and size < self.max_batch_size:
+                piece = pending[0].take(self.max_batch_size - size)
+                if pending[0].taken == len(pending[0].texts):
+                    pending.popleft()
+                batch.append(piece)
+                size += len(piece[2])
+        return size
+
+    def _run(self):
+        while True:
+            batch = []
+            with self._ready:
+                while not self._queries and not self._documents:
+                    self._ready.wait()
+                size = self._take(batch, 0)
+                deadline = time.monotonic() + self.max_wait
+
+                # Keep collecting until the batch is full or the first request has waited long enough
+                while size < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._ready.wait(remaining)
+                    size = self._take(batch, size)
+
+            self._process(batch)
+
+    def _process(self, batch):
+        # A request that already failed in an earlier piece needs no more work
+        batch = [piece for piece in batch if not piece[0].future.done()]
+        documents = [piece for piece in batch if self.queries_as_documents or piece[0].kind == "document"]
+        queries = [piece for piece in batch if not self.queries_as_documents and piece[0].kind == "query"]
+
+        if documents:
+            self._run_group(documents, self.embeddings.embed_documents)
+        for piece in queries:
+            self._run_group([piece], lambda texts: [self.embeddings.embed_query(texts[0])])
+
+    def _run_group(self, group, embed):
+        """Embed every text of a group in one call and fan the results back out in order"""
+        try:
+            vectors = embed([text for _, _, texts in group for text in texts])
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(group)} requests failed: {str(e)}")
+            for request, _, _ in group:
+                request.fail(e)
+            return
+
+        self.batches += 1
+        self.texts += len(vectors)
+
+        position = 0
+        for request, offset, texts in group:
+            request.finish_piece(offset, vectors[position:position + len(texts)])
+            position += len(texts)
@@ -0,0 +1,211 @@
+"""
+Persistent embedding cache.
+
+Vectors are stored as float32 blobs in SQLite, keyed by a hash of the model name
+and the normalized text, so re-processing a document or embedding overlapping
+chunks never computes the same vector twice. The cache is bounded by size and
+evicts the least recently used vectors first.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """Normalize unicode and whitespace so trivially different texts share a cache entry"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_model_name(model_name, backend=None):
+    """Name vectors are cached under: backends other than PyTorch produce slightly different vectors"""
+    if not backend or backend == "pytorch":
+        return model_name
+    return f"{model_name}@{backend}"
+
+
+def embedding_cache_key(model_name, text, kind="document"):
+    """Cache key for the embedding of text by model_name"""
+    hasher = hashlib.sha256()
+    hasher.update(f"{model_name}\0{kind}\0".encode("utf-8"))
+    hasher.update(normalize_text(text).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed vector cache with size-based LRU eviction and hit/miss counters"""
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        """
+        Open (or create) a cache file.
+
+        Args:
+            path: SQLite file to store vectors in
+            max_bytes: Total vector bytes kept before the least recently used entries are evicted
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, nbytes INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys):
+        """Return a dict of key -> vector (list of floats) for the keys present in the cache"""
+        if not keys:
+            return {}
+
+        found = {}
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs, evicting old entries if the cache grows past max_bytes"""
+        if not items:
+            return
+
+        now = time.time()
+        rows = []
+        for key, vector in items:
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((key, blob, len(blob), now))
+
+        with self._lock:
+            # Bytes of entries being overwritten, so the running total stays exact
+            keys = [row[0] for row in rows]
+            replaced = 0
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(nbytes), 0) FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchone()[0]
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, nbytes, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self.total_bytes += sum(row[2] for row in rows) - replaced
+
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache is back under 90% of max_bytes"""
+        target = int(self.max_bytes * 0.9)
+        while self.total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, nbytes FROM embeddings ORDER BY last_access LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+
+            evicted = []
+            for key, nbytes in rows:
+                if self.total_bytes <= target:
+                    break
+                evicted.append((key,))
+                self.total_bytes -= nbytes
+
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+            self.evictions += len(evicted)
+
+        logger.info(f"Embedding cache evicted down to {self.total_bytes} bytes ({self.evictions} evictions so far)")
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap an Embeddings object so every vector is looked up in an EmbeddingCache first"""
+
+    def __init__(self, embeddings, model_name, cache):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        keys = [embedding_cache_key(self.model_name, text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        # Embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(list(computed.items()))
+            cached.update(computed)
+
+        return [list(cached[key]) for key in keys]
+
+    def embed_query(self, text):
+        key = embedding_cache_key(self.model_name, text, kind="query")
+        cached = self.cache.get_many([key])
+        if key in cached:
+            return cached[key]
+
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many([(key, vector)])
+        return vector
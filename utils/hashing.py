@@ -0,0 +1,10 @@
+"""
+Content hashes shared by the Django app and the RAG API.
+"""
+
+import hashlib
+
+
+def chunk_hash(text):
+    """Stable content hash of a chunk, used for chunk IDs and for matching chunks across stores"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
@@ -0,0 +1,201 @@
+"""
+Lexical + vector hybrid retrieval.
+
+Each document gets a compact BM25 inverted index over its chunks, built when the
+chunks are created and stored next to its vector collection. At query time the
+BM25 ranking and the vector ranking are merged with reciprocal rank fusion, so
+exact tokens (IDs, names, codes) surface without a large vector ``fetch_k``.
+
+Chunks are identified by their content hash (``utils.hashing.chunk_hash``),
+which both the vector metadata and the BM25 index carry.
+"""
+
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+
+from langchain_core.documents import Document
+
+from utils.hashing import chunk_hash
+
+# Keep codes like "INV-2023-001", "a.b@c.com" or "v1.2" together as one token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.@/][a-z0-9]+)*")
+
+
+def tokenize(text):
+    """Lowercased word/code tokens of text"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def bm25_index_path(collection_name, persist_directory="./chroma_db"):
+    """Where the BM25 index of a vector collection is stored"""
+    return os.path.join(persist_directory, "bm25", f"{collection_name}.json")
+
+
+class BM25Index:
+    """Okapi BM25 over a small set of chunks, stored as postings lists"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.lengths = []
+        self.postings = {}  # term -> list of (chunk position, term frequency)
+
+    @classmethod
+    def from_texts(cls, texts, ids=None, k1=1.5, b=0.75):
+        """
+        Build an index over texts.
+
+        Args:
+            texts: Chunk texts
+            ids: Chunk identifiers returned by search (defaults to the chunks' content hashes)
+        """
+        index = cls(k1=k1, b=b)
+        index.add_texts(texts, ids)
+        return index
+
+    def add_texts(self, texts, ids=None):
+        if ids is None:
+            ids = [chunk_hash(text) for text in texts]
+
+        for chunk_id, text in zip(ids, texts):
+            position = len(self.ids)
+            terms = Counter(tokenize(text))
+            self.ids.append(chunk_id)
+            self.lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, []).append((position, frequency))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, k=5):
+        """Return up to k (chunk id, score) pairs for query, best first"""
+        if not self.ids:
+            return []
+
+        count = len(self.ids)
+        average_length = sum(self.lengths) / count or 1.0
+        scores = {}
+
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / average_length)
+                scores[position] = scores.get(position, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.ids[position], score) for position, score in best]
+
+    def to_dict(self):
+        return {
+            "k1": self.k1,
+            "b": self.b,
+            "ids": self.ids,
+            "lengths": self.lengths,
+            "postings": self.postings
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls(k1=data["k1"], b=data["b"])
+        index.ids = data["ids"]
+        index.lengths = data["lengths"]
+        index.postings = {term: [tuple(entry) for entry in entries] for term, entries in data["postings"].items()}
+        return index
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved index, or return None if there is none"""
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merge several rankings of the same items.
+
+    Args:
+        rankings: Lists of item identifiers, each ordered best first
+        k: Damping constant; higher values flatten the contribution of top ranks
+
+    Returns:
+        List of (identifier, fused score) pairs, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def fetch_chunks_by_hash(vectorstore, hashes):
+    """Load the chunks with the given content hashes from a vectorstore, as hash -> Document"""
+    if not hashes:
+        return {}
+
+    where = {"chunk_hash": hashes[0]} if len(hashes) == 1 else {"chunk_hash": {"$in": list(hashes)}}
+    stored = vectorstore.get(where=where, include=["documents", "metadatas"])
+
+    chunks = {}
+    for text, metadata in zip(stored["documents"], stored["metadatas"]):
+        chunks[metadata.get("chunk_hash") or chunk_hash(text)] = Document(page_content=text, metadata=metadata)
+    return chunks
+
+
+class HybridRetriever:
+    """Retriever returning the reciprocal-rank fusion of vector search and BM25 results"""
+
+    def __init__(self, vectorstore, bm25_index, k=6, vector_k=4, lexical_k=4, rrf_k=60, retriever=None):
+        """
+        Args:
+            vectorstore: Vector store holding the chunks (also used to load BM25-only hits)
+            bm25_index: BM25Index over the same chunks, keyed by content hash
+            k: Number of fused chunks returned
+            vector_k: Chunks requested from the vector search
+            lexical_k: Chunks requested from the BM25 index
+            rrf_k: Reciprocal rank fusion constant
+            retriever: Retriever to use for the vector side instead of plain similarity search
+        """
+        self.vectorstore = vectorstore
+        self.bm25_index = bm25_index
+        self.k = k
+        self.vector_k = vector_k
+        self.lexical_k = lexical_k
+        self.rrf_k = rrf_k
+        self.retriever = retriever
+
+    def get_relevant_documents(self, query):
+        if self.retriever is not None:
+            vector_docs = self.retriever.get_relevant_documents(query)
+        else:
+            vector_docs = self.vectorstore.similarity_search(query, k=self.vector_k)
+
+        vector_keys = [doc.metadata.get("chunk_hash") or chunk_hash(doc.page_content) for doc in vector_docs]
+        lexical_keys = [key for key, _ in self.bm25_index.search(query, k=self.lexical_k)]
+
+        fused = reciprocal_rank_fusion([vector_keys, lexical_keys], k=self.rrf_k)[:self.k]
+
+        chunks = dict(zip(vector_keys, vector_docs))
+        missing = [key for key, _ in fused if key not in chunks]
+        if missing:
+            chunks.update(fetch_chunks_by_hash(self.vectorstore, missing))
+
+        return [chunks[key] for key, _ in fused if key in chunks]
+
+    def invoke(self, query, config=None):
+        return self.get_relevant_documents(query)
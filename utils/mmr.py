@@ -0,0 +1,119 @@
+"""
+Vectorized maximal marginal relevance (MMR).
+
+Candidates and their vectors are fetched from the store in one call, the
+candidate-candidate similarity matrix is computed once, and greedy selection
+keeps a running "most similar already-selected chunk" vector instead of
+re-scanning the selection on every step. That keeps ``fetch_k`` in the hundreds
+cheap.
+"""
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        return matrix / max(float(np.linalg.norm(matrix)), 1e-12)
+    return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+
+def mmr_select(query_vector, candidate_vectors, k=4, lambda_mult=0.5):
+    """
+    Greedy MMR selection.
+
+    Args:
+        query_vector: Query embedding
+        candidate_vectors: Matrix of candidate embeddings (one row per candidate)
+        k: Number of candidates to select
+        lambda_mult: 1 ranks purely by relevance, 0 purely by diversity
+
+    Returns:
+        Row indices of the selected candidates, in selection order
+    """
+    candidates = _normalize(candidate_vectors)
+    if candidates.ndim != 2 or len(candidates) == 0 or k <= 0:
+        return []
+
+    relevance = candidates @ _normalize(query_vector)
+    similarity = candidates @ candidates.T
+
+    k = min(k, len(candidates))
+    first = int(np.argmax(relevance))
+    selected = [first]
+    available = np.ones(len(candidates), dtype=bool)
+    available[first] = False
+
+    # Highest similarity of each candidate to anything selected so far
+    max_similarity = similarity[first].copy()
+
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+
+    return selected
+
+
+def fetch_candidates(vectorstore, query_vector, fetch_k, filter=None):
+    """
+    Nearest chunks to query_vector together with their stored vectors, in one call.
+
+    Returns:
+        (texts, metadatas, vectors) for up to fetch_k chunks
+    """
+    if hasattr(vectorstore, "fetch_candidates"):
+        # Stores that know how to fetch their own candidates (e.g. shard partitions)
+        return vectorstore.fetch_candidates(query_vector, fetch_k, filter)
+
+    if hasattr(vectorstore, "_top_k"):
+        # NumpyVectorStore: vectors are already in memory
+        positions, _ = vectorstore._top_k(query_vector, fetch_k, filter)
+        return (
+            [vectorstore.texts[i] for i in positions],
+            [vectorstore.metadatas[i] for i in positions],
+            np.asarray(vectorstore.vectors[positions]) if len(positions) else np.zeros((0, 0), dtype=np.float32)
+        )
+
+    # Chroma: ask the collection for the embeddings along with the results
+    results = vectorstore._collection.query(
+        query_embeddings=[list(map(float, query_vector))],
+        n_results=fetch_k,
+        where=filter,
+        include=["documents", "metadatas", "embeddings"]
+    )
+    return results["documents"][0], results["metadatas"][0], np.asarray(results["embeddings"][0], dtype=np.float32)
+
+
+def mmr_search_by_vector(vectorstore, query_vector, k=4, fetch_k=100, lambda_mult=0.5, filter=None):
+    """MMR over the fetch_k nearest chunks of a vectorstore"""
+    texts, metadatas, vectors = fetch_candidates(vectorstore, query_vector, fetch_k, filter)
+    if not texts:
+        return []
+    selected = mmr_select(query_vector, vectors, k=k, lambda_mult=lambda_mult)
+    return [Document(page_content=texts[i], metadata=dict(metadatas[i] or {})) for i in selected]
+
+
+class MMRRetriever:
+    """Retriever running vectorized MMR against a NumPy or Chroma vectorstore"""
+
+    def __init__(self, vectorstore, k=5, fetch_k=100, lambda_mult=0.7, filter=None):
+        self.vectorstore = vectorstore
+        self.k = k
+        self.fetch_k = fetch_k
+        self.lambda_mult = lambda_mult
+        self.filter = filter
+
+    def get_relevant_documents(self, query):
+        query_vector = self.vectorstore.embeddings.embed_query(query)
+        return mmr_search_by_vector(
+            self.vectorstore, query_vector,
+            k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult, filter=self.filter
+        )
+
+    def invoke(self, query, config=None):
+        return self.get_relevant_documents(query)
@@ -0,0 +1,156 @@
+"""
+Scatter-gather search across many documents.
+
+A query is embedded once, compared with a centroid (mean chunk vector) per
+document to skip documents that can't be relevant, and the remaining document
+stores are searched in parallel. Every hit is re-scored by cosine similarity
+against the query vector, so results from NumPy, Chroma and shard partitions
+are comparable, and a global top-k is returned with the document each chunk
+came from.
+"""
+
+import heapq
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.documents import Document
+
+from utils.mmr import fetch_candidates
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def document_centroid(store):
+    """Normalized mean of a store's chunk vectors, or None if it is empty"""
+    if getattr(store, "vectors", None) is not None:
+        vectors = np.asarray(store.vectors)
+    else:
+        embeddings = store.get(include=["embeddings"]).get("embeddings")
+        vectors = np.asarray(embeddings if embeddings is not None else [], dtype=np.float32)
+    if vectors.ndim != 2 or len(vectors) == 0:
+        return None
+
+    vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    return _normalize(vectors.mean(axis=0))
+
+
+class CentroidIndex:
+    """Per-document centroid vectors, persisted as one JSON file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._centroids = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self._centroids = {name: np.asarray(vector, dtype=np.float32) for name, vector in json.load(f).items()}
+
+    def __contains__(self, name):
+        return name in self._centroids
+
+    def names(self, prefix=""):
+        return [name for name in self._centroids if name.startswith(prefix)]
+
+    def update(self, name, store):
+        """Recompute the centroid of a document from its store"""
+        centroid = document_centroid(store)
+        with self._lock:
+            if centroid is None:
+                self._centroids.pop(name, None)
+            else:
+                self._centroids[name] = centroid
+            self._save()
+        return centroid
+
+    def remove(self, name):
+        with self._lock:
+            if self._centroids.pop(name, None) is not None:
+                self._save()
+
+    def rank(self, query_vector, names, max_documents=None, min_similarity=None):
+        """
+        Order documents by centroid similarity to the query and prune the tail.
+
+        Documents without a centroid are kept (at the end) so nothing is skipped
+        just because its centroid hasn't been computed yet.
+        """
+        query_vector = _normalize(query_vector)
+        scored = []
+        unknown = []
+        for name in names:
+            centroid = self._centroids.get(name)
+            if centroid is None or centroid.shape != query_vector.shape:
+                unknown.append(name)
+                continue
+            similarity = float(centroid @ query_vector)
+            if min_similarity is None or similarity >= min_similarity:
+                scored.append((similarity, name))
+
+        scored.sort(reverse=True)
+        ranked = [name for _, name in scored] + unknown
+        return ranked[:max_documents] if max_documents else ranked
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({name: vector.tolist() for name, vector in self._centroids.items()}, f)
+        os.replace(temporary_path, self.path)
+
+
+def _search_store(label, store, query_vector, k):
+    """Top-k chunks of one store with cosine scores, tagged with the document they came from"""
+    texts, metadatas, vectors = fetch_candidates(store, query_vector, k)
+    if not texts:
+        return []
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    scores = vectors @ query_vector
+    return [
+        (float(score), label, Document(page_content=text, metadata=dict(metadata or {})))
+        for text, metadata, score in zip(texts, metadatas, scores)
+    ]
+
+
+def scatter_gather_search(query_vector, stores, k=8, per_document_k=None, max_workers=8):
+    """
+    Search several document stores in parallel and merge the results.
+
+    Args:
+        query_vector: Query embedding
+        stores: Mapping of document label (e.g. document ID) -> vectorstore
+        k: Number of chunks returned overall
+        per_document_k: Chunks taken from each document (defaults to k)
+        max_workers: Stores searched at the same time
+
+    Returns:
+        List of (score, label, Document) tuples, best first
+    """
+    if not stores:
+        return []
+
+    query_vector = _normalize(query_vector)
+    per_document_k = per_document_k or k
+
+    def search(item):
+        label, store = item
+        try:
+            return _search_store(label, store, query_vector, per_document_k)
+        except Exception as e:
+            logger.warning(f"Search of document {label} failed: {str(e)}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(stores))) as executor:
+        results = [hit for hits in executor.map(search, stores.items()) for hit in hits]
+
+    return heapq.nlargest(k, results, key=lambda hit: hit[0])
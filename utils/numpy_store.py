@@ -0,0 +1,365 @@
+"""
+Brute-force vector store for small documents.
+
+A document's normalized vectors live in one contiguous float32 matrix saved as
+``vectors.npy`` and memory-mapped on load; texts, metadata and IDs sit next to
+it in ``records.json``. A top-k query is a single matrix-vector product plus
+``argpartition``, which for a few hundred chunks beats an HNSW graph and needs
+no index files, SQLite handles or background threads.
+
+``open_document_store`` picks this store for new documents and moves a document
+to a Chroma (HNSW) collection once it grows past ``max_numpy_chunks``.
+"""
+
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from utils.mmr import mmr_search_by_vector
+
+logger = logging.getLogger(__name__)
+
+# Documents up to this many chunks stay in a NumPy store; larger ones use Chroma
+NUMPY_STORE_MAX_CHUNKS = 500
+
+# Chroma keeps the segments (HNSW index, metadata) of every collection it opened in
+# memory; past this many bytes it unloads the least recently used ones
+CHROMA_MEMORY_LIMIT_BYTES = int(os.environ.get("CHROMA_MEMORY_LIMIT_BYTES", 2 * 1024 ** 3))
+
+
+def chroma_settings():
+    """
+    Settings for every Chroma client on a persist directory: an LRU segment cache
+    bounded by CHROMA_MEMORY_LIMIT_BYTES. Chroma refuses to open one directory with
+    different settings, so all clients must use these.
+    """
+    from chromadb.config import Settings
+    return Settings(
+        anonymized_telemetry=False,
+        chroma_segment_cache_policy="LRU",
+        chroma_memory_limit_bytes=CHROMA_MEMORY_LIMIT_BYTES
+    )
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        return matrix / max(float(np.linalg.norm(matrix)), 1e-12)
+    return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+
+def _matches(metadata, where):
+    """Evaluate a Chroma-style metadata filter (equality, $in, $ne, $and, $or)"""
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(_matches(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if operator == "$eq" and value != operand:
+                    return False
+                if operator == "$ne" and value == operand:
+                    return False
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$nin" and value in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class NumpyVectorStore(VectorStore):
+    """Exact cosine search over a memory-mapped float32 matrix"""
+
+    def __init__(self, path, embedding_function):
+        """
+        Open (or create) a store directory.
+
+        Args:
+            path: Directory holding vectors.npy and records.json
+            embedding_function: Embeddings used for added texts and queries
+        """
+        self.path = path
+        self.embedding_function = embedding_function
+        self._vectors_path = os.path.join(path, "vectors.npy")
+        self._records_path = os.path.join(path, "records.json")
+
+        self.ids = []
+        self.texts = []
+        self.metadatas = []
+        self.vectors = None
+
+        if os.path.exists(self._records_path):
+            with open(self._records_path) as f:
+                records = json.load(f)
+            self.ids = records["ids"]
+            self.texts = records["texts"]
+            self.metadatas = records["metadatas"]
+            self.vectors = np.load(self._vectors_path, mmap_mode="r")
+
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "records.json"))
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def __len__(self):
+        return len(self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """Size of the vector matrix"""
+        return 0 if self.vectors is None else int(self.vectors.nbytes)
+
+    # Writing
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self.embedding_function.embed_documents(texts)
+        return self.add_embeddings(texts, vectors, metadatas=metadatas, ids=ids)
+
+    def add_embeddings(self, texts, vectors, metadatas=None, ids=None):
+        """Add (or replace, by ID) chunks whose vectors are already computed"""
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        if ids is None:
+            ids = [f"chunk_{len(self.ids) + i}" for i in range(len(texts))]
+        ids = list(ids)
+
+        vectors = _normalize(vectors)
+        matrix = np.array(self.vectors) if self.vectors is not None else np.zeros((0, vectors.shape[1]), dtype=np.float32)
+
+        appended = []
+        for i, chunk_id in enumerate(ids):
+            position = self._positions.get(chunk_id)
+            if position is None:
+                self._positions[chunk_id] = len(self.ids)
+                self.ids.append(chunk_id)
+                self.texts.append(texts[i])
+                self.metadatas.append(metadatas[i])
+                appended.append(vectors[i])
+            else:
+                self.texts[position] = texts[i]
+                self.metadatas[position] = metadatas[i]
+                matrix[position] = vectors[i]
+
+        if appended:
+            matrix = np.vstack([matrix, np.asarray(appended, dtype=np.float32)])
+        self._save(matrix)
+        return ids
+
+    def update_metadata(self, ids, metadatas):
+        """Replace the metadata of stored chunks without touching their vectors"""
+        for chunk_id, metadata in zip(ids, metadatas):
+            position = self._positions.get(chunk_id)
+            if position is not None:
+                self.metadatas[position] = metadata
+        self._save_records()
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return False
+        removed = set(ids)
+        keep = [i for i, chunk_id in enumerate(self.ids) if chunk_id not in removed]
+        if len(keep) == len(self.ids):
+            return False
+
+        matrix = np.array(self.vectors[keep]) if self.vectors is not None else None
+        self.ids = [self.ids[i] for i in keep]
+        self.texts = [self.texts[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        self._save(matrix)
+        return True
+
+    def delete_collection(self):
+        """Remove the store from disk"""
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.ids, self.texts, self.metadatas, self.vectors = [], [], [], None
+        self._positions = {}
+
+    def persist(self):
+        """Writes happen immediately; kept for compatibility with Chroma callers"""
+
+    def _save(self, matrix):
+        os.makedirs(self.path, exist_ok=True)
+        if matrix is None:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+
+        # Write to a temporary file and swap it in, so readers never see a partial matrix
+        temporary_path = self._vectors_path + ".tmp.npy"
+        np.save(temporary_path, np.ascontiguousarray(matrix, dtype=np.float32))
+        os.replace(temporary_path, self._vectors_path)
+        self.vectors = np.load(self._vectors_path, mmap_mode="r")
+        self._save_records()
+
+    def _save_records(self):
+        temporary_path = self._records_path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({"ids": self.ids, "texts": self.texts, "metadatas": self.metadatas}, f)
+        os.replace(temporary_path, self._records_path)
+
+    # Reading
+
+    def get(self, ids=None, where=None, include=None, limit=None, **kwargs):
+        """Chroma-compatible get: returns a dict with ids, documents, metadatas (and embeddings if included)"""
+        include = include if include is not None else ["documents", "metadatas"]
+        if ids is not None:
+            positions = [self._positions[chunk_id] for chunk_id in ids if chunk_id in self._positions]
+        else:
+            positions = range(len(self.ids))
+        if where:
+            positions = [i for i in positions if _matches(self.metadatas[i], where)]
+        positions = list(positions)[:limit] if limit else list(positions)
+
+        result = {"ids": [self.ids[i] for i in positions]}
+        result["documents"] = [self.texts[i] for i in positions] if "documents" in include else None
+        result["metadatas"] = [self.metadatas[i] for i in positions] if "metadatas" in include else None
+        if "embeddings" in include:
+            result["embeddings"] = [np.array(self.vectors[i]) for i in positions]
+        return result
+
+    def _candidates(self, filter):
+        if not filter:
+            return None
+        return np.array([i for i, metadata in enumerate(self.metadatas) if _matches(metadata, filter)], dtype=np.int64)
+
+    def _top_k(self, query_vector, k, filter=None):
+        """Positions and cosine similarities of the k best chunks, best first"""
+        if not self.ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        candidates = self._candidates(filter)
+        matrix = self.vectors if candidates is None else self.vectors[candidates]
+        if len(matrix) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        scores = matrix @ _normalize(query_vector)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        positions = top if candidates is None else candidates[top]
+        return positions, scores[top]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None):
+        positions, scores = self._top_k(embedding, k, filter)
+        # Squared L2 distance of the normalized vectors, as Chroma's default "l2" space reports it
+        return [
+            (Document(page_content=self.texts[i], metadata=dict(self.metadatas[i])), max(2.0 - 2.0 * float(score), 0.0))
+            for i, score in zip(positions, scores)
+        ]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        """Top-k chunks with their distance (lower is better), comparable to Chroma's scores"""
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k, filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        # Same conversion as Chroma's "l2" collections
+        return self._euclidean_relevance_score_fn
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        return mmr_search_by_vector(self, embedding, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter)
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding_function.embed_query(query), k, fetch_k, lambda_mult, filter
+        )
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path=None, **kwargs):
+        if path is None:
+            raise ValueError("NumpyVectorStore.from_texts needs a path")
+        store = cls(path, embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+
+def numpy_store_path(collection_name, persist_directory="./chroma_db"):
+    """Directory of the NumPy store standing in for a collection"""
+    return os.path.join(persist_directory, "numpy", collection_name)
+
+
+def chroma_collection_exists(collection_name, persist_directory="./chroma_db"):
+    import chromadb
+    client = chromadb.PersistentClient(path=persist_directory, settings=chroma_settings())
+    return collection_name in [collection.name for collection in client.list_collections()]
+
+
+def open_document_store(collection_name, embedding_function, persist_directory="./chroma_db"):
+    """
+    Open a document's vector store: its NumPy store if it has one, otherwise its
+    Chroma collection if that exists, otherwise a new (empty) NumPy store.
+    """
+    path = numpy_store_path(collection_name, persist_directory)
+    if NumpyVectorStore.exists(path):
+        return NumpyVectorStore(path, embedding_function)
+
+    if chroma_collection_exists(collection_name, persist_directory):
+        from langchain_community.vectorstores import Chroma
+        return Chroma(
+            collection_name=collection_name,
+            embedding_function=embedding_function,
+            persist_directory=persist_directory,
+            client_settings=chroma_settings()
+        )
+
+    return NumpyVectorStore(path, embedding_function)
+
+
+def promote_to_chroma(store, collection_name, persist_directory="./chroma_db"):
+    """Move a NumPy store that outgrew brute-force search into a Chroma (HNSW) collection"""
+    from langchain_community.vectorstores import Chroma
+
+    vectorstore = Chroma(
+        collection_name=collection_name,
+        embedding_function=store.embedding_function,
+        persist_directory=persist_directory,
+        client_settings=chroma_settings()
+    )
+
+    # Reuse the stored vectors rather than embedding every chunk again
+    for start in range(0, len(store.ids), 1000):
+        end = start + 1000
+        vectorstore._collection.upsert(
+            ids=store.ids[start:end],
+            embeddings=np.asarray(store.vectors[start:end]).tolist(),
+            documents=store.texts[start:end],
+            metadatas=store.metadatas[start:end]
+        )
+
+    logger.info(f"Moved {collection_name} ({len(store.ids)} chunks) from NumPy to Chroma")
+    store.delete_collection()
+    return vectorstore
+
+
+def enforce_size_threshold(store, collection_name, persist_directory="./chroma_db", max_numpy_chunks=NUMPY_STORE_MAX_CHUNKS):
+    """Return the store to keep using: the same one, or a Chroma copy if it has grown too large"""
+    if isinstance(store, NumpyVectorStore) and len(store) > max_numpy_chunks:
+        return promote_to_chroma(store, collection_name, persist_directory)
+    return store
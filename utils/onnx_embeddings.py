@@ -0,0 +1,201 @@
+"""
+Quantized ONNX embedding backend for CPU inference.
+
+The configured sentence-transformer is exported to ONNX once, quantized to int8
+with onnxruntime's dynamic quantization, and served through an onnxruntime
+session behind the usual ``embed_documents``/``embed_query`` interface. Pooling
+(attention-masked mean) and L2 normalization match the sentence-transformers
+models used by this project; ``check_parity`` verifies that against PyTorch.
+
+Requires ``onnxruntime`` and ``transformers`` (plus ``torch`` for the one-off export).
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+# Token limit of plain transformers models whose tokenizer doesn't set one
+DEFAULT_MAX_LENGTH = 512
+
+
+def _onnx_model_dir(model_name, cache_dir):
+    return os.path.join(cache_dir, model_name.replace("/", "__"))
+
+
+def onnx_backend_name(quantize=True):
+    """Backend name reported with vectors from this module, e.g. in embedding cache keys"""
+    return "onnx-int8" if quantize else "onnx-fp32"
+
+
+def read_max_seq_length(model_name, model_dir, tokenizer):
+    """
+    Token limit the model embeds with: max_seq_length from its sentence-transformers
+    config (384 for all-mpnet-base-v2), else the tokenizer's limit.
+    """
+    path = os.path.join(model_dir, "sentence_bert_config.json")
+    if not os.path.exists(path):
+        try:
+            from huggingface_hub import hf_hub_download
+            path = hf_hub_download(model_name, "sentence_bert_config.json")
+        except Exception:
+            path = None
+
+    if path:
+        with open(path) as f:
+            max_seq_length = json.load(f).get("max_seq_length")
+        if max_seq_length:
+            return int(max_seq_length)
+
+    # Tokenizers without a limit report a huge sentinel value
+    return min(tokenizer.model_max_length, DEFAULT_MAX_LENGTH)
+
+
+def export_onnx_model(model_name, cache_dir="./onnx_models", quantize=True):
+    """
+    Export a Hugging Face encoder to ONNX (and int8) if it hasn't been exported yet.
+
+    Returns:
+        Path of the ONNX file to load (the quantized one when quantize is True)
+    """
+    model_dir = _onnx_model_dir(model_name, cache_dir)
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    int8_path = os.path.join(model_dir, "model.int8.onnx")
+    target_path = int8_path if quantize else fp32_path
+
+    if os.path.exists(target_path):
+        return target_path
+
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(model_dir, exist_ok=True)
+
+    if not os.path.exists(fp32_path):
+        logger.info(f"Exporting {model_name} to ONNX")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+
+        sample = tokenizer(["ONNX export sample sentence"], return_tensors="pt")
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (sample["input_ids"], sample["attention_mask"]),
+                fp32_path,
+                input_names=["input_ids", "attention_mask"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"}
+                },
+                opset_version=14
+            )
+        tokenizer.save_pretrained(model_dir)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        logger.info(f"Quantizing {model_name} to int8")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+    return target_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """Sentence embeddings computed with onnxruntime from an (optionally int8) exported model"""
+
+    def __init__(self, model_name, cache_dir="./onnx_models", quantize=True, batch_size=32,
+                 max_length=None, num_threads=None):
+        """
+        Args:
+            model_name: Hugging Face model to export and serve
+            cache_dir: Where exported ONNX files are kept between runs
+            quantize: Serve the int8 dynamically quantized model instead of fp32
+            batch_size: Texts per onnxruntime call
+            max_length: Token limit per text, longer texts are truncated (defaults to the model's own)
+            num_threads: Intra-op threads for onnxruntime (defaults to all cores)
+        """
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError(
+                "The ONNX embedding backend needs onnxruntime and transformers: "
+                "pip install onnxruntime transformers"
+            ) from e
+
+        self.model_name = model_name
+        self.backend = onnx_backend_name(quantize)
+        self.batch_size = batch_size
+
+        self.model_path = export_onnx_model(model_name, cache_dir=cache_dir, quantize=quantize)
+        self.model_bytes = os.path.getsize(self.model_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        model_dir = _onnx_model_dir(model_name, cache_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length or read_max_seq_length(model_name, model_dir, self.tokenizer)
+
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text):
+        return self._embed_batch([text])[0]
+
+    def _embed_batch(self, texts):
+        tokens = self.tokenizer(
+            list(texts),
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np"
+        )
+        attention_mask = tokens["attention_mask"].astype(np.int64)
+        hidden = self.session.run(
+            ["last_hidden_state"],
+            {"input_ids": tokens["input_ids"].astype(np.int64), "attention_mask": attention_mask}
+        )[0]
+
+        # Mean pooling over real tokens, then L2 normalization (as sentence-transformers does)
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32).tolist()
+
+
+def check_parity(reference, candidate, texts, min_cosine=0.98):
+    """
+    Compare two embedding backends on the same texts.
+
+    Returns:
+        Dictionary with the minimum and mean cosine similarity between the two
+        backends' vectors, and whether the minimum reaches min_cosine
+    """
+    expected = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    actual = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+
+    expected /= np.clip(np.linalg.norm(expected, axis=1, keepdims=True), 1e-12, None)
+    actual /= np.clip(np.linalg.norm(actual, axis=1, keepdims=True), 1e-12, None)
+    cosines = (expected * actual).sum(axis=1)
+
+    return {
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "passed": bool(cosines.min() >= min_cosine),
+        "texts": len(texts)
+    }
@@ -0,0 +1,169 @@
+"""
+Staged processing with bounded queues.
+
+Items flow through a fixed sequence of stages, each served by its own worker
+threads. Stages are connected by bounded queues: a stage that falls behind
+makes the stage feeding it block (and ultimately ``submit``), so a burst of
+work waits upstream instead of piling up in memory, while the other stages keep
+working on the next items. Every stage counts what it processed, how long that
+took and how long it spent blocked on the stage after it.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Stage:
+    """One step of a pipeline: ``func`` applied to every item by ``workers`` threads"""
+
+    def __init__(self, name, func, workers=1, queue_size=8):
+        """
+        Args:
+            name: Stage name used in stats and thread names
+            func: Called with each item; returns the item for the next stage, or
+                None when the item needs no further processing
+            workers: Threads running func concurrently
+            queue_size: Items waiting for this stage before upstream blocks
+        """
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.processed = 0
+        self.failed = 0
+        self.in_progress = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def stats(self, uptime):
+        """Throughput, queue depth and timings of this stage"""
+        with self._lock:
+            return {
+                "stage": self.name,
+                "workers": self.workers,
+                "in_progress": self.in_progress,
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "processed": self.processed,
+                "failed": self.failed,
+                "throughput_per_second": self.processed / uptime if uptime else 0.0,
+                "avg_seconds": self.busy_seconds / self.processed if self.processed else 0.0,
+                "blocked_seconds": round(self.blocked_seconds, 3)
+            }
+
+
+class Pipeline:
+    """Run items through stages connected by bounded queues"""
+
+    def __init__(self, stages, on_error=None, name="pipeline"):
+        """
+        Args:
+            stages: Stage objects, in order
+            on_error: Called with (item, stage name, exception) when a stage raises;
+                the item then leaves the pipeline
+            name: Prefix of the worker thread names
+        """
+        self.stages = list(stages)
+        self.on_error = on_error
+        self.name = name
+        self.started_at = None
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start every stage's workers (once)"""
+        with self._lock:
+            if self.started_at is not None:
+                return self
+            self.started_at = time.monotonic()
+            for index, stage in enumerate(self.stages):
+                stage._running = stage.workers
+                for number in range(stage.workers):
+                    thread = threading.Thread(
+                        target=self._work, args=(index,), daemon=True, name=f"{self.name}-{stage.name}-{number}"
+                    )
+                    thread.start()
+                    self._threads.append(thread)
+        return self
+
+    def submit(self, item, timeout=None):
+        """
+        Queue an item for the first stage, blocking while that stage is full.
+
+        Raises:
+            queue.Full: If the stage is still full after ``timeout`` seconds
+        """
+        self.start()
+        self.stages[0].queue.put(item, timeout=timeout)
+
+    def close(self):
+        """Let queued items drain, then stop the workers"""
+        for _ in range(self.stages[0].workers):
+            self.stages[0].queue.put(_STOP)
+
+    def join(self, timeout=None):
+        """Wait for the workers to stop after close()"""
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def stats(self):
+        """Uptime and per-stage stats"""
+        uptime = time.monotonic() - self.started_at if self.started_at is not None else 0.0
+        return {
+            "uptime_seconds": round(uptime, 3),
+            "stages": [stage.stats(uptime) for stage in self.stages]
+        }
+
+    def _work(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                with stage._lock:
+                    stage._running -= 1
+                    last = stage._running == 0
+                # The last worker out stops the next stage; earlier items are all through by now
+                if last and next_stage:
+                    for _ in range(next_stage.workers):
+                        next_stage.queue.put(_STOP)
+                return
+
+            with stage._lock:
+                stage.in_progress += 1
+            start = time.perf_counter()
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                with stage._lock:
+                    stage.in_progress -= 1
+                    stage.failed += 1
+                logger.error(f"{self.name} stage {stage.name} failed: {str(e)}")
+                if self.on_error:
+                    try:
+                        self.on_error(item, stage.name, e)
+                    except Exception as handler_error:
+                        logger.error(f"{self.name} error handler failed: {str(handler_error)}")
+                continue
+
+            with stage._lock:
+                stage.in_progress -= 1
+                stage.processed += 1
+                stage.busy_seconds += time.perf_counter() - start
+
+            if result is not None and next_stage:
+                # Blocks while the next stage is full: backpressure
+                put_start = time.perf_counter()
+                next_stage.queue.put(result)
+                with stage._lock:
+                    stage.blocked_seconds += time.perf_counter() - put_start
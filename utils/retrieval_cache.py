@@ -0,0 +1,78 @@
+"""
+Retrieval result cache.
+
+Caches the chunks returned for a query, keyed by (collection, index version,
+normalized query hash, k, filter), so repeated questions skip the vector and
+keyword search even when the answer itself has to be regenerated. Entries are
+evicted least recently used first, and a collection's entries are dropped when
+its content changes.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from utils.embedding_cache import normalize_text
+
+
+def query_hash(query):
+    """Hash of a query, insensitive to case and whitespace differences"""
+    return hashlib.sha256(normalize_text(query).lower().encode("utf-8")).hexdigest()
+
+
+class RetrievalCache:
+    """LRU cache of retrieved chunks per (collection, version, query, k, filter)"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(collection_name, version, query, k, filter=None):
+        filter_key = json.dumps(filter, sort_keys=True) if filter else ""
+        return (collection_name, version, query_hash(query), k, filter_key)
+
+    def get_or_search(self, collection_name, version, query, k, search, filter=None):
+        """
+        Return cached chunks for the query, or run search() and cache its result.
+
+        Args:
+            search: Zero-argument function performing the actual retrieval
+        """
+        key = self.make_key(collection_name, version, query, k, filter)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(self._entries[key])
+            self.misses += 1
+
+        docs = search()
+        with self._lock:
+            self._entries[key] = list(docs)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return docs
+
+    def invalidate(self, collection_name):
+        """Drop every cached result for a collection"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == collection_name]:
+                del self._entries[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
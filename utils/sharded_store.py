@@ -0,0 +1,234 @@
+"""
+Shared, sharded chunk storage.
+
+Instead of one Chroma collection per document, chunks of every document go into
+a small, fixed number of collections (``chunks_shard_00`` ...), chosen by a hash
+of the user ID. A document is then a metadata partition of its shard: every
+query is prefiltered on ``user_id`` and ``document_id``. This keeps the number
+of HNSW indexes, open files and startup work constant as documents accumulate.
+
+Documents keep their logical collection name (``user_{user_id}_doc_{document_id}``)
+everywhere else (aliases, BM25 indexes); ``open_partition`` maps it to a shard.
+"""
+
+import logging
+import os
+import re
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD_COUNT = 16
+
+COLLECTION_NAME_PATTERN = re.compile(r"^user_(?P<user_id>.+)_doc_(?P<document_id>.+)$")
+
+
+def shard_for_user(user_id, shard_count=DEFAULT_SHARD_COUNT):
+    """Shard number holding a user's chunks (stable across processes, unlike hash())"""
+    return zlib.crc32(str(user_id).encode("utf-8")) % shard_count
+
+
+def shard_collection_name(user_id, shard_count=DEFAULT_SHARD_COUNT):
+    return f"chunks_shard_{shard_for_user(user_id, shard_count):02d}"
+
+
+def parse_collection_name(collection_name):
+    """(user_id, document_id) of a per-document collection name, or None if it isn't one"""
+    match = COLLECTION_NAME_PATTERN.match(collection_name)
+    if not match:
+        return None
+    return match.group("user_id"), match.group("document_id")
+
+
+class PartitionedVectorStore:
+    """One document's slice of a shard collection, exposing the vectorstore calls the API uses"""
+
+    def __init__(self, shard, user_id, document_id):
+        """
+        Args:
+            shard: langchain Chroma vectorstore of the shard collection
+            user_id: Owner of the document
+            document_id: Document whose chunks this partition holds
+        """
+        self.shard = shard
+        self.user_id = str(user_id)
+        self.document_id = str(document_id)
+
+    @property
+    def embeddings(self):
+        return self.shard.embeddings
+
+    def _where(self, filter=None):
+        clauses = [{"user_id": self.user_id}, {"document_id": self.document_id}]
+        if filter:
+            clauses.append(filter)
+        return {"$and": clauses}
+
+    # Chunk IDs are namespaced by user so identical IDs from different users never collide
+
+    def _to_stored(self, ids):
+        return [f"{self.user_id}/{chunk_id}" for chunk_id in ids]
+
+    def _from_stored(self, ids):
+        prefix = f"{self.user_id}/"
+        return [chunk_id[len(prefix):] if chunk_id.startswith(prefix) else chunk_id for chunk_id in ids]
+
+    def _partition_metadata(self, metadatas, count):
+        metadatas = [dict(metadata) for metadata in metadatas] if metadatas else [{} for _ in range(count)]
+        for metadata in metadatas:
+            metadata["user_id"] = self.user_id
+            metadata["document_id"] = self.document_id
+        return metadatas
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if ids is None:
+            ids = [f"{self.document_id}:{i}" for i in range(len(texts))]
+        self.shard.add_texts(
+            texts=texts,
+            metadatas=self._partition_metadata(metadatas, len(texts)),
+            ids=self._to_stored(ids)
+        )
+        return list(ids)
+
+    def update_metadata(self, ids, metadatas):
+        self.shard._collection.update(
+            ids=self._to_stored(ids),
+            metadatas=self._partition_metadata(metadatas, len(ids))
+        )
+
+    def get(self, ids=None, where=None, include=None, **kwargs):
+        include = include if include is not None else ["documents", "metadatas"]
+        result = self.shard._collection.get(
+            ids=self._to_stored(ids) if ids is not None else None,
+            where=self._where(where),
+            include=include
+        )
+        result["ids"] = self._from_stored(result["ids"])
+        return result
+
+    def delete(self, ids=None, **kwargs):
+        if ids:
+            self.shard._collection.delete(ids=self._to_stored(ids))
+
+    def delete_collection(self):
+        """Delete every chunk of the document (the shard itself stays)"""
+        self.shard._collection.delete(where=self._where())
+
+    def count(self):
+        return len(self.get(include=[])["ids"])
+
+    def persist(self):
+        """Chroma persists automatically"""
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.shard.similarity_search_with_score(query, k=k, filter=self._where(filter))
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.shard.similarity_search(query, k=k, filter=self._where(filter))
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return self.shard.similarity_search_by_vector(embedding, k=k, filter=self._where(filter))
+
+    def fetch_candidates(self, query_vector, fetch_k, filter=None):
+        """Nearest chunks with their vectors, for utils.mmr"""
+        results = self.shard._collection.query(
+            query_embeddings=[list(map(float, query_vector))],
+            n_results=fetch_k,
+            where=self._where(filter),
+            include=["documents", "metadatas", "embeddings"]
+        )
+        return results["documents"][0], results["metadatas"][0], np.asarray(results["embeddings"][0], dtype=np.float32)
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        from utils.mmr import mmr_search_by_vector
+        return mmr_search_by_vector(
+            self, self.embeddings.embed_query(query), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter
+        )
+
+
+def open_shard(shard_name, embedding_function, persist_directory="./chroma_db"):
+    from langchain_community.vectorstores import Chroma
+    from utils.numpy_store import chroma_settings
+    return Chroma(
+        collection_name=shard_name,
+        embedding_function=embedding_function,
+        persist_directory=persist_directory,
+        client_settings=chroma_settings()
+    )
+
+
+def open_partition(collection_name, embedding_function, persist_directory="./chroma_db", shard_count=DEFAULT_SHARD_COUNT):
+    """Open the shard partition standing in for a per-document collection name"""
+    parsed = parse_collection_name(collection_name)
+    if parsed is None:
+        raise ValueError(f"Not a per-document collection name: {collection_name}")
+    user_id, document_id = parsed
+    shard = open_shard(shard_collection_name(user_id, shard_count), embedding_function, persist_directory)
+    return PartitionedVectorStore(shard, user_id, document_id)
+
+
+def migrate_to_shards(persist_directory="./chroma_db", shard_count=DEFAULT_SHARD_COUNT, delete_source=False, dry_run=False):
+    """
+    Copy every per-document collection (Chroma or NumPy) into the shard collections.
+
+    Vectors are copied as stored, so nothing is re-embedded. Chunks already in a
+    shard are overwritten, which makes the migration safe to re-run.
+
+    Returns:
+        Dictionary with the number of documents and chunks migrated and documents skipped
+    """
+    import chromadb
+    from utils.numpy_store import NumpyVectorStore, chroma_settings, numpy_store_path
+
+    client = chromadb.PersistentClient(path=persist_directory, settings=chroma_settings())
+    stats = {"documents": 0, "chunks": 0, "skipped": 0}
+
+    sources = [collection.name for collection in client.list_collections() if parse_collection_name(collection.name)]
+    numpy_root = os.path.join(persist_directory, "numpy")
+    if os.path.isdir(numpy_root):
+        sources += [name for name in sorted(os.listdir(numpy_root)) if parse_collection_name(name) and name not in sources]
+
+    for collection_name in sources:
+        user_id, document_id = parse_collection_name(collection_name)
+        numpy_path = numpy_store_path(collection_name, persist_directory)
+
+        if NumpyVectorStore.exists(numpy_path):
+            store = NumpyVectorStore(numpy_path, embedding_function=None)
+            ids, texts, metadatas = store.ids, store.texts, store.metadatas
+            vectors = np.asarray(store.vectors).tolist() if store.vectors is not None else []
+        else:
+            stored = client.get_collection(collection_name).get(include=["documents", "metadatas", "embeddings"])
+            ids, texts, metadatas, vectors = stored["ids"], stored["documents"], stored["metadatas"], stored["embeddings"]
+
+        if not ids:
+            stats["skipped"] += 1
+            continue
+
+        stats["documents"] += 1
+        stats["chunks"] += len(ids)
+        if dry_run:
+            continue
+
+        shard = client.get_or_create_collection(shard_collection_name(user_id, shard_count))
+        metadatas = [dict(metadata or {}, user_id=str(user_id), document_id=str(document_id)) for metadata in metadatas]
+        for start in range(0, len(ids), 1000):
+            end = start + 1000
+            shard.upsert(
+                ids=[f"{user_id}/{chunk_id}" for chunk_id in ids[start:end]],
+                embeddings=[list(map(float, vector)) for vector in vectors[start:end]],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end]
+            )
+
+        if delete_source:
+            if NumpyVectorStore.exists(numpy_path):
+                store.delete_collection()
+            else:
+                client.delete_collection(collection_name)
+
+        logger.info(f"Migrated {collection_name} ({len(ids)} chunks) to {shard_collection_name(user_id, shard_count)}")
+
+    return stats
@@ -0,0 +1,146 @@
+"""
+Chunk-aligned slicing of large documents for upload.
+
+The API chunks each uploaded request on its own, so a document sent in fixed
+size pieces loses or duplicates the chunks that straddle the cuts. Here the
+client runs the API's own splitter once (cheap: no embedding) and cuts the text
+where a chunk starts a top-level piece (usually a paragraph), keeping the
+separator in front of it so the splitter sees identical pieces. Each slice also
+carries the whole piece the next slice starts with, so the API can tell where
+its last chunk ends; the API keeps only the chunks that start inside the
+slice's ``owned`` region. The chunks produced this way are the ones the whole
+text would have produced, and ``first_chunk`` numbers them the same way.
+"""
+
+import bisect
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# Chunking used by the RAG API (utils/RAG_pipeline.py)
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+
+
+def make_text_splitter(add_start_index=False):
+    """Splitter the API chunks documents with"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=SEPARATORS,
+        length_function=len,
+        add_start_index=add_start_index
+    )
+
+
+def slice_for_upload(text, max_chars=20000, splitter=None):
+    """
+    Cut text into slices of at most ``max_chars`` characters on chunk boundaries.
+
+    A slice only exceeds ``max_chars`` when no chunk boundary leaves room to cut
+    within the limit, e.g. inside a single paragraph longer than ``max_chars``.
+
+    Args:
+        text: Whole document text
+        max_chars: Largest slice sent in one request
+        splitter: Splitter to align with (defaults to the API's)
+
+    Returns:
+        List of dicts with the slice ``text``, its ``offset`` in the document,
+        ``owned`` (chunks starting at or after this position in the slice belong
+        to the next slice) and ``first_chunk`` (index of its first chunk)
+    """
+    splitter = splitter or make_text_splitter(add_start_index=True)
+    if len(text) <= max_chars:
+        return [{"text": text, "offset": 0, "owned": len(text), "first_chunk": 0}]
+
+    # The separator the splitter divides the whole text by first
+    separators = getattr(splitter, "_separators", SEPARATORS)
+    top = next((separator for separator in separators if separator and separator in text), "")
+    chunks = splitter.create_documents([text])
+    starts = [chunk.metadata["start_index"] for chunk in chunks]
+    ends = [start + len(chunk.page_content) for start, chunk in zip(starts, chunks)]
+
+    # Slices may only start at chunks that begin a top-level piece
+    boundaries = [i for i in range(1, len(starts)) if top and text.startswith(top, starts[i] - len(top))]
+
+    def piece_end(position):
+        end = text.find(top, position)
+        return len(text) if end == -1 else end
+
+    def slice_end(first, cut):
+        # Owned chunks may overlap the next slice; include them whole, plus the
+        # piece after them, which decides where the splitter closed them
+        owned_end = max(ends[first:cut] + [starts[cut]])
+        return piece_end(piece_end(owned_end) + len(top))
+
+    slices = []
+    first, offset = 0, 0
+    while True:
+        later = boundaries[bisect.bisect_right(boundaries, first):]
+        if not later or len(text) - offset <= max_chars:
+            slices.append({"text": text[offset:], "offset": offset, "owned": len(text) - offset, "first_chunk": first})
+            return slices
+
+        # Furthest boundary that keeps the slice within max_chars (slices only grow with the cut)
+        cut = later[0]
+        for i in later[1:]:
+            if slice_end(first, i) - offset > max_chars:
+                break
+            cut = i
+        end = slice_end(first, cut)
+        slices.append({
+            "text": text[offset:end],
+            "offset": offset,
+            "owned": starts[cut] - offset,
+            "first_chunk": first
+        })
+        first, offset = cut, starts[cut] - len(top)
+
+
+def iter_slices_for_upload(pieces, max_chars=20000, splitter=None, separator="\n"):
+    """
+    ``slice_for_upload`` over text that arrives in pieces, e.g. PDF pages.
+
+    The pieces are joined with ``separator``. Slices are cut from a buffer of
+    about twice ``max_chars``; the last slice of the buffer stays open until more
+    text (or the end) arrives, since the splitter may still extend its chunks. So
+    memory is bounded by the buffer, not by the document.
+
+    Args:
+        pieces: Iterable of text pieces, in document order
+        max_chars: Largest slice sent in one request
+        splitter: Splitter to align with (defaults to the API's)
+        separator: Text joining consecutive pieces
+
+    Yields:
+        Slices as returned by ``slice_for_upload``, with ``offset`` and
+        ``first_chunk`` counted from the start of the whole text
+    """
+    splitter = splitter or make_text_splitter(add_start_index=True)
+    buffer = ""
+    base_offset, base_chunk = 0, 0
+
+    def rebase(piece):
+        return dict(piece, offset=piece["offset"] + base_offset, first_chunk=piece["first_chunk"] + base_chunk)
+
+    for text in pieces:
+        if not text:
+            continue
+        buffer = f"{buffer}{separator}{text}" if buffer else text
+        if len(buffer) < 2 * max_chars:
+            continue
+
+        slices = slice_for_upload(buffer, max_chars=max_chars, splitter=splitter)
+        if len(slices) < 2:
+            continue
+        for piece in slices[:-1]:
+            yield rebase(piece)
+        last = slices[-1]
+        base_offset += last["offset"]
+        base_chunk += last["first_chunk"]
+        buffer = buffer[last["offset"]:]
+
+    if buffer:
+        for piece in slice_for_upload(buffer, max_chars=max_chars, splitter=splitter):
+            yield rebase(piece)
@@ -0,0 +1,175 @@
+"""
+Compressed transport between the Django app and the RAG API.
+
+Both sides advertise what they can decode (the API in its /healthcheck
+response, the client in Accept / Accept-Encoding headers) and fall back to
+plain JSON when the other side doesn't know about compression. Bodies are
+compressed with zstd when the ``zstandard`` package is installed and with gzip
+otherwise; structured payloads can be sent as msgpack when ``msgpack`` is
+installed. Small bodies are sent as they are, since compressing them costs
+more than it saves.
+"""
+
+import gzip
+import io
+import json
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+
+MIN_COMPRESS_BYTES = 1024  # Bodies smaller than this are not compressed
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def supported_encodings():
+    """Content encodings this process can read and write, preferred first"""
+    return (["zstd"] if zstandard else []) + ["gzip"]
+
+
+def supported_formats():
+    """Body formats this process can read and write, preferred first"""
+    return ([MSGPACK_TYPE] if msgpack else []) + [JSON_TYPE]
+
+
+def capabilities():
+    """What this process accepts, as advertised to the other side"""
+    return {"encodings": supported_encodings(), "formats": supported_formats()}
+
+
+def negotiate(offered, supported):
+    """
+    Pick the first of our supported values the other side offered.
+
+    Args:
+        offered: Header value (e.g. "gzip, zstd;q=0.5") or list of values
+        supported: Our values, preferred first
+
+    Returns:
+        The chosen value, or None if there is nothing in common
+    """
+    if isinstance(offered, str):
+        tokens = set()
+        for part in offered.split(","):
+            value, _, params = part.strip().partition(";")
+            if params.replace(" ", "") in ("q=0", "q=0.0"):
+                continue
+            tokens.add(value.strip().lower())
+        offered = tokens
+    return next((value for value in supported if value in offered), None)
+
+
+def compress(data, encoding):
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    if encoding == "zstd" and zstandard:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def decompress(data, encoding):
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "zstd" and zstandard:
+        # Streaming reader: frames written without a content size are allowed
+        return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def serialize(payload, content_type=JSON_TYPE):
+    if content_type == MSGPACK_TYPE and msgpack:
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload).encode("utf-8")
+
+
+def deserialize(data, content_type=JSON_TYPE):
+    if content_type == MSGPACK_TYPE and msgpack:
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def encode_body(payload, content_type=JSON_TYPE, encoding=None, min_size=MIN_COMPRESS_BYTES):
+    """
+    Serialize (and compress, if worthwhile) a request body.
+
+    Returns:
+        Tuple of (body bytes, headers to send with it)
+    """
+    body = serialize(payload, content_type)
+    headers = {"Content-Type": content_type}
+    if encoding and len(body) >= min_size:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return body, headers
+
+
+def encode_response(json_body, accept="", accept_encoding="", min_size=MIN_COMPRESS_BYTES):
+    """
+    Re-encode a JSON response body for a client's Accept and Accept-Encoding headers.
+
+    Returns:
+        Tuple of (body bytes, headers), or None to send the JSON body unchanged
+    """
+    use_msgpack = msgpack is not None and negotiate(accept or "", [MSGPACK_TYPE]) is not None
+    encoding = negotiate(accept_encoding or "", supported_encodings()) if len(json_body) >= min_size else None
+    if not use_msgpack and not encoding:
+        return None
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    body = json_body
+    if use_msgpack:
+        body = serialize(json.loads(json_body), MSGPACK_TYPE)
+        headers["Content-Type"] = MSGPACK_TYPE
+    if encoding:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return body, headers
+
+
+class DecodingMiddleware:
+    """
+    WSGI middleware turning compressed and msgpack request bodies into plain JSON.
+
+    Endpoints keep reading ``request.json`` and never see the wire format.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+        content_type = environ.get("CONTENT_TYPE", "").split(";")[0].strip()
+        if encoding in ("", "identity") and content_type != MSGPACK_TYPE:
+            return self.app(environ, start_response)
+
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            body = environ["wsgi.input"].read(length) if length else environ["wsgi.input"].read()
+            if encoding not in ("", "identity"):
+                body = decompress(body, encoding)
+            if content_type == MSGPACK_TYPE:
+                body = json.dumps(deserialize(body, MSGPACK_TYPE)).encode("utf-8")
+                environ["CONTENT_TYPE"] = JSON_TYPE
+        except Exception as e:
+            logger.warning(f"Could not decode {encoding or content_type} request body: {str(e)}")
+            error = json.dumps({"error": f"Could not decode request body: {str(e)}"}).encode("utf-8")
+            start_response("400 BAD REQUEST", [("Content-Type", JSON_TYPE), ("Content-Length", str(len(error)))])
+            return [error]
+
+        environ["wsgi.input"] = io.BytesIO(body)
+        environ["CONTENT_LENGTH"] = str(len(body))
+        environ.pop("HTTP_CONTENT_ENCODING", None)
+        return self.app(environ, start_response)